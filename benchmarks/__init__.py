@@ -0,0 +1,64 @@
+"""Offline storefront benchmarks.
+
+Each module is runnable with ``python -m benchmarks.<name>`` from the project
+root. They run against Django's throwaway test database (never db.sqlite3),
+so they are safe to run on a development checkout.
+"""
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings')
+    import django
+
+    django.setup()
+
+
+@contextmanager
+def benchmark_database(verbosity=0):
+    """Create and migrate the test database for the duration of the block.
+
+    Test mirrors of the default database (the read replica) are pointed at
+    it too, as the test runner does.
+    """
+    from django.db import connection, connections
+
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    mirrors = [alias for alias in connections if connections[alias].settings_dict['TEST'].get('MIRROR') == connection.alias]
+    for alias in mirrors:
+        connections[alias].close()
+        connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+    try:
+        yield connection
+    finally:
+        for alias in mirrors:
+            connections[alias].close()
+            connections[alias].settings_dict['NAME'] = old_name
+        connection.creation.destroy_test_db(old_name, verbosity)
+
+
+def timed(func, repeat):
+    """Run ``func`` ``repeat`` times, returning per-call latencies in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        'p50': round(pick(0.50), 3),
+        'p95': round(pick(0.95), 3),
+        'p99': round(pick(0.99), 3),
+        'mean': round(statistics.fmean(ordered), 3),
+    }
@@ -0,0 +1,64 @@
+"""Latency and query counts of the big admin changelists.
+
+    python -m benchmarks.admin_changelists --orders 300000
+
+Opens the Order, OrderItem and Product changelists as a superuser, the
+first and a deep page, unfiltered, filtered and searched, ``--repeat``
+times each. With the default 300k orders of 1-5 lines the OrderItem table
+holds about 900k rows.
+"""
+import argparse
+import json
+
+from benchmarks import benchmark_database, percentiles, setup_django, timed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--orders', type=int, default=300000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext, override_settings
+    from django.urls import reverse
+
+    from benchmarks.catalog import generate_catalog
+    from shop.models import OrderItem
+
+    with benchmark_database(), override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+        generate_catalog(categories=50, products=args.products, orders=args.orders)
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        client = Client()
+        client.force_login(User.objects.get(username='admin'))
+        orders = reverse('admin:shop_order_changelist')
+        items = reverse('admin:shop_orderitem_changelist')
+        products = reverse('admin:shop_product_changelist')
+        pages = {
+            'orderitem': items,
+            'orderitem_page_2000': f'{items}?p=2000',
+            'orderitem_search': f'{items}?q=Tai',
+            'order': orders,
+            'order_filtered': f'{orders}?status__exact=ship',
+            'order_search_phone': f'{orders}?q=0900012',
+            'product': products,
+            'product_search': f'{products}?q=tai nghe',
+        }
+        report = {'config': vars(args), 'orderitem_rows': OrderItem.objects.count()}
+        for name, url in pages.items():
+            assert client.get(url).status_code == 200, url
+            with CaptureQueriesContext(connection) as queries:
+                client.get(url)
+            report[name] = {
+                'queries': len(queries.captured_queries),
+                'ms': percentiles(timed(lambda: client.get(url), args.repeat)),
+            }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
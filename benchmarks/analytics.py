@@ -0,0 +1,62 @@
+"""Time the sales-rollup backfill and a year-long dashboard against scanning orders.
+
+    python -m benchmarks.analytics --orders 100000
+"""
+import argparse
+import json
+import time
+from datetime import timedelta
+
+from benchmarks import benchmark_database, percentiles, setup_django, timed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.db import connection
+    from django.db.models import Count, Sum
+    from django.utils import timezone
+
+    from benchmarks.catalog import generate_catalog
+    from shop.analytics import rebuild_rollups, sales_summary
+    from shop.models import Order, OrderItem, SalesRollup
+
+    with benchmark_database():
+        generate_catalog(categories=50, products=args.products, orders=args.orders)
+        # Spread the orders over the last year, newest last.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {Order._meta.db_table} SET created_at = '
+                f"datetime('now', '-' || ((%s - id) * 31536 / %s) || ' seconds')",
+                [args.orders, args.orders // 1000 or 1],
+            )
+        started = time.perf_counter()
+        rows = rebuild_rollups()
+        backfill_seconds = time.perf_counter() - started
+
+        end = timezone.now()
+        start = end - timedelta(days=365)
+
+        def scan():
+            items = OrderItem.objects.filter(order__created_at__gte=start).exclude(order__status='cancel')
+            list(items.values('product_id').annotate(total=Sum('line_total')).order_by('-total')[:10])
+            list(Order.objects.filter(created_at__gte=start).values('status').annotate(count=Count('pk')))
+
+        print(json.dumps({
+            'orders': args.orders,
+            'order_items': OrderItem.objects.count(),
+            'rollup_rows': rows,
+            'sales_rollup_rows': SalesRollup.objects.count(),
+            'backfill_seconds': round(backfill_seconds, 2),
+            'year_dashboard_ms': percentiles(timed(lambda: sales_summary(start, end), args.repeat)),
+            'year_scan_ms': percentiles(timed(scan, max(1, args.repeat // 4))),
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
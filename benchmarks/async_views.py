@@ -0,0 +1,135 @@
+"""Compare the sync (WSGI) and async (ASGI) storefront views under concurrency.
+
+    python -m benchmarks.async_views --concurrency 16 --rounds 20
+    python -m benchmarks.async_views --cold     # clear the region cache every round
+
+Each round fires ``--concurrency`` simultaneous requests per scenario: from
+a thread pool through the sync handler, and from one event loop through the
+async handler with ``shop.async_views`` routed in. Reports per-request
+p50/p95/p99 and requests per second for both paths.
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.urls import include, path
+
+from benchmarks import benchmark_database, percentiles, setup_django
+
+# Used as ROOT_URLCONF for the async pass: the async views shadow the sync
+# ones, everything else resolves through the project urls.
+urlpatterns = []
+
+
+def _async_urlpatterns():
+    from shop import async_views
+
+    return [
+        path('', async_views.home_view, name='home'),
+        path('products.json', async_views.product_list_json, name='product_list_json'),
+        path('product/<slug:slug>/', async_views.product_detail_view, name='product_detail'),
+        path('', include('ecommerce.urls')),
+    ]
+
+
+def scenarios():
+    from shop.models import Category, Product
+
+    product = Product.objects.filter(is_active=True).order_by('pk').first()
+    category = Category.objects.order_by('pk').first()
+    return {
+        'home': ('/', {}),
+        'home_category': ('/', {'cat': category.slug}),
+        'home_search': ('/', {'q': 'dien thoai'}),
+        'product_list_json': ('/products.json', {}),
+        'product_detail': (f'/product/{product.slug}/', {}),
+    }
+
+
+def run_sync(targets, concurrency, rounds, cold):
+    from django.core.cache import cache
+    from django.test import Client
+
+    def fetch(target):
+        url, data = target
+        started = time.perf_counter()
+        response = Client().get(url, data)
+        assert response.status_code == 200, (url, response.status_code)
+        return (time.perf_counter() - started) * 1000
+
+    samples = {name: [] for name in targets}
+    elapsed = 0.0
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(rounds):
+            for name, target in targets.items():
+                if cold:
+                    cache.clear()
+                started = time.perf_counter()
+                samples[name].extend(pool.map(fetch, [target] * concurrency))
+                elapsed += time.perf_counter() - started
+    return samples, elapsed
+
+
+def run_async(targets, concurrency, rounds, cold):
+    from django.core.cache import cache
+    from django.test import AsyncClient
+
+    async def fetch(target):
+        url, data = target
+        started = time.perf_counter()
+        response = await AsyncClient().get(url, data)
+        assert response.status_code == 200, (url, response.status_code)
+        return (time.perf_counter() - started) * 1000
+
+    async def main():
+        samples = {name: [] for name in targets}
+        elapsed = 0.0
+        for _ in range(rounds):
+            for name, target in targets.items():
+                if cold:
+                    cache.clear()
+                started = time.perf_counter()
+                samples[name].extend(await asyncio.gather(*(fetch(target) for _ in range(concurrency))))
+                elapsed += time.perf_counter() - started
+        return samples, elapsed
+
+    return asyncio.run(main())
+
+
+def summarize(samples, elapsed):
+    total = sum(len(values) for values in samples.values())
+    return {
+        'throughput_rps': round(total / elapsed, 1),
+        'views': {name: percentiles(values) for name, values in samples.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--categories', type=int, default=30)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--cold', action='store_true', help='Clear the region cache before every round.')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.test.utils import override_settings
+
+    from benchmarks.catalog import generate_catalog
+
+    urlpatterns.extend(_async_urlpatterns())
+    with benchmark_database(), override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+        generate_catalog(categories=args.categories, products=args.products, flash_sales=40, banners=8)
+        targets = scenarios()
+        report = {'config': vars(args)}
+        report['sync'] = summarize(*run_sync(targets, args.concurrency, args.rounds, args.cold))
+        with override_settings(ROOT_URLCONF=__name__):
+            report['async'] = summarize(*run_async(targets, args.concurrency, args.rounds, args.cold))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
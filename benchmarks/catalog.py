@@ -0,0 +1,94 @@
+"""Synthetic catalog generator for benchmarks."""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+WORDS = (
+    'điện thoại', 'máy tính', 'tai nghe', 'ốp lưng', 'sạc dự phòng', 'bàn phím', 'chuột',
+    'áo thun', 'quần jean', 'giày thể thao', 'đồng hồ', 'balo', 'nồi cơm điện', 'quạt',
+    'son môi', 'kem chống nắng', 'sách', 'đèn ngủ', 'bình nước', 'loa bluetooth',
+)
+ADJECTIVES = ('cao cấp', 'giá rẻ', 'chính hãng', 'mới', 'siêu bền', 'chống nước', 'không dây', 'mini')
+COLORS = ('Đỏ', 'Xanh', 'Đen', 'Trắng', 'Vàng', 'Hồng', 'Tím', 'Xám')
+BATCH_SIZE = 2000
+
+
+def generate_catalog(categories=20, products=1000, flash_sales=0, banners=0, orders=0, seed=0):
+    """Bulk-create a reproducible synthetic storefront.
+
+    ``flash_sales`` products get a flash price: about two thirds running now,
+    the rest opening within the hour. ``orders`` orders of 1-5 random lines
+    are imported without touching stock. bulk_create skips model signals, so
+    the search index and related products are rebuilt at the end. Returns
+    the created categories.
+    """
+    from django.utils import timezone
+
+    from shop import search
+    from shop.related import rebuild_related
+    from shop.models import Banner, Category, Order, Product
+    from shop.orders import import_orders
+
+    rng = random.Random(seed)
+    now = timezone.now()
+    cats = Category.objects.bulk_create(
+        Category(name=f'Danh mục {i}', slug=f'danh-muc-{i}') for i in range(categories)
+    )
+    flash_indexes = set(rng.sample(range(products), min(flash_sales, products)))
+    batch = []
+    for i in range(products):
+        word = rng.choice(WORDS)
+        adjective = rng.choice(ADJECTIVES)
+        price = Decimal(rng.randrange(10, 5000) * 1000)
+        product = Product(
+            category=rng.choice(cats) if cats else None,
+            name=f'{word.capitalize()} {adjective} {i}',
+            slug=f'san-pham-{i}',
+            price=price,
+            stock=rng.randrange(0, 200),
+            description=f'{word} {adjective}, bảo hành {rng.randrange(1, 24)} tháng. {rng.choice(WORDS)} đi kèm.',
+            color_options=', '.join(rng.sample(COLORS, 3)),
+            specifications=f'Trọng lượng: {rng.randrange(100, 3000)}g\nXuất xứ: Việt Nam',
+            image_url=f'https://img.example/{i}.png' if rng.random() < 0.8 else '',
+            is_hot=rng.random() < 0.05,
+            is_best_seller=rng.random() < 0.05,
+        )
+        if i in flash_indexes:
+            start = now + timedelta(minutes=rng.randrange(-120, 60))
+            product.flash_sale_price = (price * Decimal(rng.randrange(50, 95)) / 100).quantize(Decimal('1000'))
+            product.flash_sale_start = start
+            product.flash_sale_end = start + timedelta(hours=rng.randrange(3, 6))
+            product.flash_sale_stock = rng.choice((0, 20, 50))
+        product.refresh_pricing(now)
+        batch.append(product)
+        if len(batch) >= BATCH_SIZE:
+            Product.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Product.objects.bulk_create(batch)
+
+    Banner.objects.bulk_create(
+        Banner(title=f'Banner {i}', image_url=f'https://img.example/banner-{i}.png',
+               is_featured=i < 5, discount_info=f'Giảm {rng.randrange(10, 60)}%', order=i)
+        for i in range(banners)
+    )
+
+    if orders:
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+        statuses = [code for code, _ in Order.STATUS_CHOICES]
+        for offset in range(0, orders, BATCH_SIZE):
+            import_orders([
+                {
+                    'customer_name': f'Khách {n}',
+                    'phone': f'09{n:08d}',
+                    'address': 'Hà Nội',
+                    'payment_method': rng.choice(('cod', 'bank')),
+                    'status': rng.choice(statuses),
+                    'items': [(pid, rng.randrange(1, 4)) for pid in rng.sample(product_ids, rng.randrange(1, 6))],
+                }
+                for n in range(offset, min(orders, offset + BATCH_SIZE))
+            ])
+
+    search.rebuild_index()
+    rebuild_related()
+    return cats
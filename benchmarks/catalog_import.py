@@ -0,0 +1,60 @@
+"""Time the bulk catalog import: a fresh 200k-row CSV, then re-importing it as updates.
+
+    python -m benchmarks.catalog_import --rows 200000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+
+from benchmarks import benchmark_database, setup_django
+from benchmarks.catalog import ADJECTIVES, COLORS, WORDS
+
+
+def write_csv(path, rows, categories, seed=0, slugs=False):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['name', 'slug', 'category', 'price', 'stock', 'description', 'color_options'])
+        for i in range(rows):
+            word = rng.choice(WORDS)
+            # Names repeat on purpose so slugs collide and need suffixes.
+            name = f'{word.capitalize()} {rng.choice(ADJECTIVES)} {i % (rows // 4 or 1)}'
+            writer.writerow([
+                name, f'sp-{i}' if slugs else '', f'Danh mục {rng.randrange(categories)}',
+                rng.randrange(10, 5000) * 1000, rng.randrange(0, 200),
+                f'{word}, bảo hành {rng.randrange(1, 24)} tháng.', ', '.join(rng.sample(COLORS, 3)),
+            ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from shop.imports import import_catalog
+
+    results = {'rows': args.rows, 'batch_size': args.batch_size}
+    with benchmark_database(), tempfile.TemporaryDirectory() as directory:
+        for label, slugs in (('create', False), ('create_with_slugs', True), ('update', True)):
+            path = os.path.join(directory, f'{label}.csv')
+            write_csv(path, args.rows, args.categories, slugs=slugs, seed=1 if label == 'update' else 0)
+            with open(path, encoding='utf-8', newline='') as file:
+                report = import_catalog(file, 'csv', batch_size=args.batch_size)
+            results[label] = {
+                'created': report.created,
+                'updated': report.updated,
+                'rejected': report.error_count,
+                'seconds': round(report.seconds, 2),
+                'rows_per_second': report.rows_per_second,
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Storefront reads against concurrent checkouts, stock vs tuned SQLite.
+
+    python -m benchmarks.db_contention --writers 4 --readers 8 --seconds 10
+
+For ``--seconds`` per mode, ``--writers`` threads place orders through
+``shop.orders.create_order`` (a stock reservation, an order and its items,
+a catalog version bump) while ``--readers`` threads request the home page,
+``products.json`` and product pages through the test client. Every order
+invalidates the cached regions, so the readers keep hitting the database.
+
+``stock`` is Django's SQLite defaults: rollback journal, no pragmas,
+everything on one alias. ``tuned`` is ``shop.db.sqlite_databases`` as
+configured in settings: WAL, the pragmas and storefront reads on the
+read-only replica.
+Reports checkouts and reads per second, latency percentiles and how many
+operations failed with "database is locked".
+"""
+import argparse
+import json
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from benchmarks import benchmark_database, percentiles, setup_django
+
+CUSTOMER = {'customer_name': 'Khách', 'phone': '0900000000', 'address': 'Hà Nội'}
+
+
+def _stock_mode(databases):
+    """Strip the tuning from the primary; returns a function restoring it."""
+    from django.db import connections
+
+    primary = databases['default']
+    saved = primary['OPTIONS']
+    connections.close_all()
+    primary['OPTIONS'] = {}
+    with sqlite3.connect(primary['NAME']) as db:
+        db.execute('PRAGMA journal_mode = DELETE')
+
+    def restore():
+        connections.close_all()
+        primary['OPTIONS'] = saved
+    return restore
+
+
+def _run(duration, writers, readers, product_ids, paths, seed):
+    from django.db import OperationalError, connections
+    from django.test import Client
+
+    from shop.db import is_busy
+    from shop.inventory import InsufficientStock
+    from shop.models import Order
+    from shop.orders import create_order, quote_cart
+
+    stop = time.perf_counter() + duration
+    lock = threading.Lock()
+    checkouts, reads = [], []
+    errors = Counter()
+
+    def record(samples, started, error=None):
+        with lock:
+            if error is None:
+                samples.append((time.perf_counter() - started) * 1000)
+            else:
+                errors[error] += 1
+
+    def failure(exc):
+        return 'locked' if is_busy(exc) else type(exc).__name__
+
+    def writer(rng):
+        try:
+            while time.perf_counter() < stop:
+                cart = {str(pid): rng.randint(1, 2) for pid in rng.sample(product_ids, rng.randint(1, 3))}
+                started = time.perf_counter()
+                try:
+                    items, _ = quote_cart(cart)
+                    create_order(Order(**CUSTOMER), items)
+                except (OperationalError, InsufficientStock) as exc:
+                    record(checkouts, started, f'checkout {failure(exc)}')
+                else:
+                    record(checkouts, started)
+        finally:
+            connections.close_all()
+
+    def reader(rng):
+        client = Client()
+        try:
+            while time.perf_counter() < stop:
+                started = time.perf_counter()
+                try:
+                    response = client.get(rng.choice(paths))
+                except OperationalError as exc:
+                    record(reads, started, f'read {failure(exc)}')
+                    continue
+                if response.status_code == 200:
+                    record(reads, started)
+                else:
+                    record(reads, started, f'read HTTP {response.status_code}')
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=writer, args=(random.Random(seed + i),)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(random.Random(seed + 1000 + i),)) for i in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    with connections['default'].cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        journal_mode = cursor.fetchone()[0]
+    return {
+        'journal_mode': journal_mode,
+        'checkouts_per_second': round(len(checkouts) / elapsed, 1),
+        'checkout_ms': percentiles(checkouts) if checkouts else None,
+        'reads_per_second': round(len(reads) / elapsed, 1),
+        'read_ms': percentiles(reads) if reads else None,
+        'errors': dict(errors),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--categories', type=int, default=30)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.core.cache import cache
+    from django.db import connections
+    from django.test.utils import override_settings
+    from django.urls import reverse
+
+    from benchmarks.catalog import generate_catalog
+    from shop.models import Category, Product
+
+    report = {'config': vars(args)}
+    with benchmark_database(), override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+        generate_catalog(categories=args.categories, products=args.products, flash_sales=40, banners=8)
+        Product.objects.update(stock=10 ** 9)
+        product_ids = list(Product.objects.filter(is_active=True).values_list('pk', flat=True))
+        slugs = list(Product.objects.order_by('?').values_list('slug', flat=True)[:200])
+        category = Category.objects.order_by('pk').first()
+        paths = [reverse('home'), f'{reverse("home")}?cat={category.slug}', reverse('product_list_json')]
+        paths += [reverse('product_detail', args=[slug]) for slug in slugs]
+
+        restore = _stock_mode(connections.settings)
+        try:
+            with override_settings(DATABASE_ROUTERS=[]):
+                cache.clear()
+                report['stock'] = _run(args.seconds, args.writers, args.readers, product_ids, paths, args.seed)
+        finally:
+            restore()
+        cache.clear()
+        report['tuned'] = _run(args.seconds, args.writers, args.readers, product_ids, paths, args.seed)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
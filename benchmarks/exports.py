@@ -0,0 +1,64 @@
+"""Peak memory and throughput of the streaming order export vs loading everything.
+
+    python -m benchmarks.exports --orders 50000
+
+The streaming peak is reached after two chunks (one chunk in hand while the
+next one's items are prefetched) and stays there however many orders
+follow; loading everything grows with the table.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from benchmarks import benchmark_database, setup_django
+
+
+def measure(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    lines = func()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'lines': lines, 'seconds': round(seconds, 2), 'peak_kib': round(peak / 1024, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=50000)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from benchmarks.catalog import generate_catalog
+    from shop.exports import CHUNK_SIZE, Export
+    from shop.models import Order
+
+    def stream(fmt, limit=None):
+        def run():
+            export = Export('orders', fmt)
+            count = 0
+            for count, _ in enumerate(export, 1):
+                if limit is not None and export.count >= limit:
+                    break
+            return count
+        return run
+
+    def load_all():
+        orders = list(Order.objects.prefetch_related('items'))
+        return sum(len(order.items.all()) for order in orders)
+
+    with benchmark_database():
+        generate_catalog(categories=20, products=args.products, orders=args.orders)
+        print(json.dumps({
+            'orders': args.orders,
+            'csv_two_chunks': measure(stream('csv', 2 * CHUNK_SIZE)),
+            'csv': measure(stream('csv')),
+            'jsonl': measure(stream('jsonl')),
+            'load_all': measure(load_all),
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
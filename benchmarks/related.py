@@ -0,0 +1,42 @@
+"""Time the full related-products rebuild and the per-product page read.
+
+    python -m benchmarks.related --products 100000 --orders 20000
+"""
+import argparse
+import json
+import time
+
+from benchmarks import benchmark_database, percentiles, setup_django, timed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from benchmarks.catalog import generate_catalog
+    from shop.models import Product
+    from shop.related import rebuild_related, refresh_related, related_products
+
+    with benchmark_database():
+        generate_catalog(categories=50, products=args.products, orders=args.orders)
+        started = time.perf_counter()
+        rows = rebuild_related()
+        rebuild_seconds = time.perf_counter() - started
+
+        product = Product.objects.order_by('pk').first()
+        print(json.dumps({
+            'products': args.products,
+            'orders': args.orders,
+            'rows': rows,
+            'rebuild_seconds': round(rebuild_seconds, 2),
+            'refresh_one_ms': percentiles(timed(lambda: refresh_related([product.pk]), args.repeat)),
+            'read_ms': percentiles(timed(lambda: list(related_products(product)), args.repeat)),
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Compare FTS5 search latency against the old icontains scan.
+
+    python -m benchmarks.search --products 100000
+"""
+import argparse
+import json
+
+from benchmarks import benchmark_database, percentiles, setup_django, timed
+
+QUERIES = ('dien thoai', 'tai', 'ốp lưng chính hãng', 'balo chong nuoc', 'sạc', 'không dây mini')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.db.models import Q
+
+    from benchmarks.catalog import generate_catalog
+    from shop import search
+    from shop.models import Product
+    from shop.views import PRODUCTS_PER_PAGE
+
+    def legacy(qs, query):
+        return qs.filter(Q(name__icontains=query) | Q(description__icontains=query)).order_by('-created_at')
+
+    with benchmark_database():
+        generate_catalog(categories=50, products=args.products)
+        base = Product.objects.filter(is_active=True)
+        report = {'products': args.products, 'queries': {}}
+        for query in QUERIES:
+            row = {}
+            for label, build in (('fts5', search.search_products), ('icontains', legacy)):
+                qs = build(base, query)
+
+                def first_page(qs=qs):
+                    qs.count()
+                    list(qs[:PRODUCTS_PER_PAGE])
+
+                row[label] = {'hits': qs.count(), **percentiles(timed(first_page, args.repeat))}
+            report['queries'][query] = row
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
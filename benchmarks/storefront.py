@@ -0,0 +1,242 @@
+"""Storefront view benchmarks: latency percentiles, query counts, allocations.
+
+    python -m benchmarks.storefront                   # print a report
+    python -m benchmarks.storefront --write-baseline  # refresh benchmarks/baseline.json
+    python -m benchmarks.storefront --compare         # diff against the baseline, exit 1 on regression
+    python -m benchmarks.storefront --processes 4     # also drive the WSGI app from 4 processes
+
+Runs fully offline against a throwaway SQLite database populated by
+``benchmarks.catalog``. Single-process numbers go through Django's test
+client; the multi-process mode calls the real WSGI application.
+"""
+import argparse
+import json
+import multiprocessing
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks import benchmark_database, percentiles, setup_django
+
+BASELINE_PATH = Path(__file__).with_name('baseline.json')
+CHECKOUT_DATA = {'customer_name': 'Khách', 'phone': '0900000000', 'address': 'Hà Nội', 'payment_method': 'cod'}
+# Latency noise floor: smaller p50 differences are never reported.
+MIN_LATENCY_DELTA_MS = 2.0
+# Scenarios the multi-process mode drives through the WSGI app (GET only).
+WSGI_SCENARIOS = ('home', 'home_category', 'home_search', 'product_detail')
+
+
+class Scenario:
+    def __init__(self, name, method, path, data=None, prepare=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.prepare = prepare
+
+    def run(self, client):
+        response = getattr(client, self.method)(self.path, self.data or {})
+        if response.status_code >= 400:
+            raise RuntimeError(f'{self.name}: HTTP {response.status_code}')
+        return response
+
+
+def build_scenarios():
+    from django.urls import reverse
+
+    from shop.models import Category, Product
+
+    product = Product.objects.filter(is_active=True, stock__gt=0).order_by('pk').first()
+    cart_products = list(Product.objects.filter(is_active=True, stock__gt=0).order_by('pk')[:3])
+    category = Category.objects.order_by('pk').first()
+    add_url = reverse('add_to_cart', args=[product.pk])
+
+    def fill_cart(client):
+        for p in cart_products:
+            client.post(reverse('add_to_cart', args=[p.pk]), {'qty': 1})
+
+    return [
+        Scenario('home', 'get', reverse('home')),
+        Scenario('home_category', 'get', reverse('home'), {'cat': category.slug}),
+        Scenario('home_search', 'get', reverse('home'), {'q': 'dien thoai'}),
+        Scenario('product_list_json', 'get', reverse('product_list_json')),
+        Scenario('product_detail', 'get', reverse('product_detail', args=[product.slug])),
+        Scenario('add_to_cart', 'post', add_url, {'qty': 1}),
+        Scenario('cart_view', 'get', reverse('cart_view'), prepare=fill_cart),
+        Scenario('checkout', 'get', reverse('checkout'), prepare=fill_cart),
+        Scenario('checkout_submit', 'post', reverse('checkout'), CHECKOUT_DATA, prepare=fill_cart),
+    ]
+
+
+def measure(scenario, repeat, warmup=3):
+    from contextlib import ExitStack
+
+    from django.db import connections
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    client = Client()
+    for _ in range(warmup):
+        if scenario.prepare:
+            scenario.prepare(client)
+        scenario.run(client)
+
+    latencies = []
+    queries = []
+    for _ in range(repeat):
+        if scenario.prepare:
+            scenario.prepare(client)
+        # Storefront reads go to the replica connection: count every alias.
+        with ExitStack() as stack:
+            contexts = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            started = time.perf_counter()
+            scenario.run(client)
+            latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(sum(len(ctx.captured_queries) for ctx in contexts))
+
+    if scenario.prepare:
+        scenario.prepare(client)
+    tracemalloc.start()
+    scenario.run(client)
+    _, peak = tracemalloc.get_traced_memory()
+    blocks = len(tracemalloc.take_snapshot().traces)
+    tracemalloc.stop()
+
+    return {
+        **percentiles(latencies),
+        'queries': int(statistics.median(queries)),
+        'max_queries': max(queries),
+        'alloc_peak_kib': round(peak / 1024, 1),
+        'alloc_blocks': blocks,
+        'requests': repeat,
+    }
+
+
+def _wsgi_worker(args):
+    names, requests, seed = args
+    import random
+
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.db import connections
+    from django.test import RequestFactory
+
+    connections.close_all()
+    application = WSGIHandler()
+    factory = RequestFactory()
+    scenarios = {s.name: s for s in build_scenarios() if s.name in names}
+    rng = random.Random(seed)
+    samples = {name: [] for name in scenarios}
+
+    def start_response(status, headers):
+        if int(status.split()[0]) >= 400:
+            raise RuntimeError(status)
+
+    for _ in range(requests):
+        scenario = scenarios[rng.choice(names)]
+        environ = factory.get(scenario.path, scenario.data or {}).environ
+        started = time.perf_counter()
+        body = application(environ, start_response)
+        b''.join(body)
+        body.close()
+        samples[scenario.name].append((time.perf_counter() - started) * 1000)
+    connections.close_all()
+    return samples
+
+
+def measure_wsgi(processes, requests):
+    from django.db import connections
+
+    connections.close_all()
+    names = list(WSGI_SCENARIOS)
+    jobs = [(names, requests, seed) for seed in range(processes)]
+    started = time.perf_counter()
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        results = pool.map(_wsgi_worker, jobs)
+    elapsed = time.perf_counter() - started
+    merged = {name: [] for name in names}
+    for samples in results:
+        for name, values in samples.items():
+            merged[name].extend(values)
+    return {
+        'processes': processes,
+        'requests': processes * requests,
+        'throughput_rps': round(processes * requests / elapsed, 1),
+        'views': {name: percentiles(values) for name, values in merged.items() if values},
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return a list of human-readable regressions of ``report`` vs ``baseline``."""
+    regressions = []
+    for name, old in baseline['views'].items():
+        new = report['views'].get(name)
+        if new is None:
+            regressions.append(f'{name}: missing from this run')
+            continue
+        if new['queries'] > old['queries']:
+            regressions.append(f"{name}: queries {old['queries']} -> {new['queries']}")
+        if new['p50'] > old['p50'] * (1 + tolerance) and new['p50'] - old['p50'] > MIN_LATENCY_DELTA_MS:
+            regressions.append(f"{name}: p50 {old['p50']}ms -> {new['p50']}ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--categories', type=int, default=30)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--flash-sales', type=int, default=40)
+    parser.add_argument('--banners', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Also drive the WSGI app from this many processes.')
+    parser.add_argument('--wsgi-requests', type=int, default=200, help='Requests per process.')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--write-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=1.0,
+                        help='Allowed relative p50 slowdown before --compare fails (default 1.0, i.e. 2x). '
+                             'Query counts must never increase.')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.core.cache import cache
+    from django.test.utils import override_settings
+
+    from benchmarks.catalog import generate_catalog
+
+    config = {
+        'categories': args.categories, 'products': args.products, 'flash_sales': args.flash_sales,
+        'banners': args.banners, 'orders': args.orders, 'repeat': args.repeat, 'seed': args.seed,
+    }
+    with benchmark_database(), override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+        cache.clear()
+        generate_catalog(
+            categories=args.categories, products=args.products, flash_sales=args.flash_sales,
+            banners=args.banners, orders=args.orders, seed=args.seed,
+        )
+        report = {'config': config, 'views': {}}
+        for scenario in build_scenarios():
+            report['views'][scenario.name] = measure(scenario, args.repeat)
+        if args.processes:
+            report['wsgi'] = measure_wsgi(args.processes, args.wsgi_requests)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.write_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2, ensure_ascii=False) + '\n')
+    if args.compare:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get('config') != config:
+            print(f'warning: baseline was recorded with {baseline.get("config")}', file=sys.stderr)
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
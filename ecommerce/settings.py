@@ -14,6 +14,8 @@ from pathlib import Path
 
 import os
 
+from shop.db import sqlite_databases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,11 +45,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shop.carts.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,12 +80,42 @@ WSGI_APPLICATION = 'ecommerce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# WAL, connection pragmas and persistent connections, plus a read-only
+# "replica" connection that shop.db.ReadReplicaRouter gives the storefront
+# views. The test database is file-backed (not in-memory) so concurrency
+# tests exercise real locking.
+DATABASES = sqlite_databases(BASE_DIR / 'db.sqlite3', test_name=BASE_DIR / 'test_db.sqlite3')
+DATABASE_ROUTERS = ['shop.db.ReadReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# The storefront requires a cache shared by every process: the catalog
+# version counter (shop/cache.py) that admin saves, imports and the workers
+# bump, the regions and ETags keyed by it, and the flash-sale strips
+# pre-warmed by flash_sale_worker are all read back by the web workers.
+# A per-process LocMemCache would leave the others serving stale pages.
+# Use Redis in production (REDIS_URL; needs the redis package), where
+# incr() is atomic; the fallback is a file cache shared by the processes
+# of one host. FileBasedCache.incr() is a read followed by a write, so
+# two processes bumping the catalog version at once can lose one bump:
+# fine for development, not for several production workers. The test
+# suite uses a cache of its own (shop/tests.py).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('SHOP_CACHE_DIR', BASE_DIR / '.cache'),
+        },
     }
-}
 
 
 # Password validation
@@ -137,3 +171,37 @@ LANGUAGE_CODE = 'vi'
 TIME_ZONE = 'Asia/Ho_Chi_Minh'
 USE_I18N = True
 USE_TZ = True
+
+# Fraction of requests sampled by shop.instrumentation (0 disables it).
+SHOP_INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('SHOP_INSTRUMENTATION_SAMPLE_RATE', 0))
+
+# Where carts live: shop.carts.DatabaseCartStore, CacheCartStore or
+# SignedCookieCartStore (see shop/carts.py).
+SHOP_CART_STORE = 'shop.carts.DatabaseCartStore'
+
+# Serve home, products.json and product pages from shop.async_views; only
+# worth it under ASGI (ecommerce.asgi).
+SHOP_ASYNC_VIEWS = os.environ.get('SHOP_ASYNC_VIEWS') == '1'
+
+# Remote catalog images copied by shop.images: per-fetch timeout (seconds)
+# and the largest source accepted (bytes).
+SHOP_IMAGE_FETCH_TIMEOUT = 10
+SHOP_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+
+# collectstatic fingerprints static files by content hash and precompresses
+# them (.gz, plus .br with the optional brotli package); ecommerce.wsgi then
+# serves them from STATIC_ROOT with far-future caching (shop/staticfiles.py).
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'shop.staticfiles.CompressedManifestStaticFilesStorage'},
+}
+SHOP_SERVE_STATIC = True
+
+# Part of every storefront page ETag (shop/conditional.py): bump it when a
+# deploy changes the templates, so browsers stop revalidating old pages.
+SHOP_PAGE_VERSION = 1
+
+# Checkout: 'direct' writes the order in the request; 'queued' reserves the
+# stock, queues the order and leaves it to `manage.py order_worker`
+# (shop/order_queue.py).
+SHOP_ORDER_INTAKE = os.environ.get('SHOP_ORDER_INTAKE', 'direct')
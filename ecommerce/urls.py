@@ -19,8 +19,11 @@ from django.urls import path , include
 from django.conf import settings
 from django.conf.urls.static import static
 from shop import views as shop_views
+from shop.admin import instrumentation_view, sales_dashboard_view
 
 urlpatterns = [
+    path('admin/instrumentation/', admin.site.admin_view(instrumentation_view), name='admin_instrumentation'),
+    path('admin/sales/', admin.site.admin_view(sales_dashboard_view), name='admin_sales'),
     path('admin/', admin.site.urls),
     path ('', include('shop.urls')),
     path ('accounts/logout/', shop_views.logout_view, name='logout'),
@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings')
 
 application = get_wsgi_application()
+
+# Collected, fingerprinted and precompressed static files (shop.staticfiles).
+if getattr(settings, 'SHOP_SERVE_STATIC', False):
+    from shop.staticfiles import StaticFilesApp
+
+    application = StaticFilesApp(application)
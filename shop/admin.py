@@ -1,7 +1,51 @@
-from django.contrib import admin
+import io
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
 from django.utils.html import format_html
-from .models import Category, Product, Banner, Order, OrderItem
-from .models import Popup
+from .models import Category, Product, Banner, Order, OrderItem, OrderStatusChange
+from .models import PendingOrder, Popup, SourceImage
+from . import analytics, exports, imports, instrumentation, order_queue, order_status
+from .changelists import LargeTableAdminMixin
+from .forms import CatalogImportForm
+
+
+def _export_action(fmt):
+    def action(modeladmin, request, queryset):
+        kind = 'orders' if queryset.model is Order else 'products'
+        return exports.streaming_response(exports.Export(kind, fmt, queryset))
+
+    action.__name__ = f'export_{fmt}'
+    return admin.action(description=f'Xuất {fmt.upper()} các mục đã chọn')(action)
+
+
+export_csv = _export_action('csv')
+export_jsonl = _export_action('jsonl')
+
+
+def _status_action(target):
+    label = dict(Order.STATUS_CHOICES)[target]
+
+    def action(modeladmin, request, queryset):
+        moved = sum(order_status.transition(queryset, target, user=request.user).values())
+        skipped = queryset.count() - moved
+        modeladmin.message_user(request, f'Đã chuyển {moved} đơn sang "{label}".')
+        if skipped:
+            modeladmin.message_user(
+                request, f'Bỏ qua {skipped} đơn không thể chuyển sang "{label}".', messages.WARNING,
+            )
+
+    action.__name__ = f'mark_{target}'
+    return admin.action(description=f'Chuyển các đơn đã chọn sang "{label}"')(action)
+
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'slug', 'image_preview', 'created_at')
@@ -19,20 +63,27 @@ class CategoryAdmin(admin.ModelAdmin):
 class PopupAdmin(admin.ModelAdmin):
     list_display = ("title", "product", "is_active")
     list_editable = ("is_active",)
+    list_select_related = ("product",)
     search_fields = ("title", "description", "button_link")
+    autocomplete_fields = ("product",)
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'category', 'price', 'is_hot', 'is_best_seller', 'is_active', 'created_at')
     list_filter = ('is_hot', 'is_best_seller', 'is_active', 'category')
+    list_select_related = ('category',)
+    list_only = ('name', 'category__name', 'price', 'is_hot', 'is_best_seller', 'is_active', 'created_at')
     search_fields = ('name', 'description', 'color_options', 'specifications')
+    search_fts = True
+    autocomplete_fields = ('category',)
     prepopulated_fields = {"slug": ("name",)}
+    actions = (export_csv, export_jsonl)
     fieldsets = (
         ('Thông tin cơ bản', {
             'fields': ('name', 'slug', 'category', 'price', 'is_active', 'is_hot', 'is_best_seller')
         }),
         ('Flash Sale', {
-            'fields': ('flash_sale_price', 'flash_sale_start', 'flash_sale_end', 'flash_sale_stock')
+            'fields': ('flash_sale_price', 'flash_sale_start', 'flash_sale_end', 'flash_sale_stock', 'flash_sale_sold_out')
         }),
         ('Hình ảnh & Kho', {
             'fields': ('image_url', 'stock')
@@ -46,6 +97,39 @@ class ProductAdmin(admin.ModelAdmin):
         }),
     )
     readonly_fields = ('created_at', 'updated_at')
+    change_list_template = 'admin/shop/product/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='shop_product_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """Upload a CSV/JSONL catalog (see shop.imports)."""
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            raise PermissionDenied
+        form = CatalogImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+            report = imports.import_catalog(
+                upload, form.cleaned_data['format'], create_categories=form.cleaned_data['create_categories'],
+            )
+            messages.success(
+                request,
+                f'Đã nhập {report.rows} dòng: {report.created} sản phẩm mới, {report.updated} cập nhật, '
+                f'{report.error_count} lỗi ({report.seconds:.1f}s).',
+            )
+            for line, message in report.errors[:20]:
+                messages.warning(request, f'Dòng {line}: {message}')
+            return redirect('admin:shop_product_changelist')
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Nhập sản phẩm',
+            'opts': self.model._meta,
+            'form': form,
+            'fields': imports.IMPORT_FIELDS,
+        }
+        return TemplateResponse(request, 'admin/shop/product/import.html', context)
 
 @admin.register(Banner)
 class BannerAdmin(admin.ModelAdmin):
@@ -60,18 +144,156 @@ class BannerAdmin(admin.ModelAdmin):
         return '(no image)'
     image_preview.short_description = 'Ảnh banner'
 
+class OrderStatusChangeInline(admin.TabularInline):
+    model = OrderStatusChange
+    fields = ('from_status', 'to_status', 'changed_by', 'changed_at')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('id', 'customer_name', 'phone', 'total_amount', 'payment_method', 'status', 'created_at')
-    list_filter = ('status', 'payment_method')
-    search_fields = ('customer_name', 'phone', 'address')
+    # A date filter rather than date_hierarchy, which lists the distinct
+    # years/months/days by truncating every row's created_at.
+    list_filter = ('status', 'payment_method', ('created_at', admin.DateFieldListFilter))
+    list_only = list_display
+    search_prefix_fields = ('phone', 'customer_name')
     readonly_fields = ('created_at',)
     radio_fields = {'status': admin.HORIZONTAL, 'payment_method': admin.HORIZONTAL}
+    autocomplete_fields = ('user',)
+    inlines = (OrderStatusChangeInline,)
+    actions = (
+        export_csv, export_jsonl,
+        *(_status_action(status) for status, _ in Order.STATUS_CHOICES if order_status.sources(status)),
+    )
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        if obj is not None and 'status' in form.base_fields:
+            # Only the moves order_status allows; the field validates against these.
+            allowed = order_status.allowed_statuses(obj.status)
+            field = form.base_fields['status']
+            field.choices = [choice for choice in field.choices if choice[0] in allowed]
+        return form
 
-    class Media:
-        js = ('js/admin_order.js',)
+    def save_model(self, request, obj, form, change):
+        if not (change and 'status' in form.changed_data):
+            return super().save_model(request, obj, form, change)
+        # Save the other fields under the old status, then move it like the
+        # bulk actions do: history row, rollups, restock.
+        target, obj.status = obj.status, form.initial['status']
+        super().save_model(request, obj, form, change)
+        order_status.set_status(obj, target, user=request.user)
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('order', 'product_name', 'quantity', 'unit_price', 'line_total')
-    search_fields = ('product_name',)
\ No newline at end of file
+    list_select_related = ('order',)
+    # What Order.__str__ needs.
+    list_only = ('product_name', 'quantity', 'unit_price', 'line_total',
+                 'order__customer_name', 'order__total_amount')
+    search_prefix_fields = ('product_name',)
+    search_id_field = 'order'
+    raw_id_fields = ('order', 'product')
+
+@admin.register(SourceImage)
+class SourceImageAdmin(admin.ModelAdmin):
+    """Read-only view of shop.images: what was fetched and what failed."""
+    list_display = ('url', 'status', 'width', 'height', 'presets', 'error', 'fetched_at')
+    list_filter = ('status',)
+    search_fields = ('url',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(PendingOrder)
+class PendingOrderAdmin(admin.ModelAdmin):
+    """Read-only view of the queued-checkout intake (shop.order_queue).
+
+    Failed entries still hold their stock; the actions queue them again or
+    cancel them and release it.
+    """
+    list_display = ('number', 'status', 'order', 'attempts', 'claim', 'claimed_until', 'error', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('number',)
+    list_select_related = ('order',)
+    actions = ('retry', 'cancel')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_resolve_permission(self, request):
+        return request.user.has_perm('shop.change_pendingorder')
+
+    def _report(self, request, queryset, done, verb):
+        self.message_user(request, f'Đã {verb} {done} đơn lỗi.')
+        skipped = queryset.count() - done
+        if skipped:
+            self.message_user(request, f'Bỏ qua {skipped} đơn không ở trạng thái lỗi.', messages.WARNING)
+
+    @admin.action(description='Xử lý lại các đơn lỗi đã chọn', permissions=['resolve'])
+    def retry(self, request, queryset):
+        self._report(request, queryset, order_queue.retry(queryset), 'xếp hàng lại')
+
+    @admin.action(description='Hủy các đơn lỗi đã chọn và trả hàng về kho', permissions=['resolve'])
+    def cancel(self, request, queryset):
+        self._report(request, queryset, order_queue.cancel(queryset), 'hủy')
+
+def instrumentation_view(request):
+    """Per-view latency/query percentiles and duplicated SQL (see shop.instrumentation)."""
+    report = instrumentation.summarize(instrumentation.collect(), top=20)
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Hiệu năng theo trang',
+        'report': report,
+        'sample_rate': getattr(settings, 'SHOP_INSTRUMENTATION_SAMPLE_RATE', 0),
+    }
+    return TemplateResponse(request, 'admin/shop/instrumentation.html', context)
+
+
+SALES_RANGES = (7, 30, 90, 365)
+# The dashboard may lag new orders by this many seconds.
+SALES_DASHBOARD_TIMEOUT = 60
+
+
+def _sales_dashboard(days):
+    end = timezone.now()
+    start = end - timedelta(days=days)
+    period = 'month' if days > 90 else 'day'
+    summary = analytics.sales_summary(start, end)
+    statuses, methods = dict(Order.STATUS_CHOICES), dict(Order.PAYMENT_CHOICES)
+    for row in summary['by_status']:
+        row['label'] = statuses.get(row['status'], row['status'])
+    for row in summary['by_payment']:
+        row['label'] = methods.get(row['payment_method'], row['payment_method'])
+    return {'period': period, 'summary': summary, 'series': analytics.revenue_series(start, end, period)}
+
+
+def sales_dashboard_view(request):
+    """Revenue, orders and best sellers over a range, read from the sales rollups."""
+    try:
+        days = int(request.GET.get('days', 30))
+    except ValueError:
+        days = 30
+    if days not in SALES_RANGES:
+        days = 30
+    dashboard = cache.get_or_set(f'shop:sales-dashboard:{days}', lambda: _sales_dashboard(days),
+                                 SALES_DASHBOARD_TIMEOUT)
+    context = {
+        **admin.site.each_context(request),
+        **dashboard,
+        'title': 'Doanh số',
+        'days': days,
+        'ranges': SALES_RANGES,
+    }
+    return TemplateResponse(request, 'admin/shop/sales.html', context)
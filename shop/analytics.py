@@ -0,0 +1,378 @@
+"""Materialized sales rollups and the numbers derived from them.
+
+Two additive tables hold one row per (period, bucket, key) for hour, day
+and month buckets in the shop's time zone:
+
+``SalesRollup``
+    Units, revenue and orders per product (and its category) of every
+    order that is not cancelled.
+``OrderRollup``
+    Orders and revenue per status and payment method, cancelled included.
+
+They are kept current incrementally: ``create_order`` and ``import_orders``
+add their orders in the same transaction (one upsert per table), and
+saving or deleting an order moves it between status buckets (see
+``shop.signals``), as do bulk status changes (``shop.order_status``). ``manage.py backfill_sales_rollups`` recomputes them
+from ``Order``/``OrderItem``, for history or after bulk ``update()`` calls
+that skip signals.
+
+Queries over a range cover it with the fewest buckets (whole months, then
+days, then hours at the edges), so a year-long dashboard reads a few
+hundred rows instead of every order line.
+
+``update_product_flags`` (``manage.py update_product_flags``, run it from
+cron) sets ``is_best_seller`` on the products selling the most units over
+BEST_SELLER_DAYS and ``is_hot`` on the ones whose rate over the last
+HOT_HOURS is at least HOT_GROWTH times their BEST_SELLER_DAYS rate.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from functools import reduce
+from itertools import groupby
+from operator import itemgetter, or_
+
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import Category, Order, OrderItem, OrderRollup, Product, SalesRollup
+
+# Lines of cancelled orders are not sales.
+CANCELLED = 'cancel'
+WRITE_BATCH_SIZE = 2000
+
+BEST_SELLER_DAYS = 30
+BEST_SELLER_COUNT = 12
+HOT_HOURS = 48
+HOT_COUNT = 12
+HOT_GROWTH = 2.0
+MIN_UNITS = 2
+
+
+def truncate(value, period):
+    """Start of the ``period`` bucket holding ``value``, in local time."""
+    value = timezone.localtime(value).replace(minute=0, second=0, microsecond=0)
+    if period in ('day', 'month'):
+        value = value.replace(hour=0)
+    if period == 'month':
+        value = value.replace(day=1)
+    return value
+
+
+def _buckets(value):
+    """``(period, bucket)`` of ``value`` for every period."""
+    hour = truncate(value, 'hour')
+    day = hour.replace(hour=0)
+    return (('hour', hour), ('day', day), ('month', day.replace(day=1)))
+
+
+def _next(bucket, period):
+    step = {'hour': timedelta(hours=1), 'day': timedelta(days=1), 'month': timedelta(days=32)}[period]
+    return truncate(bucket + step, period)
+
+
+def _segments(start, end, periods=('month', 'day', 'hour')):
+    """``(period, lo, hi)`` triples covering ``[start, end)`` with the fewest buckets.
+
+    The finest period rounds ``start`` down to its bucket.
+    """
+    if start >= end:
+        return []
+    period, finer = periods[0], periods[1:]
+    if not finer:
+        return [(period, truncate(start, period), end)]
+    lo = truncate(start, period)
+    if lo < start:
+        lo = _next(lo, period)
+    hi = truncate(end, period)
+    if lo >= hi:
+        return _segments(start, end, finer)
+    return _segments(start, lo, finer) + [(period, lo, hi)] + _segments(hi, end, finer)
+
+
+def range_filter(start, end):
+    """Q matching the rollup rows that cover ``[start, end)`` exactly once."""
+    segments = [Q(period=period, bucket__gte=lo, bucket__lt=hi) for period, lo, hi in _segments(start, end)]
+    return reduce(or_, segments) if segments else Q(pk__in=[])
+
+
+# --- incremental maintenance -------------------------------------------------
+
+def _upsert(model, keys, extra, values, rows):
+    """Add ``values`` columns of ``rows`` onto the rows matching ``keys``, inserting missing ones.
+
+    ``extra`` columns are written as given.
+    """
+    if not rows:
+        return
+    table = model._meta.db_table
+    columns = keys + extra + values
+    updates = ', '.join(
+        [f'{column} = excluded.{column}' for column in extra]
+        + [f'{column} = {table}.{column} + excluded.{column}' for column in values]
+    )
+    sql = (
+        f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(["%s"] * len(columns))}) '
+        f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {updates}'
+    )
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), WRITE_BATCH_SIZE):
+            cursor.executemany(sql, rows[start:start + WRITE_BATCH_SIZE])
+
+
+class _Deltas:
+    """Accumulates signed changes to both rollup tables, then writes them."""
+
+    def __init__(self):
+        self.orders = defaultdict(lambda: [0, Decimal('0')])
+        self.sales = defaultdict(lambda: [0, Decimal('0'), 0])
+        self.categories = {}
+
+    def add_order(self, created_at, status, payment_method, total, sign=1):
+        for period, bucket in _buckets(created_at):
+            entry = self.orders[period, bucket, status, payment_method]
+            entry[0] += sign
+            entry[1] += sign * total
+
+    def add_lines(self, created_at, lines, sign=1):
+        """``lines``: ``(product_id, category_id, quantity, line_total)`` tuples."""
+        buckets = _buckets(created_at)
+        for product_id, category_id, quantity, line_total in lines:
+            if product_id is None:
+                continue
+            self.categories[product_id] = category_id
+            for period, bucket in buckets:
+                entry = self.sales[period, bucket, product_id]
+                entry[0] += sign * quantity
+                entry[1] += sign * line_total
+                entry[2] += sign
+
+    def write(self):
+        ops = connection.ops
+        buckets = {}
+
+        def adapt(bucket):
+            if bucket not in buckets:
+                buckets[bucket] = ops.adapt_datetimefield_value(bucket)
+            return buckets[bucket]
+
+        _upsert(OrderRollup, ['period', 'bucket', 'status', 'payment_method'], [], ['orders', 'revenue'], [
+            (period, adapt(bucket), status, method, orders, ops.adapt_decimalfield_value(revenue, 14, 2))
+            for (period, bucket, status, method), (orders, revenue) in self.orders.items()
+        ])
+        _upsert(SalesRollup, ['period', 'bucket', 'product_id'], ['category_id'], ['units', 'revenue', 'orders'], [
+            (period, adapt(bucket), pid, self.categories[pid], units, ops.adapt_decimalfield_value(revenue, 14, 2),
+             orders)
+            for (period, bucket, pid), (units, revenue, orders) in self.sales.items()
+        ])
+
+
+def _item_lines(items):
+    return [(item.product_id, item.product.category_id if item.product else None, item.quantity, item.line_total)
+            for item in items]
+
+
+def record_orders(orders_and_items):
+    """Add new ``(order, order_items)`` pairs to the rollups (two statements)."""
+    deltas = _Deltas()
+    for order, items in orders_and_items:
+        deltas.add_order(order.created_at, order.status, order.payment_method, order.total_amount)
+        if order.status != CANCELLED:
+            deltas.add_lines(order.created_at, _item_lines(items))
+    deltas.write()
+
+
+def _stored_lines(order):
+    return list(OrderItem.objects.filter(order=order).values_list(
+        'product_id', 'product__category_id', 'quantity', 'line_total',
+    ))
+
+
+def order_changed(order, old_status, old_payment_method):
+    """Move a saved ``order`` out of its old status/payment bucket into its new one."""
+    if (old_status, old_payment_method) == (order.status, order.payment_method):
+        return
+    deltas = _Deltas()
+    deltas.add_order(order.created_at, old_status, old_payment_method, order.total_amount, sign=-1)
+    deltas.add_order(order.created_at, order.status, order.payment_method, order.total_amount)
+    if (old_status == CANCELLED) != (order.status == CANCELLED):
+        deltas.add_lines(order.created_at, _stored_lines(order), sign=-1 if order.status == CANCELLED else 1)
+    deltas.write()
+
+
+def orders_moved(orders, old_status, new_status):
+    """Move every order of the ``orders`` queryset from ``old_status`` to ``new_status``.
+
+    For bulk status updates, which skip the signals: one query for the
+    orders, one for their lines if cancellation changes, two upserts.
+    """
+    deltas = _Deltas()
+    for created_at, payment_method, total in orders.order_by().values_list('created_at', 'payment_method', 'total_amount'):
+        deltas.add_order(created_at, old_status, payment_method, total, sign=-1)
+        deltas.add_order(created_at, new_status, payment_method, total)
+    if (old_status == CANCELLED) != (new_status == CANCELLED):
+        lines = OrderItem.objects.filter(order__in=orders.order_by().values('pk')).order_by('order__created_at')
+        lines = lines.values_list('order__created_at', 'product_id', 'product__category_id', 'quantity', 'line_total')
+        for created_at, group in groupby(lines, key=itemgetter(0)):
+            deltas.add_lines(created_at, [line[1:] for line in group], sign=-1 if new_status == CANCELLED else 1)
+    deltas.write()
+
+
+def order_deleted(order, status, payment_method):
+    deltas = _Deltas()
+    deltas.add_order(order.created_at, status, payment_method, order.total_amount, sign=-1)
+    if status != CANCELLED:
+        deltas.add_lines(order.created_at, _stored_lines(order), sign=-1)
+    deltas.write()
+
+
+# --- backfill ------------------------------------------------------------------
+
+def rebuild_rollups(since=None):
+    """Recompute the rollups from orders, all of them or from ``since`` on.
+
+    ``since`` is rounded down to the start of its month so month buckets
+    stay whole. Orders are streamed through the same accumulator as the
+    incremental updates. Returns the number of rollup rows written.
+    """
+    orders = Order.objects.order_by('pk')
+    items = OrderItem.objects.order_by('order_id').exclude(order__status=CANCELLED)
+    if since is not None:
+        since = truncate(since, 'month')
+        orders = orders.filter(created_at__gte=since)
+        items = items.filter(order__created_at__gte=since)
+
+    deltas = _Deltas()
+    created = {}
+    for pk, created_at, status, payment_method, total in orders.values_list(
+        'pk', 'created_at', 'status', 'payment_method', 'total_amount',
+    ).iterator(chunk_size=WRITE_BATCH_SIZE):
+        deltas.add_order(created_at, status, payment_method, total)
+        if status != CANCELLED:
+            created[pk] = created_at
+    lines = items.values_list(
+        'order_id', 'product_id', 'product__category_id', 'quantity', 'line_total',
+    ).iterator(chunk_size=WRITE_BATCH_SIZE)
+    for order_id, group in groupby(lines, key=itemgetter(0)):
+        deltas.add_lines(created[order_id], (line[1:] for line in group))
+
+    with transaction.atomic():
+        for model in (OrderRollup, SalesRollup):
+            stale = model.objects.all()
+            if since is not None:
+                stale = stale.filter(bucket__gte=since)
+            stale.delete()
+        deltas.write()
+    return len(deltas.orders) + len(deltas.sales)
+
+
+# --- reading -------------------------------------------------------------------
+
+def units_sold(start, end, product_ids=None):
+    """``{product_id: units}`` sold in ``[start, end)``."""
+    rows = SalesRollup.objects.filter(range_filter(start, end))
+    if product_ids is not None:
+        rows = rows.filter(product_id__in=product_ids)
+    return dict(rows.values('product_id').annotate(total=Sum('units')).values_list('product_id', 'total'))
+
+
+def revenue_series(start, end, period='day'):
+    """``[(bucket, orders, revenue)]`` of non-cancelled orders, one per ``period`` bucket."""
+    rows = (
+        OrderRollup.objects.filter(period=period, bucket__gte=truncate(start, period), bucket__lt=end)
+        .exclude(status=CANCELLED)
+        .values('bucket').annotate(count=Sum('orders'), total=Sum('revenue')).order_by('bucket')
+    )
+    return [(row['bucket'], row['count'], row['total']) for row in rows]
+
+
+def _add(entry, count, total):
+    entry[0] += count
+    entry[1] += total
+
+
+def _ranked(totals, top):
+    rows = [{'key': key, 'units_total': units, 'total': total} for key, (units, total) in totals.items()]
+    rows.sort(key=itemgetter('total'), reverse=True)
+    return rows[:top]
+
+
+def sales_summary(start, end, top=10):
+    """Totals, breakdowns and best sellers for ``[start, end)``, all from rollups.
+
+    One grouped query per rollup table; the breakdowns are summed up here.
+    """
+    covering = range_filter(start, end)
+    statuses = defaultdict(lambda: [0, Decimal('0')])
+    methods = defaultdict(lambda: [0, Decimal('0')])
+    for status, method, count, total in (
+        OrderRollup.objects.filter(covering).values_list('status', 'payment_method')
+        .annotate(count=Sum('orders'), total=Sum('revenue')).order_by()
+    ):
+        _add(statuses[status], count, total)
+        if status != CANCELLED:
+            _add(methods[method], count, total)
+
+    products = defaultdict(lambda: [0, Decimal('0')])
+    categories = defaultdict(lambda: [0, Decimal('0')])
+    for product_id, category_id, units, total in (
+        SalesRollup.objects.filter(covering).values_list('product_id', 'category_id')
+        .annotate(units_total=Sum('units'), total=Sum('revenue')).order_by()
+    ):
+        _add(products[product_id], units, total)
+        _add(categories[category_id], units, total)
+
+    top_products = _ranked(products, top)
+    top_categories = _ranked(categories, top)
+    names = dict(Product.objects.filter(pk__in=[row['key'] for row in top_products]).values_list('pk', 'name'))
+    for row in top_products:
+        row['name'] = names.get(row['key'], f'#{row["key"]}')
+    names = dict(Category.objects.filter(pk__in=[row['key'] for row in top_categories]).values_list('pk', 'name'))
+    for row in top_categories:
+        row['name'] = names.get(row['key'])
+    return {
+        'orders': sum(count for count, _ in methods.values()),
+        'revenue': sum((total for _, total in methods.values()), Decimal('0')),
+        'by_status': sorted(({'status': key, 'count': count, 'total': total}
+                             for key, (count, total) in statuses.items()), key=itemgetter('count'), reverse=True),
+        'by_payment': sorted(({'payment_method': key, 'count': count, 'total': total}
+                              for key, (count, total) in methods.items()), key=itemgetter('total'), reverse=True),
+        'products': top_products,
+        'categories': top_categories,
+    }
+
+
+# --- product flags -------------------------------------------------------------
+
+def _set_flag(field, product_ids):
+    changed = Product.objects.filter(**{field: True}).exclude(pk__in=product_ids).update(**{field: False})
+    changed += Product.objects.filter(pk__in=product_ids, **{field: False}).update(**{field: True})
+    return changed
+
+
+def product_flags(now=None):
+    """``(best_seller_ids, hot_ids)`` from sales velocity at ``now``."""
+    now = now or timezone.now()
+    active = set(Product.objects.filter(is_active=True).values_list('pk', flat=True))
+    month = {pk: units for pk, units in units_sold(now - timedelta(days=BEST_SELLER_DAYS), now).items()
+             if pk in active and units >= MIN_UNITS}
+    best = sorted(month, key=lambda pk: (month[pk], pk), reverse=True)[:BEST_SELLER_COUNT]
+
+    recent = units_sold(now - timedelta(hours=HOT_HOURS), now, product_ids=list(month))
+    window = BEST_SELLER_DAYS * 24 / HOT_HOURS
+    rising = [pk for pk, units in recent.items()
+              if units >= MIN_UNITS and units * window >= HOT_GROWTH * month[pk]]
+    hot = sorted(rising, key=lambda pk: (recent[pk], pk), reverse=True)[:HOT_COUNT]
+    return best, hot
+
+
+def update_product_flags(now=None):
+    """Recompute ``is_best_seller``/``is_hot``; returns the number of products changed."""
+    best, hot = product_flags(now)
+    with transaction.atomic():
+        changed = _set_flag('is_best_seller', best) + _set_flag('is_hot', hot)
+    if changed:
+        bump_catalog_version()
+    return changed
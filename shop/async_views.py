@@ -0,0 +1,124 @@
+"""Async variants of the read-only storefront views, for ASGI deployments.
+
+Enabled with ``SHOP_ASYNC_VIEWS = True`` (see ``shop.urls``). They render
+the same templates and JSON as ``shop.views`` but never block the event
+loop: independent homepage regions that miss the cache are built
+concurrently in worker threads (``shop.cache.aget_regions``), the listing
+query runs alongside them, and the JSON listing fetches its page and its
+count at the same time. Templates are rendered off the loop too, because
+the auth and messages context processors may touch the database.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.db.utils import OperationalError, ProgrammingError
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+from django.utils import timezone
+from urllib.parse import quote
+
+from .cache import aget_regions, catalog_version
+from .conditional import conditional_page, home_validators, product_validators
+from .db import is_busy, storefront_reads
+from .flash_sales import build_strip, get_timeline, strip_region_name
+from .instrumentation import recorded
+from .models import Product
+from .pagination import InvalidCursor, cached_count, keyset_page
+from .related import RELATED_SIZE, related_products
+from .views import (
+    DATABASE_NOT_READY, PRODUCTS_PER_PAGE, _home_builders, _home_context, _home_listing,
+    _home_params, _page_from_region, _product_payload, _storefront_products,
+)
+
+arender = sync_to_async(render)
+
+
+def _isolated(func):
+    """Run ``func`` in a worker thread of its own, with that thread's connection."""
+    return sync_to_async(recorded(func), thread_sensitive=False)
+
+
+# Off the loop: a search checks once per process whether the FTS table exists.
+_build_queryset = sync_to_async(_storefront_products)
+
+
+def _timeline_now():
+    now = timezone.now()
+    version = catalog_version()
+    return now, version, get_timeline(version)
+
+
+@storefront_reads
+@conditional_page(home_validators)
+async def home_view(request):
+    query, category_slug, listing, page_number, cursor = _home_params(request)
+    qs = await _build_queryset(query, category_slug, listing)
+    stages, grid_region = _home_builders(qs, query, category_slug, listing, page_number, cursor)
+
+    regions = {}
+    flash_sale = {}
+    try:
+        now, version, timeline = await sync_to_async(_timeline_now)()
+        strip_region = strip_region_name(timeline, now)
+        stages[0][strip_region] = lambda regions: build_strip(timeline, now)
+        fetch_regions = aget_regions(stages, version, expires_at=timeline.next_transition(now))
+        if grid_region:
+            regions = await fetch_regions
+            products = _page_from_region(regions[grid_region])
+        else:
+            regions, products = await asyncio.gather(
+                fetch_regions, _isolated(_home_listing)(qs, page_number, cursor),
+            )
+        flash_sale = regions[strip_region]
+    except (OperationalError, ProgrammingError) as exc:
+        if is_busy(exc):
+            raise
+        await sync_to_async(messages.warning)(request, DATABASE_NOT_READY)
+        products = []
+
+    context = _home_context(products, regions, flash_sale, query, category_slug, listing)
+    return await arender(request, 'shop/home.html', context)
+
+
+@storefront_reads
+async def product_list_json(request):
+    query = request.GET.get('q', '').strip()
+    category_slug = request.GET.get('cat', '').strip()
+    qs = await _build_queryset(query, category_slug)
+    try:
+        page, product_count = await asyncio.gather(
+            _isolated(keyset_page)(qs, request.GET.get('cursor', '').strip() or None, PRODUCTS_PER_PAGE),
+            _isolated(cached_count)(qs, f'{quote(query)}:{quote(category_slug)}'),
+        )
+    except InvalidCursor:
+        return JsonResponse({'error': 'invalid cursor'}, status=400)
+    return JsonResponse({
+        'query': query,
+        'category': category_slug,
+        'product_count': product_count,
+        'total_pages': max(1, -(-product_count // PRODUCTS_PER_PAGE)),
+        'has_next': page.has_next(),
+        'next_cursor': page.next_cursor,
+        'products': [_product_payload(p) for p in page],
+    })
+
+
+@storefront_reads
+@conditional_page(product_validators)
+async def product_detail_view(request, slug):
+    try:
+        product = await Product.objects.select_related('category', 'related_list').aget(slug=slug, is_active=True)
+    except Product.DoesNotExist:
+        raise Http404('Sản phẩm không tồn tại.')
+    related = await sync_to_async(related_products)(product)
+    if not related:
+        related = [
+            p async for p in Product.objects.filter(is_active=True, category_id=product.category_id)
+            .exclude(id=product.id)[:RELATED_SIZE]
+        ]
+    context = {
+        'product': product,
+        'related_products': related,
+    }
+    return await arender(request, 'shop/product_detail.html', context)
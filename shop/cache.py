@@ -0,0 +1,126 @@
+"""Versioned cache for the storefront's catalog-derived regions.
+
+Every cached region is keyed by a catalog version counter that the signal
+handlers in ``shop.signals`` bump whenever a Banner, Category, Product or
+Popup changes, so stale entries are never read again and simply expire.
+Callers can additionally cut region timeouts short at the next flash-sale
+start/end (see ``shop.flash_sales``) so that a strip rendered before a sale
+opens never survives past the opening.
+"""
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.utils import timezone
+
+from .instrumentation import recorded
+
+CATALOG_VERSION_KEY = 'shop:catalog:version'
+REGION_KEY_PREFIX = 'shop:region'
+# Upper bound for any region, even when no flash-sale boundary is near.
+REGION_TIMEOUT = 300
+CHANGED_AT_TIMEOUT = 24 * 60 * 60
+
+
+def catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Seed from the clock rather than 1 so a version evicted from the
+        # cache can never collide with regions still stored under it.
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        catalog_version()
+
+
+def catalog_changed_at(version):
+    """When ``version`` was first seen: never before the change that made it.
+
+    Used as the storefront's ``Last-Modified``; if the entry is evicted the
+    time moves later, which only costs a full response.
+    """
+    key = region_key('changed_at', version)
+    changed = cache.get(key)
+    if changed is None:
+        cache.add(key, timezone.now(), CHANGED_AT_TIMEOUT)
+        changed = cache.get(key) or timezone.now()
+    return changed
+
+
+def region_key(name, version):
+    return f'{REGION_KEY_PREFIX}:{version}:{name}'
+
+
+def region_timeout(expires_at, now=None):
+    """Seconds a region may live: REGION_TIMEOUT, cut short by ``expires_at``.
+
+    Rounds down, and returns 0 (do not cache) inside the last second, so a
+    region never outlives the boundary it was computed before.
+    """
+    if not expires_at:
+        return REGION_TIMEOUT
+    now = now or timezone.now()
+    return max(0, min(REGION_TIMEOUT, int((expires_at - now).total_seconds())))
+
+
+def get_regions(builders, version=None, expires_at=None):
+    """Fetch named regions in one cache round trip, building the missing ones.
+
+    ``builders`` maps region name to a callable taking the dict of regions
+    resolved so far, so a later region can be derived from an earlier one
+    (e.g. category tiles from the category list) without another query.
+    Newly built regions are cached until ``expires_at`` at the latest.
+    """
+    version = version or catalog_version()
+    keys = {name: region_key(name, version) for name in builders}
+    cached = cache.get_many(keys.values())
+
+    regions = {}
+    missing = {}
+    for name, build in builders.items():
+        key = keys[name]
+        if key in cached:
+            regions[name] = cached[key]
+        else:
+            regions[name] = missing[key] = build(regions)
+    if missing:
+        cache.set_many(missing, region_timeout(expires_at))
+    return regions
+
+
+async def aget_regions(stages, version, expires_at=None):
+    """Async ``get_regions`` building independent regions concurrently.
+
+    ``stages`` is a list of builder dicts: the missing regions of one stage
+    are built at the same time, each in its own worker thread (and so its
+    own database connection, which the thread keeps for reuse), and a
+    stage's builders see every region of earlier stages.
+    """
+    keys = {name: region_key(name, version) for stage in stages for name in stage}
+    cached = await cache.aget_many(keys.values())
+
+    regions = {}
+    missing = {}
+    for stage in stages:
+        todo = []
+        for name, build in stage.items():
+            if keys[name] in cached:
+                regions[name] = cached[keys[name]]
+            else:
+                todo.append((name, build))
+        snapshot = dict(regions)
+        built = await asyncio.gather(*(
+            sync_to_async(recorded(build), thread_sensitive=False)(snapshot) for _, build in todo
+        ))
+        for (name, _), region in zip(todo, built):
+            regions[name] = missing[keys[name]] = region
+    if missing:
+        await cache.aset_many(missing, region_timeout(expires_at))
+    return regions
@@ -0,0 +1,272 @@
+"""Shopping-cart storage, independent of the session.
+
+``CartMiddleware`` puts a lazily loaded ``Cart`` on ``request.cart``. Where
+the lines are kept is up to the store named by ``SHOP_CART_STORE``:
+
+``DatabaseCartStore`` (default)
+    One ``CartItem`` row per line. Changing a line is a single-row upsert or
+    delete, not a rewrite of the whole session row.
+``CacheCartStore``
+    The encoded cart as one cache value (``SHOP_CART_CACHE`` alias).
+``SignedCookieCartStore``
+    The encoded cart in a signed cookie: no server-side writes at all.
+
+The server-side stores key anonymous carts by a random ``cart_id`` cookie
+and signed-in users' carts by user id, so a cart follows its user across
+devices. On login the anonymous cart is merged into the user's cart.
+Anonymous database carts outlive their ``cart_id`` cookie; ``manage.py
+purge_carts`` deletes the ones nobody has touched for a while.
+
+Carts are encoded compactly as ``"<product_id>:<qty>,..."``.
+"""
+import secrets
+from datetime import timedelta
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from .models import CartItem
+
+MAX_QUANTITY = 999
+CART_ID_COOKIE = 'cart_id'
+CART_COOKIE = 'cart'
+CART_COOKIE_SALT = 'shop.carts'
+CART_COOKIE_AGE = 30 * 24 * 60 * 60
+CACHE_KEY_PREFIX = 'shop:cart'
+
+
+def encode(lines):
+    return ','.join(f'{pid}:{qty}' for pid, qty in lines.items() if qty > 0)
+
+
+def decode(value):
+    lines = {}
+    for part in (value or '').split(','):
+        pid, _, qty = part.partition(':')
+        if pid.isdigit() and qty.isdigit() and int(qty) > 0:
+            lines[int(pid)] = min(int(qty), MAX_QUANTITY)
+    return lines
+
+
+def _merged(target, source):
+    lines = dict(target)
+    for pid, qty in source.items():
+        lines[pid] = min(lines.get(pid, 0) + qty, MAX_QUANTITY)
+    return lines
+
+
+class Cart:
+    """The current request's cart: ``{product_id: quantity}`` plus mutators."""
+
+    def __init__(self, request, store):
+        self.request = request
+        self.store = store
+        self.new_cart_id = None
+        self.cookie_changed = False
+
+    def _anonymous_key(self, create=False):
+        cart_id = self.new_cart_id or self.request.COOKIES.get(CART_ID_COOKIE, '')
+        if not (cart_id.isalnum() and len(cart_id) == 32):
+            if not create:
+                return None
+            self.new_cart_id = cart_id = secrets.token_hex(16)
+        return f'a:{cart_id}'
+
+    def _key(self, create=False):
+        user = getattr(self.request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'u:{user.pk}'
+        return self._anonymous_key(create)
+
+    @property
+    def key(self):
+        """Store key of this cart; None for a visitor who never had one."""
+        return self._key()
+
+    @property
+    def write_key(self):
+        """Store key of this cart, handing out a ``cart_id`` cookie if needed."""
+        return self._key(create=True)
+
+    @cached_property
+    def lines(self):
+        return self.store.load(self)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def __len__(self):
+        return sum(self.lines.values())
+
+    def items(self):
+        return self.lines.items()
+
+    def quantity(self, product_id):
+        return self.lines.get(int(product_id), 0)
+
+    def set(self, product_id, quantity):
+        """Set one line's quantity (0 removes it)."""
+        product_id, quantity = int(product_id), max(0, min(int(quantity), MAX_QUANTITY))
+        if quantity:
+            self.lines[product_id] = quantity
+        else:
+            self.lines.pop(product_id, None)
+        self.store.save_line(self, product_id, quantity)
+
+    def remove(self, product_id):
+        self.set(product_id, 0)
+
+    def clear(self):
+        self.lines.clear()
+        self.store.clear(self)
+
+    def merge_anonymous(self):
+        """Move the anonymous cart into the signed-in user's cart."""
+        source = self._anonymous_key()
+        if source is not None:
+            self.store.merge(self, source, self.key)
+            self.__dict__.pop('lines', None)
+
+    def update_response(self, response):
+        if self.new_cart_id and self.store.needs_cart_id:
+            response.set_cookie(CART_ID_COOKIE, self.new_cart_id, max_age=CART_COOKIE_AGE,
+                                httponly=True, samesite='Lax')
+        if self.cookie_changed:
+            if self.lines:
+                response.set_signed_cookie(CART_COOKIE, encode(self.lines), salt=CART_COOKIE_SALT,
+                                           max_age=CART_COOKIE_AGE, httponly=True, samesite='Lax')
+            else:
+                response.delete_cookie(CART_COOKIE)
+        return response
+
+
+class DatabaseCartStore:
+    needs_cart_id = True
+
+    def _lines(self, key):
+        if key is None:
+            return {}
+        return dict(CartItem.objects.filter(cart_key=key).values_list('product_id', 'quantity'))
+
+    def _upsert(self, key, lines):
+        CartItem.objects.bulk_create(
+            [CartItem(cart_key=key, product_id=pid, quantity=qty) for pid, qty in lines.items()],
+            update_conflicts=True, unique_fields=['cart_key', 'product'], update_fields=['quantity', 'updated_at'],
+        )
+
+    def load(self, cart):
+        return self._lines(cart.key)
+
+    def save_line(self, cart, product_id, quantity):
+        if quantity:
+            self._upsert(cart.write_key, {product_id: quantity})
+        elif cart.key is not None:
+            CartItem.objects.filter(cart_key=cart.key, product_id=product_id).delete()
+
+    def clear(self, cart):
+        if cart.key is not None:
+            CartItem.objects.filter(cart_key=cart.key).delete()
+
+    def merge(self, cart, source_key, target_key):
+        source = self._lines(source_key)
+        if source:
+            self._upsert(target_key, _merged(self._lines(target_key), source))
+            CartItem.objects.filter(cart_key=source_key).delete()
+
+
+def purge_carts(older_than=timedelta(seconds=CART_COOKIE_AGE), batch_size=1000):
+    """Delete anonymous ``CartItem`` carts with no line changed in ``older_than``.
+
+    Signed-in users' carts are kept. Returns the number of rows deleted.
+    """
+    cutoff = timezone.now() - older_than
+    recent = CartItem.objects.filter(updated_at__gte=cutoff).values('cart_key')
+    abandoned = CartItem.objects.filter(updated_at__lt=cutoff, cart_key__startswith='a:').exclude(cart_key__in=recent)
+    deleted = 0
+    while True:
+        batch = list(abandoned.values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += CartItem.objects.filter(pk__in=batch).delete()[0]
+
+
+class CacheCartStore:
+    needs_cart_id = True
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'SHOP_CART_CACHE', 'default')]
+
+    def _key(self, key):
+        return f'{CACHE_KEY_PREFIX}:{key}'
+
+    def load(self, cart):
+        key = cart.key
+        return decode(self.cache.get(self._key(key))) if key is not None else {}
+
+    def save_line(self, cart, product_id, quantity):
+        self.cache.set(self._key(cart.write_key), encode(cart.lines), CART_COOKIE_AGE)
+
+    def clear(self, cart):
+        if cart.key is not None:
+            self.cache.delete(self._key(cart.key))
+
+    def merge(self, cart, source_key, target_key):
+        source = decode(self.cache.get(self._key(source_key)))
+        if source:
+            target = decode(self.cache.get(self._key(target_key)))
+            self.cache.set(self._key(target_key), encode(_merged(target, source)), CART_COOKIE_AGE)
+            self.cache.delete(self._key(source_key))
+
+
+class SignedCookieCartStore:
+    needs_cart_id = False
+
+    def load(self, cart):
+        return decode(cart.request.get_signed_cookie(
+            CART_COOKIE, default='', salt=CART_COOKIE_SALT, max_age=CART_COOKIE_AGE,
+        ))
+
+    def save_line(self, cart, product_id, quantity):
+        cart.cookie_changed = True
+
+    def clear(self, cart):
+        cart.cookie_changed = True
+
+    def merge(self, cart, source_key, target_key):
+        # The cookie already is the browser's cart, signed in or not.
+        pass
+
+
+_stores = {}
+
+
+def get_store():
+    path = getattr(settings, 'SHOP_CART_STORE', 'shop.carts.DatabaseCartStore')
+    if path not in _stores:
+        _stores[path] = import_string(path)()
+    return _stores[path]
+
+
+class CartMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.cart = Cart(request, get_store())
+        return request.cart.update_response(self.get_response(request))
+
+    async def __acall__(self, request):
+        request.cart = Cart(request, get_store())
+        return request.cart.update_response(await self.get_response(request))
+
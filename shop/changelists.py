@@ -0,0 +1,125 @@
+"""Admin changelists that stay fast on tables with millions of rows.
+
+``LargeTableAdminMixin`` goes in front of ``admin.ModelAdmin``:
+
+``list_only``
+    The fields the changelist rows need (``order__customer_name`` style
+    for ``list_select_related`` relations); the rest are deferred, so a
+    page does not load descriptions and specifications it never shows.
+    Only the page of rows is projected: actions get the full rows, so
+    an export does not fetch each deferred field row by row.
+``search_prefix_fields``
+    Fields searched with an index-friendly range (``field >= term AND
+    field < term + U+10FFFF``) instead of ``LIKE '%term%'``, which has to
+    scan the table. Prefixes match case-sensitively: the term as typed and
+    with its first letter capitalised. A numeric term also matches
+    ``search_id_field`` (the primary key unless set). ``search_fts`` instead hands the search to
+    ``shop.search.search_products`` (products only).
+Counts
+    The paginator estimates the row count of an unfiltered table with
+    ``ESTIMATE_ABOVE`` rows or more (see ``estimated_count``) instead of
+    running COUNT(*), and the "N total" count beside filtered results is
+    not shown.
+
+Foreign keys on these admins use ``raw_id_fields`` or
+``autocomplete_fields`` so their forms never render a select listing
+every row.
+"""
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from . import search
+
+# Unfiltered tables at least this big get an estimated count.
+ESTIMATE_ABOVE = 100_000
+PREFIX_END = '\U0010ffff'
+
+
+def table_estimate(model, using='default'):
+    """Roughly how many rows ``model``'s table holds, without counting them.
+
+    SQLite: the span of the integer primary key (an upper bound: deleted
+    rows leave gaps). PostgreSQL: the planner's ``reltuples``. None
+    elsewhere.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite' and model._meta.pk.get_internal_type() in ('AutoField', 'BigAutoField'):
+            pk = connection.ops.quote_name(model._meta.pk.column)
+            # Separate subqueries: SQLite only answers a bare MIN()/MAX() from
+            # the index, MAX(id) - MIN(id) in one SELECT scans the table.
+            cursor.execute(f'SELECT (SELECT MAX({pk}) FROM {table}) - (SELECT MIN({pk}) FROM {table}) + 1')
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return (row[0] or 0) if row else 0
+
+
+def estimated_count(queryset):
+    """``queryset.count()``, estimated for an unfiltered big table."""
+    if not queryset.query.where:
+        estimate = table_estimate(queryset.model, queryset.db)
+        if estimate is not None and estimate >= ESTIMATE_ABOVE:
+            return estimate
+    return queryset.count()
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list)
+
+
+def prefix_filter(fields, term):
+    """Q matching rows where any of ``fields`` starts with ``term``, using their indexes."""
+    condition = Q()
+    for variant in {term, term[:1].upper() + term[1:]}:
+        for field in fields:
+            condition |= Q(**{f'{field}__gte': variant, f'{field}__lt': variant + PREFIX_END})
+    return condition
+
+
+class LargeTableAdminMixin:
+    list_only = ()
+    search_prefix_fields = ()
+    search_id_field = 'pk'
+    search_fts = False
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_fields(self, request):
+        # The search box is shown only when there are search fields.
+        return super().get_search_fields(request) or self.search_prefix_fields
+
+    def get_changelist(self, request, **kwargs):
+        ChangeList = super().get_changelist(request, **kwargs)
+        only = self.list_only
+        if not only:
+            return ChangeList
+
+        class ProjectedChangeList(ChangeList):
+            def get_results(self, request):
+                queryset = self.queryset
+                self.queryset = queryset.only(*only)
+                try:
+                    super().get_results(request)
+                finally:
+                    self.queryset = queryset
+
+        return ProjectedChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term or not (self.search_prefix_fields or self.search_fts):
+            return super().get_search_results(request, queryset, search_term)
+        if self.search_fts:
+            return search.search_products(queryset, term), False
+        condition = prefix_filter(self.search_prefix_fields, term)
+        if term.isdigit() and len(term) < 19:
+            condition |= Q(**{self.search_id_field: int(term)})
+        return queryset.filter(condition), False
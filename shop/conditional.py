@@ -0,0 +1,140 @@
+"""Conditional GET for the storefront pages.
+
+``conditional_page`` works out a page's validators before its view runs
+and answers ``304 Not Modified`` when the browser's copy is still good, so
+an unchanged page costs a few cache reads and no template rendering (a
+product page also needs one lookup by slug for its product's state).
+
+A page changes when the catalog version does (catalog writes bump it;
+stock reservations only when a flash sale sells out), when the flash-sale
+segment changes (a sale starts or ends), when its product's
+``updated_at``, stock or flash-sale allotment does, and with the
+visitor: the user shown in the navbar and the CSRF secret behind the
+page's forms. The ETag hashes all of these; it is weak because the CSRF
+token in the body is masked differently on every render.
+``Last-Modified`` is the latest of the catalog change time, the segment
+start and ``updated_at``. It cannot see the visitor, so a request that
+carries cookies is only answered 304 on its ETag.
+
+Pages are sent with ``Cache-Control: private, no-cache``: the browser may
+keep them but must revalidate every time.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.db.utils import OperationalError, ProgrammingError
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .cache import catalog_changed_at, catalog_version
+from .flash_sales import get_timeline
+from .models import Product
+
+
+def _etag(request, key):
+    # The CSRF secret the page's forms were (or will be) signed with: the
+    # view may hand out a new one, so the ETag is redone after it runs.
+    user = getattr(request, 'user', None)
+    user_id = user.pk if user is not None and user.is_authenticated else ''
+    visitor = f'{user_id}:{request.META.get("CSRF_COOKIE", "")}'
+    return f'W/"{hashlib.sha1(f"{key}:{visitor}".encode()).hexdigest()}"'
+
+
+def _validators(parts, modified):
+    key = ':'.join(str(part) for part in (getattr(settings, 'SHOP_PAGE_VERSION', 1), *parts))
+    return key, int(max(stamp.timestamp() for stamp in modified if stamp))
+
+
+def _catalog_state():
+    now = timezone.now()
+    version = catalog_version()
+    segment = get_timeline(version).segment_start(now)
+    return version, segment, catalog_changed_at(version)
+
+
+def home_validators(request):
+    version, segment, changed = _catalog_state()
+    return _validators(['home', version, segment and segment.timestamp()], [changed, segment])
+
+
+# What a product page shows that can change without bumping the catalog
+# version: reserve_stock and restock write these with update(), and touch
+# updated_at so Last-Modified moves too.
+PRODUCT_STATE_FIELDS = ('updated_at', 'stock', 'flash_sale_stock', 'flash_sale_sold_out')
+
+
+def _product_state(slug):
+    # Read on every request (one lookup on the unique slug index), not cached
+    # per catalog version: checkouts change stock without bumping it.
+    rows = Product.objects.filter(slug=slug, is_active=True).order_by().values_list(*PRODUCT_STATE_FIELDS)
+    return next(iter(rows[:1]), None)
+
+
+def product_validators(request, slug):
+    """Validators of a product page; None (let the view 404) for an unknown slug."""
+    version, segment, changed = _catalog_state()
+    state = _product_state(slug)
+    if state is None:
+        return None
+    updated_at, *stock = state
+    parts = ['product', slug, updated_at.timestamp(), *stock, version, segment and segment.timestamp()]
+    return _validators(parts, [changed, segment, updated_at])
+
+
+def _check(request, compute, args, kwargs):
+    """``(key, last_modified, response)``; response is a 304 or None."""
+    if request.method not in ('GET', 'HEAD') or len(messages.get_messages(request)):
+        # Pending messages must be rendered, not answered from the browser cache.
+        return None, None, None
+    try:
+        validators = compute(request, *args, **kwargs)
+    except (OperationalError, ProgrammingError):
+        return None, None, None
+    if validators is None:
+        return None, None, None
+    key, last_modified = validators
+    response = get_conditional_response(
+        request, etag=_etag(request, key), last_modified=None if request.COOKIES else last_modified,
+    )
+    if response is not None:
+        _finish(request, response, key, last_modified)
+    return key, last_modified, response
+
+
+def _finish(request, response, key, last_modified):
+    if key is not None and response.status_code in (200, 304):
+        response.headers.setdefault('ETag', _etag(request, key))
+        response.headers.setdefault('Last-Modified', http_date(last_modified))
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_page(compute):
+    """Decorate a storefront view with validators from ``compute(request, *args, **kwargs)``.
+
+    ``compute`` returns ``(key, last_modified_timestamp)`` or None (no
+    validators); the ETag is ``key`` plus the visitor. Works on sync and
+    async views.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                key, last_modified, response = await sync_to_async(_check)(request, compute, args, kwargs)
+                if response is not None:
+                    return response
+                return _finish(request, await view(request, *args, **kwargs), key, last_modified)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key, last_modified, response = _check(request, compute, args, kwargs)
+            if response is not None:
+                return response
+            return _finish(request, view(request, *args, **kwargs), key, last_modified)
+        return wrapper
+    return decorator
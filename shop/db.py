@@ -0,0 +1,126 @@
+"""SQLite settings for production and the read/write database router.
+
+``sqlite_databases`` builds ``settings.DATABASES`` for one SQLite file:
+
+``default``
+    The primary. WAL journal (readers never wait for a writer and a writer
+    never waits for readers), ``synchronous=NORMAL`` (durable at each WAL
+    checkpoint rather than each commit, which is safe with WAL),
+    ``busy_timeout`` so a writer queues for the lock instead of failing with
+    "database is locked", a memory-mapped file and a larger page cache.
+    Transactions stay ``DEFERRED``: the shop's write transactions
+    (``reserve_stock``, the importers) write first, and taking the lock at
+    ``BEGIN IMMEDIATE`` instead measured slower under contention. A
+    transaction that reads and only then writes can still fail at once
+    if another write commits in between; write first where it matters.
+``replica``
+    A second connection to the same file with ``query_only`` set, for
+    storefront reads.
+
+Both keep their connections open between requests (``CONN_MAX_AGE``), so
+the pragmas run once per connection, not once per request.
+
+``ReadReplicaRouter`` sends reads to the replica only inside a view
+decorated with ``storefront_reads`` and only outside a transaction on the
+primary. Everything else (checkout, carts, the admin, management
+commands) reads and writes on the primary and sees its own writes.
+"""
+import contextvars
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.db import connections
+from django.db.utils import OperationalError
+
+PRIMARY = 'default'
+REPLICA = 'replica'
+CONN_MAX_AGE = 600
+BUSY_TIMEOUT_MS = 5000
+PRAGMAS = (
+    ('busy_timeout', BUSY_TIMEOUT_MS),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+    # Negative: KiB rather than pages; per connection.
+    ('cache_size', -32 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+
+_storefront = contextvars.ContextVar('shop_storefront_reads', default=False)
+
+
+def init_command(pragmas):
+    return '; '.join(f'PRAGMA {name} = {value}' for name, value in pragmas)
+
+
+def sqlite_database(name, read_only=False, test=None):
+    """One ``DATABASES`` entry for the SQLite file ``name``."""
+    # busy_timeout first, so the pragmas after it wait for a lock too.
+    pragmas = PRAGMAS + ((('query_only', 'ON'),) if read_only else (('journal_mode', 'WAL'),))
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'OPTIONS': {'init_command': init_command(pragmas)},
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': test or {},
+    }
+
+
+def sqlite_databases(name, test_name=None):
+    """``DATABASES`` with the primary and a read-only replica of ``name``."""
+    return {
+        PRIMARY: sqlite_database(name, test={'NAME': test_name} if test_name else None),
+        # The test runner points the replica at the test database as a mirror.
+        REPLICA: sqlite_database(name, read_only=True, test={'MIRROR': PRIMARY}),
+    }
+
+
+def is_busy(exc):
+    """Whether ``exc`` is SQLite giving up on a lock (as opposed to, say, a missing table)."""
+    message = str(exc)
+    return isinstance(exc, OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def replica_usable():
+    # Inside a transaction on the primary, read what it has written (this
+    # also keeps a TestCase's reads on the connection holding its rows).
+    return REPLICA in connections.settings and not connections[PRIMARY].in_atomic_block
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _storefront.get() and replica_usable():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same file: objects from either connection may be related.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db == REPLICA else None
+
+
+def storefront_reads(view):
+    """Send the queries of a read-only storefront view to the replica."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            token = _storefront.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _storefront.reset(token)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _storefront.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _storefront.reset(token)
+    return wrapper
@@ -0,0 +1,157 @@
+"""Streaming CSV/JSONL exports of orders and products.
+
+``Export`` yields the file line by line. Objects are read in primary-key
+order with ``.iterator(chunk_size=...)``; order items are prefetched one
+chunk at a time, so memory use stays flat however many rows there are, and
+nothing is buffered before the first line goes out.
+
+CSV has one line per order item (order columns repeated; an order without
+items gets one line with the item columns empty). JSONL has one object per
+order with its items nested. Every line starts with its object's id, so an
+interrupted export resumes with ``after_id`` set to the last id written.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Order, OrderItem, Product
+
+CHUNK_SIZE = 2000
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+ORDER_FIELDS = (
+    'id', 'created_at', 'status', 'payment_method', 'customer_name', 'phone', 'address',
+    'total_amount', 'user_id',
+)
+ITEM_FIELDS = ('product_id', 'product_name', 'quantity', 'unit_price', 'line_total')
+PRODUCT_FIELDS = (
+    'id', 'name', 'slug', 'category_id', 'price', 'flash_sale_price', 'flash_sale_start', 'flash_sale_end',
+    'flash_sale_stock', 'stock', 'is_active', 'is_hot', 'is_best_seller', 'created_at', 'updated_at',
+)
+PRODUCT_STATUSES = {'active': True, 'inactive': False}
+KINDS = {'orders': Order, 'products': Product}
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class _Echo:
+    """File-like object for ``csv.writer`` that hands each line back."""
+
+    def write(self, value):
+        return value
+
+
+class Export:
+    """Lines of one export; ``count`` and ``last_id`` follow what has been yielded.
+
+    ``since``/``until`` are dates (inclusive, shop time zone) on
+    ``created_at``. ``statuses`` are order statuses, or ``active`` /
+    ``inactive`` for products. ``queryset`` narrows the export further
+    (the admin's selection); its ordering is ignored.
+    """
+
+    def __init__(self, kind, fmt, queryset=None, *, since=None, until=None, statuses=None, after_id=None,
+                 header=True, chunk_size=CHUNK_SIZE):
+        if kind not in KINDS:
+            raise ValueError(f'Unknown export {kind!r}; choose from {", ".join(KINDS)}.')
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown format {fmt!r}; choose from {", ".join(FORMATS)}.')
+        model = KINDS[kind]
+        queryset = model.objects.all() if queryset is None else queryset
+        if since is not None:
+            queryset = queryset.filter(created_at__gte=_start_of(since))
+        if until is not None:
+            queryset = queryset.filter(created_at__lt=_start_of(until + timedelta(days=1)))
+        if statuses:
+            queryset = queryset.filter(**self._status_filter(kind, statuses))
+        if after_id is not None:
+            queryset = queryset.filter(pk__gt=after_id)
+        if kind == 'orders':
+            queryset = queryset.prefetch_related(Prefetch('items', queryset=OrderItem.objects.order_by('pk')))
+        self.kind = kind
+        self.fmt = fmt
+        self.queryset = queryset.order_by('pk')
+        self.header = header
+        self.chunk_size = chunk_size
+        self.count = 0
+        self.last_id = after_id
+
+    @staticmethod
+    def _status_filter(kind, statuses):
+        if kind == 'orders':
+            known = {code for code, _ in Order.STATUS_CHOICES}
+            unknown = set(statuses) - known
+            if unknown:
+                raise ValueError(f'Unknown order status: {", ".join(sorted(unknown))}.')
+            return {'status__in': list(statuses)}
+        unknown = set(statuses) - set(PRODUCT_STATUSES)
+        if unknown:
+            raise ValueError(f'Unknown product status: {", ".join(sorted(unknown))}; use active or inactive.')
+        return {'is_active__in': [PRODUCT_STATUSES[status] for status in statuses]}
+
+    @property
+    def content_type(self):
+        return FORMATS[self.fmt]
+
+    @property
+    def filename(self):
+        return f'{self.kind}-{timezone.localdate():%Y%m%d}.{self.fmt}'
+
+    def _objects(self):
+        for obj in self.queryset.iterator(chunk_size=self.chunk_size):
+            yield obj
+            self.count += 1
+            self.last_id = obj.pk
+
+    def __iter__(self):
+        return self._jsonl() if self.fmt == 'jsonl' else self._csv()
+
+    def _csv(self):
+        writer = csv.writer(_Echo())
+        if self.kind == 'orders':
+            if self.header:
+                yield writer.writerow(ORDER_FIELDS + ITEM_FIELDS)
+            for order in self._objects():
+                head = [_value(getattr(order, field)) for field in ORDER_FIELDS]
+                items = order.items.all()
+                if not items:
+                    yield writer.writerow(head + [''] * len(ITEM_FIELDS))
+                for item in items:
+                    yield writer.writerow(head + [_value(getattr(item, field)) for field in ITEM_FIELDS])
+        else:
+            if self.header:
+                yield writer.writerow(PRODUCT_FIELDS)
+            for product in self._objects():
+                yield writer.writerow([_value(getattr(product, field)) for field in PRODUCT_FIELDS])
+
+    def _jsonl(self):
+        fields = ORDER_FIELDS if self.kind == 'orders' else PRODUCT_FIELDS
+        for obj in self._objects():
+            record = {field: _value(getattr(obj, field)) for field in fields}
+            if self.kind == 'orders':
+                record['items'] = [{field: _value(getattr(item, field)) for field in ITEM_FIELDS}
+                                   for item in obj.items.all()]
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def streaming_response(export):
+    response = StreamingHttpResponse(iter(export), content_type=export.content_type)
+    response['Content-Disposition'] = f'attachment; filename="{export.filename}"'
+    return response
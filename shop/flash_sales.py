@@ -0,0 +1,134 @@
+"""Flash-sale timeline: which sales are running, and when that next changes.
+
+The start/end times of every scheduled flash sale split the time axis into
+segments during which the set of running sales is constant. The timeline
+precomputes those segments once per catalog version, so "what is on sale
+now", "when does the strip's countdown end" and "when is the next
+transition" are a bisect over the boundary list: O(log n), no query.
+
+Homepage regions expire exactly at the next transition, and the flash-sale
+strip is cached per segment so ``manage.py flash_sale_worker`` can build the
+next segment's strip a few seconds before a sale opens.
+"""
+import heapq
+from bisect import bisect_right
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .cache import REGION_TIMEOUT, catalog_version, region_key
+from .models import Product
+
+FLASH_STRIP_SIZE = 20
+TIMELINE_TIMEOUT = 24 * 60 * 60
+
+_local = {}
+
+
+class FlashSaleTimeline:
+    def __init__(self, windows):
+        """``windows``: iterable of ``(product_id, start, end)``."""
+        windows = [(pid, start, end) for pid, start, end in windows if start < end]
+        self.boundaries = sorted({t for _, start, end in windows for t in (start, end)})
+        # segments[k] covers [boundaries[k-1], boundaries[k]); the first and
+        # last segments (before the first / after the last boundary) are empty.
+        self.segments = [frozenset()]
+        self.segment_ends_at = [None]
+        # One sweep over the start and end events: a window runs in the
+        # segments with start <= segment start < end.
+        starts = sorted(range(len(windows)), key=lambda i: windows[i][1])
+        ends = sorted(range(len(windows)), key=lambda i: windows[i][2])
+        running, soonest = set(), []  # window indexes; heap of (end, index)
+        next_start = next_end = 0
+        for segment_start in self.boundaries:
+            while next_start < len(starts) and windows[starts[next_start]][1] <= segment_start:
+                index = starts[next_start]
+                running.add(index)
+                heapq.heappush(soonest, (windows[index][2], index))
+                next_start += 1
+            while next_end < len(ends) and windows[ends[next_end]][2] <= segment_start:
+                running.discard(ends[next_end])
+                next_end += 1
+            while soonest and soonest[0][1] not in running:
+                heapq.heappop(soonest)
+            self.segments.append(frozenset(windows[index][0] for index in running))
+            self.segment_ends_at.append(soonest[0][0] if soonest else None)
+
+    @classmethod
+    def from_database(cls):
+        rows = (
+            Product.objects.filter(
+                is_active=True,
+                flash_sale_price__isnull=False,
+                flash_sale_start__isnull=False,
+                flash_sale_end__isnull=False,
+                flash_sale_sold_out=False,
+            )
+            .exclude(flash_sale_price=0)
+            .values_list('pk', 'flash_sale_start', 'flash_sale_end')
+        )
+        return cls(rows)
+
+    def segment(self, at):
+        return bisect_right(self.boundaries, at)
+
+    def segment_start(self, at):
+        index = self.segment(at)
+        return self.boundaries[index - 1] if index else None
+
+    def active_ids(self, at):
+        return self.segments[self.segment(at)]
+
+    def ends_at(self, at):
+        """Earliest end among the sales running at ``at`` (the strip's countdown)."""
+        return self.segment_ends_at[self.segment(at)]
+
+    def next_transition(self, at):
+        index = self.segment(at)
+        return self.boundaries[index] if index < len(self.boundaries) else None
+
+
+def get_timeline(version=None):
+    """The timeline for the current catalog version (memoised per process)."""
+    version = version or catalog_version()
+    if _local.get('version') != version:
+        key = region_key('flash_timeline', version)
+        timeline = cache.get(key)
+        if timeline is None:
+            timeline = FlashSaleTimeline.from_database()
+            cache.set(key, timeline, TIMELINE_TIMEOUT)
+        _local.update(version=version, timeline=timeline)
+    return _local['timeline']
+
+
+def strip_region_name(timeline, at):
+    start = timeline.segment_start(at)
+    return f'flash_sale_strip:{int(start.timestamp()) if start else 0}'
+
+
+def build_strip(timeline, at):
+    ids = timeline.active_ids(at)
+    products = []
+    if ids:
+        products = list(Product.objects.filter(pk__in=ids, is_active=True).order_by('flash_sale_end')[:FLASH_STRIP_SIZE])
+    return {'products': products, 'ends_at': timeline.ends_at(at)}
+
+
+def prewarm_strip(at, version=None):
+    """Build and cache the flash-sale strip for the segment starting at ``at``.
+
+    Returns the region name written, or None when the strip would be empty.
+    """
+    version = version or catalog_version()
+    timeline = get_timeline(version)
+    strip = build_strip(timeline, at)
+    if not strip['products']:
+        return None
+    name = strip_region_name(timeline, at)
+    now = timezone.now()
+    expires_at = timeline.next_transition(at) or at + timedelta(seconds=REGION_TIMEOUT)
+    timeout = int(min((expires_at - now).total_seconds(), (at - now).total_seconds() + REGION_TIMEOUT))
+    if timeout > 0:
+        cache.set(region_key(name, version), strip, timeout)
+    return name
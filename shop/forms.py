@@ -33,4 +33,24 @@ class CheckoutForm(forms.ModelForm):
             'phone': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Enter your phone number'}),
             'address': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Enter your address'}),
             'payment_method': forms.Select(attrs={'class': 'form-control'}),
-        }
\ No newline at end of file
+        }
+
+
+class CatalogImportForm(forms.Form):
+    file = forms.FileField(label='Tệp CSV hoặc JSONL')
+    format = forms.ChoiceField(
+        label='Định dạng',
+        choices=[('', 'Theo đuôi tệp'), ('csv', 'CSV'), ('jsonl', 'JSONL')],
+        required=False,
+    )
+    create_categories = forms.BooleanField(label='Tạo danh mục chưa có', required=False, initial=True)
+
+    def clean(self):
+        cleaned = super().clean()
+        upload = cleaned.get('file')
+        if upload and not cleaned.get('format'):
+            extension = upload.name.rsplit('.', 1)[-1].lower()
+            if extension not in ('csv', 'jsonl'):
+                raise forms.ValidationError('Không nhận ra định dạng tệp; hãy chọn CSV hoặc JSONL.')
+            cleaned['format'] = extension
+        return cleaned
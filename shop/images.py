@@ -0,0 +1,292 @@
+"""Local copies and thumbnails of the hotlinked catalog images.
+
+Product, category, banner and popup images are URLs on other sites. Each
+source is fetched once by ``process``: the original is kept under
+``MEDIA_ROOT/images/`` and resized to the widths of a template *preset*
+in AVIF and WebP. Files are named by the hash of the source's content, so
+they can be cached forever and an image linked from several URLs is
+stored once. One ``SourceImage`` row per URL records the hash and the
+presets done.
+
+Templates use ``{% picture url 'card' %}`` (``shop_images``), which reads
+the cache only: a processed source becomes a ``<picture>`` with a
+``srcset`` per format, anything else points at ``image_proxy_view``. The
+proxy processes the source on its first request and redirects to the
+thumbnail, or to the original URL if it cannot be fetched.
+``process_images`` warms everything ahead of time.
+"""
+import hashlib
+from functools import lru_cache
+from http.client import HTTPException
+from io import BytesIO
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from .models import Banner, Category, Popup, Product, SourceImage
+
+# name: (widths, sizes attribute); the widths cover 1x and 2x screens at
+# the size the templates draw each kind of image.
+PRESETS = {
+    'tile': ((44, 88), '44px'),
+    'cart': ((60, 120), '60px'),
+    'card': ((160, 240, 320, 480), '(min-width: 992px) 240px, 50vw'),
+    'detail': ((360, 540, 720, 1080), '(min-width: 768px) 42vw, 100vw'),
+    'banner': ((480, 960, 1440), '(min-width: 992px) 75vw, 100vw'),
+    'popup': ((280, 560), '280px'),
+}
+# Best first; <picture> lets the browser take the first it supports.
+FORMATS = {
+    'avif': ('image/avif', {'quality': 55}),
+    'webp': ('image/webp', {'quality': 80, 'method': 4}),
+}
+FALLBACK_FORMAT = 'webp'
+# Which presets each model's images are drawn at.
+SOURCES = (
+    (Product, 'image_url', ('card', 'detail', 'cart', 'tile')),
+    (Category, 'image_url', ('tile',)),
+    (Banner, 'image_url', ('banner',)),
+    (Popup, 'image', ('popup',)),
+)
+IMAGE_DIR = 'images'
+CACHE_KEY_PREFIX = 'shop:image'
+SIGNING_SALT = 'shop.images'
+LOCK_TIMEOUT = 60
+FETCH_TIMEOUT = 10
+MAX_BYTES = 10 * 1024 * 1024
+USER_AGENT = 'shop-image-fetcher/1.0'
+PLACEHOLDER_SIZE = 88
+PLACEHOLDER_COLORS = ('#fff0ec', '#ee4d2d')
+
+_placeholders = set()
+
+
+class ImageError(Exception):
+    pass
+
+
+def url_hash(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def is_remote(url):
+    return urlsplit(url or '').scheme in ('http', 'https')
+
+
+def _cache_key(url):
+    return f'{CACHE_KEY_PREFIX}:{url_hash(url)}'
+
+
+def _info(source):
+    return {
+        'status': source.status,
+        'hash': source.content_hash,
+        'width': source.width,
+        'height': source.height,
+        'presets': source.preset_names,
+    }
+
+
+def _remember(source):
+    info = _info(source)
+    cache.set(_cache_key(source.url), info, None)
+    return info
+
+
+def lookup(url):
+    """Cached state of a processed source, or None; never queries the database."""
+    return cache.get(_cache_key(url))
+
+
+def widths(preset, source_width):
+    """Widths actually made for ``preset``: never wider than the source."""
+    return sorted({min(width, source_width) for width in PRESETS[preset][0]})
+
+
+def default_width(preset, source_width):
+    """Width of the plain ``src``: the middle of the preset's widths."""
+    made = widths(preset, source_width)
+    return made[len(made) // 2]
+
+
+def formats():
+    Image.init()
+    return [fmt for fmt in FORMATS if fmt.upper() in Image.SAVE]
+
+
+def variant_name(content_hash, width, fmt):
+    return f'{IMAGE_DIR}/{content_hash[:2]}/{content_hash[:20]}-{width}w.{fmt}'
+
+
+def variant_url(content_hash, width, fmt):
+    return default_storage.url(variant_name(content_hash, width, fmt))
+
+
+@lru_cache(maxsize=4096)
+def proxy_url(url, preset):
+    # Unsigned by time, so the same image always gets the same (cacheable) URL.
+    token = signing.Signer(salt=SIGNING_SALT).sign_object([url, preset], compress=True)
+    return reverse('image_proxy', args=[token])
+
+
+def read_token(token):
+    """``(url, preset)`` of a proxy token; raises ``signing.BadSignature``."""
+    url, preset = signing.Signer(salt=SIGNING_SALT).unsign_object(token)
+    if preset not in PRESETS:
+        raise signing.BadSignature('unknown preset')
+    return url, preset
+
+
+def fetch(url):
+    if not is_remote(url):
+        raise ImageError('not an http(s) URL')
+    limit = getattr(settings, 'SHOP_IMAGE_MAX_BYTES', MAX_BYTES)
+    request = Request(url, headers={'User-Agent': USER_AGENT})
+    try:
+        with urlopen(request, timeout=getattr(settings, 'SHOP_IMAGE_FETCH_TIMEOUT', FETCH_TIMEOUT)) as response:
+            data = response.read(limit + 1)
+    except (OSError, ValueError, HTTPException) as exc:
+        raise ImageError(f'fetch failed: {exc}')
+    if len(data) > limit:
+        raise ImageError(f'larger than {limit} bytes')
+    return data
+
+
+def _open(data):
+    try:
+        image = Image.open(BytesIO(data))
+        image.load()
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        raise ImageError(f'not an image: {exc}')
+    kind = image.format.lower()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        transparent = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+    return image, kind
+
+
+def _save(name, content):
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(content))
+
+
+def _make_variants(image, content_hash, preset):
+    for width in widths(preset, image.width):
+        resized = image
+        if width != image.width:
+            resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        for fmt in formats():
+            name = variant_name(content_hash, width, fmt)
+            if default_storage.exists(name):
+                continue
+            buffer = BytesIO()
+            resized.save(buffer, fmt.upper(), **FORMATS[fmt][1])
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def process(url, presets=None, refresh=False):
+    """Copy ``url`` locally (once, or again with ``refresh``) and make its ``presets``.
+
+    Returns the ``SourceImage``; a source that cannot be fetched or
+    decoded is recorded as failed and only retried with ``refresh``.
+    """
+    presets = list(presets or PRESETS)
+    digest = url_hash(url)
+    source = SourceImage.objects.filter(url_hash=digest).first() or SourceImage(url=url, url_hash=digest)
+    image = None
+    if refresh or source.pk is None:
+        try:
+            data = fetch(url)
+            image, kind = _open(data)
+        except ImageError as exc:
+            source.status, source.error = 'failed', str(exc)[:255]
+            source.save()
+            _remember(source)
+            return source
+        content_hash = hashlib.sha256(data).hexdigest()
+        if content_hash != source.content_hash:
+            source.presets = ''
+        source.content_hash = content_hash
+        source.file = f'{IMAGE_DIR}/{content_hash[:2]}/{content_hash}.{kind}'
+        _save(source.file, data)
+        source.width, source.height = image.size
+        source.status, source.error = 'ready', ''
+    if source.status == 'ready':
+        done = source.preset_names
+        missing = [preset for preset in presets if preset not in done]
+        if missing:
+            if image is None:
+                with default_storage.open(source.file) as file:
+                    image, _ = _open(file.read())
+            for preset in missing:
+                _make_variants(image, source.content_hash, preset)
+            source.presets = ','.join(sorted(set(done) | set(missing)))
+    source.save()
+    _remember(source)
+    return source
+
+
+def redirect_url(url, preset):
+    """Where the proxy sends a browser for ``url`` at ``preset``, processing it if needed."""
+    info = lookup(url)
+    if info is None or (info['status'] == 'ready' and preset not in info['presets']):
+        lock = f'{CACHE_KEY_PREFIX}:lock:{url_hash(url)}'
+        if not cache.add(lock, 1, LOCK_TIMEOUT):
+            # Another request is fetching it right now.
+            return url
+        try:
+            info = _info(process(url, [preset]))
+        finally:
+            cache.delete(lock)
+    if info['status'] != 'ready':
+        return url
+    return variant_url(info['hash'], default_width(preset, info['width']), FALLBACK_FORMAT)
+
+
+def srcset(info, preset, fmt):
+    return ', '.join(f'{variant_url(info["hash"], width, fmt)} {width}w' for width in widths(preset, info['width']))
+
+
+def source_urls():
+    """``{url: presets}`` of every remote image the catalog links to."""
+    urls = {}
+    for model, field, presets in SOURCES:
+        for url in model.objects.exclude(**{field: ''}).values_list(field, flat=True).distinct().iterator():
+            if is_remote(url):
+                urls.setdefault(url, set()).update(presets)
+    return urls
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed-size bitmap font.
+        return ImageFont.load_default()
+
+
+def placeholder_url(text, size=PLACEHOLDER_SIZE):
+    """URL of a locally drawn square tile with ``text`` (an initial) in the shop colours."""
+    background, foreground = PLACEHOLDER_COLORS
+    digest = hashlib.sha256(f'{text}:{size}:{background}:{foreground}'.encode()).hexdigest()
+    name = f'{IMAGE_DIR}/placeholders/{digest[:20]}.png'
+    if (default_storage.location, name) not in _placeholders:
+        if not default_storage.exists(name):
+            image = Image.new('RGB', (size, size), background)
+            draw = ImageDraw.Draw(image)
+            font = _font(size // 2)
+            left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+            draw.text(((size - right - left) / 2, (size - bottom - top) / 2), text, fill=foreground, font=font)
+            buffer = BytesIO()
+            image.save(buffer, 'PNG', optimize=True)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+        _placeholders.add((default_storage.location, name))
+    return default_storage.url(name)
@@ -0,0 +1,302 @@
+"""Bulk catalog import from CSV or JSONL.
+
+Rows are read one at a time, validated and converted with the model fields'
+own ``to_python``, and written in batches of ``batch_size``: executemany
+``UPDATE`` for slugs already in the catalog and ``INSERT ... ON CONFLICT
+(slug) DO UPDATE`` for new ones, in one transaction per batch, followed by
+one re-index of the batch in the search index and a refresh of its
+``effective_price``/``discount_percent`` columns.
+
+* A row with a ``slug`` updates the product with that slug (or creates it).
+  Only the columns present in the row are written on update, so a file
+  with just ``slug,price`` reprices without touching anything else.
+* A row without a slug is a new product. Its slug comes from the folded
+  name and is made unique against every slug in the catalog and in the
+  file (``-2``, ``-3`` ...), all in memory.
+* ``category`` is matched by name (case-insensitive) or slug against an
+  in-memory map; unknown categories are created unless
+  ``create_categories`` is off, in which case the row is rejected.
+
+Invalid rows are skipped and reported with their line numbers. The upsert
+bypasses ``save()`` and model signals, so the homepage regions are
+invalidated once at the end and related products are left to
+``rebuild_related_products``.
+"""
+import csv
+import json
+import time
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connections, models, router, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import search
+from .cache import bump_catalog_version
+from .models import Category, Product
+from .pricing import invalidate_snapshots, refresh_prices
+
+BATCH_SIZE = 1000
+FORMATS = ('csv', 'jsonl')
+IMPORT_FIELDS = (
+    'name', 'slug', 'category', 'price', 'stock', 'description', 'color_options', 'specifications',
+    'image_url', 'flash_sale_price', 'flash_sale_start', 'flash_sale_end', 'flash_sale_stock',
+    'is_active', 'is_hot', 'is_best_seller',
+)
+REQUIRED_FIELDS = ('name', 'price')
+MAX_REPORTED_ERRORS = 100
+SLUG_BASE_LENGTH = 200
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def rows_per_second(self):
+        return round(self.rows / self.seconds) if self.seconds else 0
+
+    def __str__(self):
+        return (
+            f'{self.rows} rows: {self.created} created, {self.updated} updated, '
+            f'{self.error_count} rejected in {self.seconds:.2f}s ({self.rows_per_second} rows/s)'
+        )
+
+
+def read_rows(file, fmt):
+    """Yield ``(line_number, row)`` from a text file; rows are dicts or an error string."""
+    if fmt == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                row = f'invalid JSON: {exc}'
+            yield number, row if isinstance(row, (dict, str)) else 'expected a JSON object'
+    else:
+        raise ValueError(f'Unknown format {fmt!r}; choose from {", ".join(FORMATS)}.')
+
+
+class SlugAllocator:
+    """Hands out slugs unique among ``taken``, which it keeps up to date."""
+
+    def __init__(self, taken):
+        self.taken = taken
+        self.suffixes = {}
+
+    def allocate(self, name):
+        base = slugify(search.fold(name))[:SLUG_BASE_LENGTH].strip('-') or 'san-pham'
+        slug = base
+        suffix = self.suffixes.get(base, 2)
+        while slug in self.taken:
+            slug = f'{base}-{suffix}'
+            suffix += 1
+        self.suffixes[base] = suffix
+        self.taken.add(slug)
+        return slug
+
+
+class CategoryMap:
+    """Category ids by lower-cased name and by slug, creating unknown ones on demand.
+
+    A value is also looked up by its slug, so spellings that slugify alike
+    ("Phu kien", "Phụ kiện") share one category.
+    """
+
+    def __init__(self, create=True):
+        self.create = create
+        self.ids = {}
+        for pk, name, slug in Category.objects.values_list('pk', 'name', 'slug'):
+            self.ids[name.lower()] = self.ids[slug] = pk
+
+    def resolve(self, value):
+        key = value.strip()
+        if not key:
+            return None
+        slug = slugify(key)
+        pk = self.ids.get(key.lower()) or self.ids.get(key) or self.ids.get(slug)
+        if pk is None:
+            if not self.create:
+                raise ValidationError(f'unknown category {key!r}')
+            try:
+                with transaction.atomic():
+                    category = Category.objects.create(name=key)
+            except IntegrityError:
+                # Created by someone else since the map was loaded.
+                raise ValidationError(f'category {key!r} clashes with an existing category (slug {slug!r})')
+            pk = self.ids[key.lower()] = self.ids[category.slug] = category.pk
+        return pk
+
+
+class CatalogImporter:
+    def __init__(self, batch_size=BATCH_SIZE, create_categories=True):
+        self.batch_size = batch_size
+        self.fields = {name: Product._meta.get_field(name) for name in IMPORT_FIELDS if name != 'category'}
+        self.categories = CategoryMap(create_categories)
+        self.existing = set(Product.objects.values_list('slug', flat=True).iterator())
+        self.slugs = SlugAllocator(set(self.existing))
+        self.report = ImportReport()
+        self.db = connections[router.db_for_write(Product)]
+        self.columns = {f.attname: f for f in Product._meta.concrete_fields if not f.primary_key}
+        self.defaults = {name: field.get_default() for name, field in self.columns.items()}
+        self.statements = {}
+
+    def _value(self, name, raw):
+        if name == 'category':
+            return self.categories.resolve(str(raw or ''))
+        field = self.fields[name]
+        if raw is None or raw == '':
+            if name in REQUIRED_FIELDS:
+                raise ValidationError('required')
+            if field.null:
+                return None
+            return field.get_default()
+        if isinstance(field, models.CharField) and not isinstance(raw, str):
+            raw = str(raw)
+        value = field.to_python(raw)
+        if isinstance(value, datetime) and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        if isinstance(field, models.PositiveIntegerField) and value < 0:
+            raise ValidationError('must not be negative')
+        if isinstance(field, models.DecimalField) and value < 0:
+            raise ValidationError('must not be negative')
+        if field.max_length and len(value) > field.max_length:
+            raise ValidationError(f'longer than {field.max_length} characters')
+        if name != 'slug':
+            # max_digits/decimal_places, URLs: what the database would
+            # otherwise reject mid-batch. Slugs are normalised in run().
+            field.run_validators(value)
+        return value
+
+    def clean(self, row):
+        """Model field values of one input row; raises ValidationError."""
+        unknown = set(row) - set(IMPORT_FIELDS)
+        if unknown:
+            raise ValidationError(f'unknown columns: {", ".join(sorted(str(c) for c in unknown))}')
+        values = {}
+        for name, raw in row.items():
+            try:
+                value = self._value(name, raw)
+            except ValidationError as exc:
+                raise ValidationError(f'{name}: {"; ".join(exc.messages)}')
+            values['category_id' if name == 'category' else name] = value
+        return values
+
+    def run(self, rows):
+        """Import ``(line_number, row)`` pairs (see ``read_rows``); returns the report."""
+        started = time.perf_counter()
+        try:
+            batch = {}
+            for line, row in rows:
+                self.report.rows += 1
+                try:
+                    if isinstance(row, str):
+                        raise ValidationError(row)
+                    values = self.clean(row)
+                except ValidationError as exc:
+                    self.report.error(line, '; '.join(exc.messages))
+                    continue
+                slug = values.get('slug')
+                if slug:
+                    slug = slugify(slug)[:Product._meta.get_field('slug').max_length]
+                missing = [name for name in REQUIRED_FIELDS if name not in values]
+                if missing and not (slug and slug in self.slugs.taken):
+                    # Updates may leave columns out; new products may not.
+                    self.report.error(line, f'{", ".join(missing)}: required for a new product')
+                    continue
+                if slug:
+                    self.slugs.taken.add(slug)
+                else:
+                    slug = self.slugs.allocate(values['name'])
+                values['slug'] = slug
+                if slug in batch:
+                    batch[slug] = {**batch[slug], **values}
+                else:
+                    batch[slug] = values
+                if len(batch) >= self.batch_size:
+                    self._write(batch)
+                    batch = {}
+            if batch:
+                self._write(batch)
+        finally:
+            # Each batch commits as it is written: the homepage must see the
+            # ones written before a failure too.
+            if self.report.created or self.report.updated:
+                transaction.on_commit(bump_catalog_version, using=self.db.alias)
+        self.report.seconds = time.perf_counter() - started
+        return self.report
+
+    def _statement(self, columns, update):
+        # One statement per set of columns present: an update writes only the
+        # columns its row had, an insert gets every column.
+        key = (columns, update)
+        if key not in self.statements:
+            quote = self.db.ops.quote_name
+            table = quote(Product._meta.db_table)
+            assignments = ', '.join(
+                f'{quote(name)} = {"%s" if update else f"excluded.{quote(name)}"}'
+                for name in sorted(columns - {'slug'}) + ['updated_at']
+            )
+            if update:
+                sql = f'UPDATE {table} SET {assignments} WHERE {quote("slug")} = %s'
+            else:
+                # ON CONFLICT covers a product created since the import started.
+                sql = (
+                    f'INSERT INTO {table} ({", ".join(quote(field.column) for field in self.columns.values())}) '
+                    f'VALUES ({", ".join(["%s"] * len(self.columns))}) '
+                    f'ON CONFLICT ({quote("slug")}) DO UPDATE SET {assignments}'
+                )
+            self.statements[key] = sql
+        return self.statements[key]
+
+    def _write(self, batch):
+        now = timezone.now()
+        defaults = {**self.defaults, 'created_at': now, 'updated_at': now}
+        defaults = {name: self.columns[name].get_db_prep_save(value, self.db) for name, value in defaults.items()}
+        groups = {}
+        for slug, values in batch.items():
+            prepared = {name: self.columns[name].get_db_prep_save(value, self.db) for name, value in values.items()}
+            update = slug in self.existing
+            if update:
+                row = [prepared[name] for name in sorted(prepared.keys() - {'slug'})] + [defaults['updated_at'], slug]
+            else:
+                row = list({**defaults, **prepared}.values())
+            groups.setdefault((frozenset(values), update), []).append(row)
+        updated = [slug for slug in batch if slug in self.existing]
+        with transaction.atomic(using=self.db.alias):
+            with self.db.cursor() as cursor:
+                for (columns, update), rows in groups.items():
+                    cursor.executemany(self._statement(columns, update), rows)
+            ids = dict(Product.objects.using(self.db.alias).filter(slug__in=list(batch)).values_list('slug', 'pk'))
+            search.index_products(ids.values(), using=self.db.alias)
+            # Raw INSERTs skip Product.save(), which sets the pricing columns.
+            refresh_prices(Product.objects.using(self.db.alias).filter(pk__in=list(ids.values())))
+        if updated:
+            invalidate_snapshots(ids[slug] for slug in updated)
+        self.existing.update(batch)
+        self.report.updated += len(updated)
+        self.report.created += len(batch) - len(updated)
+
+
+def import_catalog(file, fmt, batch_size=BATCH_SIZE, create_categories=True):
+    """Import a CSV/JSONL text stream; returns an ``ImportReport``."""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format {fmt!r}; choose from {", ".join(FORMATS)}.')
+    importer = CatalogImporter(batch_size=batch_size, create_categories=create_categories)
+    return importer.run(read_rows(file, fmt))
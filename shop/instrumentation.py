@@ -0,0 +1,257 @@
+"""Per-request query and timing instrumentation.
+
+``InstrumentationMiddleware`` samples a fraction of requests
+(``SHOP_INSTRUMENTATION_SAMPLE_RATE``, 0 to 1) and records, per URL name,
+the request time, query count, total DB time, template render time and any
+SQL statement run more than once, after its literals are replaced by
+placeholders. A repeat with the same parameters counts too: both an N+1
+and a lookup nobody cached show up. Samples go into a fixed-size ring
+buffer per URL name.
+
+With a sample rate of 0 the middleware removes itself at startup, so an
+unsampled deployment pays nothing; unsampled requests otherwise cost one
+``random()`` call.
+
+The sampled request's recorder lives in a context variable, so it follows
+the request into the async views' event loop and worker threads; stages
+that run on a thread of their own wrap their work in ``recorded`` so the
+queries they issue on that thread's connection are counted too.
+
+Buffers are per process. Every PUBLISH_INTERVAL seconds a process copies
+its buffers into the cache, so ``manage.py instrumentation_report`` and the
+admin page can merge every worker's samples when the cache is shared (a
+process-local cache only ever shows the current process).
+"""
+import contextvars
+import functools
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque, namedtuple
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+from django.urls import Resolver404, resolve
+
+BUFFER_SIZE = 200
+PUBLISH_INTERVAL = 10
+PUBLISH_TIMEOUT = 10 * 60
+PROCESS_KEY_PREFIX = 'shop:instrumentation'
+PROCESS_INDEX_KEY = 'shop:instrumentation:processes'
+
+Sample = namedtuple('Sample', 'duration_ms queries db_ms template_ms duplicates')
+
+_buffers = defaultdict(lambda: deque(maxlen=BUFFER_SIZE))
+_lock = threading.Lock()
+_current = contextvars.ContextVar('shop_instrumentation_recorder', default=None)
+_last_publish = [0.0]
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST_RE = re.compile(r'\(\?(?:\s*,\s*\?)+\)')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """SQL with literals and placeholders folded, so N+1 variants compare equal."""
+    sql = _STRING_RE.sub('?', sql.replace('%s', '?'))
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PLACEHOLDER_LIST_RE.sub('(...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class _Recorder:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()
+        # Concurrent async stages report from several threads.
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.db_time += elapsed
+                self.queries += 1
+                self.statements[fingerprint(sql)] += 1
+
+
+def _wrap_connections(stack, recorder):
+    for conn in connections.all():
+        if recorder not in conn.execute_wrappers:
+            stack.enter_context(conn.execute_wrapper(recorder))
+
+
+def recorded(func):
+    """Wrap ``func`` so the queries it runs on another thread count towards the sampled request."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        recorder = _current.get()
+        if recorder is None:
+            return func(*args, **kwargs)
+        with ExitStack() as stack:
+            _wrap_connections(stack, recorder)
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _instrumented_render(render):
+    def _render(self, context):
+        recorder = _current.get()
+        if recorder is None:
+            return render(self, context)
+        # {% include %} and {% extends %} render nested templates: time the
+        # outermost one only.
+        recorder.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            recorder.template_depth -= 1
+            if not recorder.template_depth:
+                recorder.template_time += time.perf_counter() - started
+
+    _render.instrumented = True
+    return _render
+
+
+def _patch_templates():
+    if not getattr(Template._render, 'instrumented', False):
+        Template._render = _instrumented_render(Template._render)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return '<unresolved>'
+    return match.view_name or match._func_path
+
+
+def record(name, sample):
+    with _lock:
+        _buffers[name].append(sample)
+    now = time.monotonic()
+    if now - _last_publish[0] >= PUBLISH_INTERVAL:
+        _last_publish[0] = now
+        publish()
+
+
+def local_samples():
+    with _lock:
+        return {name: list(samples) for name, samples in _buffers.items()}
+
+
+def publish():
+    """Copy this process's buffers into the cache for other processes to read."""
+    pid = os.getpid()
+    cache.set(f'{PROCESS_KEY_PREFIX}:{pid}', local_samples(), PUBLISH_TIMEOUT)
+    pids = set(cache.get(PROCESS_INDEX_KEY) or ())
+    if pid not in pids:
+        cache.set(PROCESS_INDEX_KEY, pids | {pid}, PUBLISH_TIMEOUT)
+
+
+def collect():
+    """All samples by URL name: this process's buffers plus what others published."""
+    merged = defaultdict(list)
+    for name, samples in local_samples().items():
+        merged[name].extend(samples)
+    pid = os.getpid()
+    others = [f'{PROCESS_KEY_PREFIX}:{p}' for p in cache.get(PROCESS_INDEX_KEY) or () if p != pid]
+    for published in cache.get_many(others).values():
+        for name, samples in published.items():
+            merged[name].extend(samples)
+    return dict(merged)
+
+
+def reset():
+    with _lock:
+        _buffers.clear()
+    pids = cache.get(PROCESS_INDEX_KEY) or ()
+    cache.delete_many([PROCESS_INDEX_KEY] + [f'{PROCESS_KEY_PREFIX}:{p}' for p in pids])
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _distribution(values):
+    ordered = sorted(values)
+    return {f'p{int(q * 100)}': round(_percentile(ordered, q), 2) for q in (0.50, 0.95, 0.99)}
+
+
+def summarize(samples_by_name, top=10):
+    """Percentiles per URL name (slowest p95 first) and the most repeated statements."""
+    views = []
+    duplicates = {}
+    for name, samples in samples_by_name.items():
+        if not samples:
+            continue
+        views.append({
+            'name': name,
+            'requests': len(samples),
+            'duration_ms': _distribution(s.duration_ms for s in samples),
+            'queries': _distribution(s.queries for s in samples),
+            'db_ms': _distribution(s.db_ms for s in samples),
+            'template_ms': _distribution(s.template_ms for s in samples),
+        })
+        for sample in samples:
+            for sql, count in sample.duplicates:
+                entry = duplicates.setdefault(sql, {'sql': sql, 'views': set(), 'requests': 0, 'executions': 0})
+                entry['views'].add(name)
+                entry['requests'] += 1
+                entry['executions'] += count
+    views.sort(key=lambda v: v['duration_ms']['p95'], reverse=True)
+    top_duplicates = sorted(duplicates.values(), key=lambda d: d['executions'], reverse=True)[:top]
+    for entry in top_duplicates:
+        entry['views'] = sorted(entry['views'])
+        entry['per_request'] = round(entry['executions'] / entry['requests'], 1)
+    return {'views': views, 'duplicates': top_duplicates}
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = float(getattr(settings, 'SHOP_INSTRUMENTATION_SAMPLE_RATE', 0))
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        _patch_templates()
+
+    def __call__(self, request):
+        if _current.get() is not None or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        recorder = _Recorder()
+        token = _current.set(recorder)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                _wrap_connections(stack, recorder)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - started
+
+        record(view_name(request), Sample(
+            duration_ms=round(duration * 1000, 3),
+            queries=recorder.queries,
+            db_ms=round(recorder.db_time * 1000, 3),
+            template_ms=round(recorder.template_time * 1000, 3),
+            duplicates=tuple((sql, n) for sql, n in recorder.statements.items() if n > 1),
+        ))
+        return response
@@ -0,0 +1,179 @@
+"""Stock reservation for checkout.
+
+Cart lines are reserved with a conditional UPDATE
+(``stock = stock - n WHERE stock >= n``) instead of read-modify-write, so
+concurrent checkouts on the same product never need a row lock held across
+Python code and can never drive stock below zero. The same statement also
+checks that the price the customer saw is still current and, for flash-sale
+lines, consumes the separate ``flash_sale_stock`` allotment.
+
+``reserve_stock`` must run inside ``transaction.atomic``: if any line fails
+it raises ``InsufficientStock`` and the whole reservation rolls back.
+"""
+from django.db import transaction
+from django.db.models import (
+    Case, F, OuterRef, PositiveIntegerField, PositiveSmallIntegerField, Q, Subquery, Sum, Value, When,
+)
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import OrderItem, Product
+from .pricing import invalidate_snapshots, refresh_prices
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        super().__init__(f'Cannot reserve {quantity} x product #{product.pk}')
+
+
+def flash_window(now):
+    """Q for products whose flash sale is running at ``now``."""
+    return Q(
+        flash_sale_price__isnull=False,
+        flash_sale_start__lte=now,
+        flash_sale_end__gte=now,
+        flash_sale_sold_out=False,
+    ) & ~Q(flash_sale_price=0)
+
+
+def _is_flash_line(product, unit_price):
+    return bool(product.flash_sale_price) and unit_price == product.flash_sale_price
+
+
+def _line_condition(product, quantity, unit_price, now):
+    """Q matching ``product``'s row only if the quoted line can still be honoured."""
+    condition = Q(pk=product.pk, stock__gte=quantity, price=product.price)
+    if _is_flash_line(product, unit_price):
+        condition &= flash_window(now) & Q(flash_sale_price=unit_price) & (
+            Q(flash_sale_stock=0) | Q(flash_sale_stock__gte=quantity)
+        )
+    return condition
+
+
+class _PartialReservation(Exception):
+    pass
+
+
+def reserve_stock(lines, now=None):
+    """Reserve every ``(product, quantity, unit_price)`` line or none of them.
+
+    ``product`` is the instance the price was quoted from; a line only
+    matches if that price still applies, so a stale quote fails instead of
+    being honoured. All lines go out as one UPDATE whatever the cart size.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        raise RuntimeError('reserve_stock() must be called inside transaction.atomic()')
+    now = now or timezone.now()
+    merged = {}
+    for product, quantity, unit_price in lines:
+        if product.pk in merged:
+            merged[product.pk][1] += quantity
+        else:
+            merged[product.pk] = [product, quantity, unit_price]
+    if not merged:
+        return
+    # A fixed order keeps row-locking backends from deadlocking on shared SKUs.
+    lines = [merged[pk] for pk in sorted(merged)]
+
+    condition = ended = Q()
+    stock_cases, flash_stock_cases, sold_out_cases, limited_ids = [], [], [], []
+    for product, quantity, unit_price in lines:
+        condition |= _line_condition(product, quantity, unit_price, now)
+        stock_cases.append(When(pk=product.pk, then=Value(quantity)))
+        if _is_flash_line(product, unit_price):
+            flash_stock_cases.append(
+                When(pk=product.pk, flash_sale_stock__gt=0, then=F('flash_sale_stock') - quantity)
+            )
+            # flash_sale_stock == 0 means "no separate limit", so when the
+            # allotment is used up exactly, flag the sale as sold out; its
+            # schedule is left alone so a top-up can resume it.
+            sold_out_cases.append(When(pk=product.pk, flash_sale_stock=quantity, then=Value(True)))
+            # The sale also ends when a limited sale takes the last of the
+            # stock (see Product.is_in_flash_sale): back to the list price.
+            ended |= Q(pk=product.pk) & (Q(flash_sale_stock=quantity) | Q(flash_sale_stock__gt=0, stock=quantity))
+            if product.flash_sale_stock:
+                limited_ids.append(product.pk)
+
+    updates = {
+        'stock': F('stock') - Case(*stock_cases, output_field=PositiveIntegerField()),
+        # Product pages revalidate on updated_at (shop.conditional).
+        'updated_at': Value(now),
+    }
+    if flash_stock_cases:
+        updates['flash_sale_stock'] = Case(
+            *flash_stock_cases, default=F('flash_sale_stock'), output_field=PositiveIntegerField(),
+        )
+        updates['flash_sale_sold_out'] = Case(*sold_out_cases, default=F('flash_sale_sold_out'))
+        updates['effective_price'] = Case(When(ended, then=F('price')), default=F('effective_price'))
+        updates['discount_percent'] = Case(
+            When(ended, then=Value(0)), default=F('discount_percent'), output_field=PositiveSmallIntegerField(),
+        )
+
+    try:
+        with transaction.atomic():
+            if Product.objects.filter(condition, is_active=True).update(**updates) != len(lines):
+                raise _PartialReservation
+    except _PartialReservation:
+        # The savepoint is rolled back, so the rows are in their original
+        # state again: find the first line that cannot be honoured.
+        available = set(Product.objects.filter(condition, is_active=True).values_list('pk', flat=True))
+        product, quantity, _ = next(line for line in lines if line[0].pk not in available)
+        raise InsufficientStock(product, quantity)
+
+    # update() skips post_save: drop the stale pricing snapshots, and tell
+    # the homepage cache when a sale sold out.
+    transaction.on_commit(lambda: invalidate_snapshots(merged))
+    if limited_ids and Product.objects.filter(Q(flash_sale_sold_out=True) | Q(stock=0), pk__in=limited_ids).exists():
+        transaction.on_commit(bump_catalog_version)
+
+
+def restock(orders):
+    """Put the items of the ``orders`` queryset back in stock, in one UPDATE.
+
+    For cancelled orders. Only ``stock`` is restored: a flash-sale
+    allotment that was used is not handed out again. Lines whose product
+    was deleted are skipped.
+    """
+    items = OrderItem.objects.filter(order__in=orders.order_by().values('pk'), product__isnull=False)
+    product_ids = set(items.values_list('product_id', flat=True))
+    if not product_ids:
+        return
+    returned = items.filter(product=OuterRef('pk')).order_by().values('product').annotate(n=Sum('quantity')).values('n')
+    Product.objects.filter(pk__in=product_ids).update(
+        stock=F('stock') + Subquery(returned, output_field=PositiveIntegerField()),
+        updated_at=timezone.now(),
+    )
+    transaction.on_commit(lambda: _restocked(product_ids))
+
+
+def _restocked(product_ids):
+    """Catch the caches up once returned stock commits (update() skips post_save).
+
+    Sold-out products are back on the listings, and a limited flash sale
+    that ended when it took the last of the stock is running again, so its
+    stored price columns must be recomputed.
+    """
+    invalidate_snapshots(product_ids)
+    # refresh_prices() bumps the catalog version itself when it writes.
+    if not refresh_prices(Product.objects.filter(pk__in=product_ids)):
+        bump_catalog_version()
+
+
+def release(quantities):
+    """Put ``{product_id: quantity}`` back in stock, in one UPDATE.
+
+    For reservations that never became an Order (see
+    ``order_queue.cancel``); like ``restock`` only ``stock`` is restored.
+    Products deleted since the reservation are skipped.
+    """
+    if not quantities:
+        return
+    returned = Case(
+        *(When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()),
+        output_field=PositiveIntegerField(),
+    )
+    Product.objects.filter(pk__in=quantities).update(stock=F('stock') + returned, updated_at=timezone.now())
+    product_ids = set(quantities)
+    transaction.on_commit(lambda: _restocked(product_ids))
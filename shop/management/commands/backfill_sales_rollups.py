@@ -0,0 +1,26 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the hourly/daily/monthly sales rollups from the order history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only rebuild from this date (YYYY-MM-DD, rounded down to its month).')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = timezone.make_aware(datetime.strptime(options['since'], '%Y-%m-%d'))
+            except ValueError:
+                raise CommandError('--since must be a date like 2024-01-31.')
+        started = time.perf_counter()
+        count = rebuild_rollups(since)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} rollup rows in {elapsed:.2f}s.'))
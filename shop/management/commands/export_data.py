@@ -0,0 +1,53 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.exports import CHUNK_SIZE, FORMATS, KINDS, Export
+
+
+def _date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date {value!r}; use YYYY-MM-DD.')
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream orders (with their items) or products as CSV or JSONL with constant memory. '
+        'Interrupted exports resume with --after-id <last id> --append.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(KINDS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--since', type=_date, help='First creation date to include (YYYY-MM-DD).')
+        parser.add_argument('--until', type=_date, help='Last creation date to include (YYYY-MM-DD).')
+        parser.add_argument('--status', action='append', dest='statuses', default=[],
+                            help='Order status, or active/inactive for products (repeatable).')
+        parser.add_argument('--after-id', type=int, help='Only export ids greater than this one.')
+        parser.add_argument('--output', help='Write to this file instead of stdout.')
+        parser.add_argument('--append', action='store_true',
+                            help='Append to --output and leave out the CSV header (for resuming).')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            export = Export(
+                options['kind'], options['format'],
+                since=options['since'], until=options['until'], statuses=options['statuses'],
+                after_id=options['after_id'], header=not options['append'], chunk_size=options['chunk_size'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options['output']:
+            mode = 'a' if options['append'] else 'w'
+            with open(options['output'], mode, encoding='utf-8', newline='') as out:
+                out.writelines(export)
+        else:
+            for line in export:
+                self.stdout.write(line, ending='')
+
+        resume = f' Resume with --after-id {export.last_id} --append.' if export.last_id is not None else ''
+        self.stderr.write(f'Exported {export.count} {options["kind"]}; last id {export.last_id}.{resume}')
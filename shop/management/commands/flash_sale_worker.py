@@ -0,0 +1,68 @@
+import time
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop.cache import catalog_version
+from shop.flash_sales import get_timeline, prewarm_strip
+from shop.pricing import refresh_prices
+
+
+class Command(BaseCommand):
+    help = (
+        'Pre-warm the homepage flash-sale strip a few seconds before each '
+        'flash-sale transition, so the traffic spike at sale start hits a warm cache, '
+        'and update the products\' effective price and discount as each transition passes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lead', type=float, default=5.0,
+                            help='Seconds before a transition to build its strip (default 5).')
+        parser.add_argument('--poll', type=float, default=30.0,
+                            help='Longest sleep between timeline checks (default 30).')
+        parser.add_argument('--once', action='store_true',
+                            help='Pre-warm the next transition if it is within --lead seconds, then exit.')
+
+    def handle(self, *args, **options):
+        if isinstance(caches['default'], (LocMemCache, DummyCache)):
+            # The strips it builds and the versions it bumps would never
+            # reach the web processes.
+            raise CommandError(
+                'flash_sale_worker needs a cache shared with the web processes; '
+                'the default cache is process-local. Configure CACHES (see settings.py).'
+            )
+        lead = timedelta(seconds=options['lead'])
+        poll = options['poll']
+        warmed = set()
+        repriced = object()  # the segment last repriced; none yet
+        while True:
+            now = timezone.now()
+            segment = get_timeline().segment_start(now)
+            if segment != repriced:
+                repriced = segment
+                changed = refresh_prices(now=now)
+                if changed:
+                    # Repricing bumped the catalog version: build the strip
+                    # of the running segment again under the new one.
+                    name = prewarm_strip(now)
+                    self.stdout.write(f'{now:%H:%M:%S} repriced {len(changed)} products, re-warmed {name or "empty strip"}')
+            version = catalog_version()
+            upcoming = get_timeline(version).next_transition(now)
+            if upcoming is not None and upcoming - now <= lead and (version, upcoming) not in warmed:
+                name = prewarm_strip(upcoming, version)
+                warmed.add((version, upcoming))
+                self.stdout.write(f'{now:%H:%M:%S} pre-warmed {name or "empty strip"} for {upcoming:%H:%M:%S}')
+            if options['once']:
+                return
+            if upcoming is None:
+                delay = poll
+            elif (version, upcoming) in warmed:
+                # Sleep past the transition before looking for the next one.
+                delay = (upcoming - now).total_seconds() + 0.01
+            else:
+                delay = (upcoming - lead - now).total_seconds()
+            time.sleep(min(poll, max(delay, 0.01)))
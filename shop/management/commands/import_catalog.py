@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.imports import BATCH_SIZE, FORMATS, import_catalog
+
+
+class Command(BaseCommand):
+    help = 'Import or update products from a CSV or JSONL file in batched upserts keyed on slug.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file; "-" reads stdin.')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--no-create-categories', action='store_true',
+                            help='Reject rows naming an unknown category instead of creating it.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if fmt not in FORMATS:
+            raise CommandError('Cannot tell the format from the file name; pass --format.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        def run(file):
+            return import_catalog(file, fmt, batch_size=options['batch_size'],
+                                  create_categories=not options['no_create_categories'])
+
+        if path == '-':
+            report = run(sys.stdin)
+        else:
+            try:
+                with open(path, encoding='utf-8-sig', newline='') as file:
+                    report = run(file)
+            except OSError as exc:
+                raise CommandError(str(exc))
+        for line, message in report.errors:
+            self.stderr.write(f'line {line}: {message}')
+        if report.error_count > len(report.errors):
+            self.stderr.write(f'... and {report.error_count - len(report.errors)} more rejected rows')
+        self.stdout.write(self.style.SUCCESS(f'Imported {report}.'))
@@ -0,0 +1,62 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+
+from shop import instrumentation
+
+
+class Command(BaseCommand):
+    help = (
+        'Report p50/p95/p99 request time, query count, DB and template time per '
+        'URL name, and the most repeated SQL, from the instrumentation buffers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Repeated statements to show (default 10).')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+        parser.add_argument('--path', action='append', default=[], dest='paths',
+                            help='Request this path in-process with sampling on before reporting '
+                                 '(repeatable). Useful with a process-local cache.')
+        parser.add_argument('--repeat', type=int, default=5, help='Requests per --path (default 5).')
+        parser.add_argument('--reset', action='store_true', help='Clear all buffers after reporting.')
+
+    def handle(self, *args, **options):
+        if options['paths']:
+            with override_settings(SHOP_INSTRUMENTATION_SAMPLE_RATE=1.0, ALLOWED_HOSTS=['testserver']):
+                client = Client()
+                for path in options['paths']:
+                    for _ in range(options['repeat']):
+                        client.get(path)
+
+        report = instrumentation.summarize(instrumentation.collect(), top=options['top'])
+        if options['reset']:
+            instrumentation.reset()
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if not report['views']:
+            self.stdout.write('No samples. Set SHOP_INSTRUMENTATION_SAMPLE_RATE or pass --path.')
+            return
+
+        header = f'{"view":<28}{"n":>6}{"ms p50/p95/p99":>24}{"queries p50/p95/p99":>24}{"db p95":>9}{"tpl p95":>9}'
+        self.stdout.write(header)
+        for view in report['views']:
+            d, q = view['duration_ms'], view['queries']
+            self.stdout.write(
+                f'{view["name"]:<28}{view["requests"]:>6}'
+                f'{_triple(d):>24}{_triple(q):>24}'
+                f'{view["db_ms"]["p95"]:>9}{view["template_ms"]["p95"]:>9}'
+            )
+        if report['duplicates']:
+            self.stdout.write('\nRepeated statements (executions, per request, views):')
+            for entry in report['duplicates']:
+                self.stdout.write(
+                    f'{entry["executions"]:>6} x{entry["per_request"]:<6} {", ".join(entry["views"])}\n'
+                    f'       {entry["sql"][:200]}'
+                )
+
+
+def _triple(distribution):
+    return f'{distribution["p50"]}/{distribution["p95"]}/{distribution["p99"]}'
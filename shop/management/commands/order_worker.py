@@ -0,0 +1,60 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop.order_queue import BATCH_SIZE, LEASE, run_worker
+
+
+class Command(BaseCommand):
+    help = (
+        'Drain the queued-checkout intake (SHOP_ORDER_INTAKE = "queued"): '
+        'turn pending orders into Orders in batches, one transaction per batch.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Worker processes (default 1).')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help=f'Pending orders per batch (default {BATCH_SIZE}).')
+        parser.add_argument('--lease', type=float, default=LEASE,
+                            help=f'Seconds before a crashed worker\'s batch is retried (default {LEASE}).')
+        parser.add_argument('--poll', type=float, default=0.5,
+                            help='Sleep when the queue is empty (default 0.5).')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        kwargs = {
+            'batch_size': options['batch_size'], 'lease': options['lease'],
+            'poll': options['poll'], 'once': options['once'],
+        }
+        if options['processes'] <= 1:
+            total = run_worker(log=self.stdout.write, **kwargs)
+            if options['once']:
+                self.stdout.write(f'Materialised {total} pending orders')
+            return
+        # Children must open their own SQLite connections.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=_work, kwargs=kwargs, daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+
+
+def _work(**kwargs):
+    try:
+        run_worker(**kwargs)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connections.close_all()
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import images
+from shop.models import SourceImage
+
+
+class Command(BaseCommand):
+    help = 'Fetch the catalog images linked from other sites and make their local thumbnails.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Fetch sources that failed before again.')
+        parser.add_argument('--refresh', action='store_true',
+                            help='Fetch every source again, picking up images changed at the same URL.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        failed = set(SourceImage.objects.filter(status='failed').values_list('url_hash', flat=True))
+        counts = {'ready': 0, 'failed': 0}
+        for url, presets in images.source_urls().items():
+            refresh = options['refresh'] or (options['retry_failed'] and images.url_hash(url) in failed)
+            source = images.process(url, presets, refresh=refresh)
+            counts[source.status] += 1
+            if source.status == 'failed':
+                self.stderr.write(f'{url}: {source.error}')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{counts["ready"]} images ready, {counts["failed"]} failed in {elapsed:.2f}s.'
+        ))
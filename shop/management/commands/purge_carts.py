@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from shop.carts import CART_COOKIE_AGE, purge_carts
+
+
+class Command(BaseCommand):
+    help = 'Delete anonymous database carts that nobody has changed for a while.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=CART_COOKIE_AGE / 86400,
+                            help='Days since the last change (default: the cart_id cookie lifetime, 30).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = purge_carts(timedelta(days=options['older_than']), options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} abandoned cart lines.'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.related import rebuild_related, refresh_stale
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed related products of the whole catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', action='store_true',
+                            help='Only refresh lists flagged stale by new orders (cheap; run it often).')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['stale']:
+            count = refresh_stale()
+            message = f'Refreshed {count} stale related-product lists'
+        else:
+            count = rebuild_related()
+            message = f'Wrote {count} related-product lists'
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'{message} in {elapsed:.2f}s.'))
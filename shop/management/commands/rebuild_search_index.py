@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index (SQLite FTS5).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not search.fts_available(using):
+            raise CommandError(
+                'Full-text index is not available on this database; '
+                'run "python manage.py migrate" on SQLite first.'
+            )
+        started = time.perf_counter()
+        count = search.rebuild_index(using)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products in {elapsed:.2f}s.'))
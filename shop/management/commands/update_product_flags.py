@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from shop.analytics import product_flags, update_product_flags
+
+
+class Command(BaseCommand):
+    help = 'Set is_best_seller and is_hot from recent sales velocity (run it from cron).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Print the product ids without saving.')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            best, hot = product_flags()
+            self.stdout.write(f'Best sellers: {best}\nHot: {hot}')
+            return
+        changed = update_product_flags()
+        self.stdout.write(self.style.SUCCESS(f'Updated flags on {changed} products.'))
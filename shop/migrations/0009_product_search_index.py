@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from shop import search
+
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    search.create_index(connection)
+    search.rebuild_index(connection.alias, apps.get_model('shop', 'Product').objects)
+
+
+def drop_search_index(apps, schema_editor):
+    from shop import search
+
+    if schema_editor.connection.vendor == 'sqlite':
+        search.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_product_is_best_seller_product_is_hot_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_product_storefront_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProductList',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='related_list', serialize=False, to='shop.product')),
+                ('product_ids', models.TextField(blank=True)),
+                ('is_stale', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'Sản phẩm liên quan',
+                'verbose_name_plural': 'Sản phẩm liên quan',
+                'indexes': [models.Index(condition=models.Q(('is_stale', True)), fields=['product'], name='related_list_stale_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_related_products'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_key', models.CharField(max_length=40)),
+                ('quantity', models.PositiveIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product')),
+            ],
+            options={
+                'verbose_name': 'Giỏ hàng',
+                'verbose_name_plural': 'Giỏ hàng',
+                'constraints': [models.UniqueConstraint(fields=('cart_key', 'product'), name='cart_item_line_uniq')],
+            },
+        ),
+    ]
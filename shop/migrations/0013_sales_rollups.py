@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_cart_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Giờ'), ('day', 'Ngày'), ('month', 'Tháng')], max_length=5)),
+                ('bucket', models.DateTimeField()),
+                ('status', models.CharField(choices=[('new', 'Mới'), ('paid', 'Xác nhận'), ('ship', 'Đang giao'), ('done', 'Hoàn tất'), ('cancel', 'Hủy')], max_length=20)),
+                ('payment_method', models.CharField(choices=[('cod', 'Thanh toán khi nhận hàng (COD)'), ('bank', 'Chuyển khoản ngân hàng')], max_length=20)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Doanh thu đơn hàng',
+                'verbose_name_plural': 'Doanh thu đơn hàng',
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket', 'status', 'payment_method'), name='order_rollup_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Giờ'), ('day', 'Ngày'), ('month', 'Tháng')], max_length=5)),
+                ('bucket', models.DateTimeField()),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('orders', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='shop.category')),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='shop.product')),
+            ],
+            options={
+                'verbose_name': 'Doanh số sản phẩm',
+                'verbose_name_plural': 'Doanh số sản phẩm',
+                'indexes': [models.Index(fields=['period', 'bucket', 'product', 'category', 'units', 'revenue'], name='sales_rollup_cover_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket', 'product'), name='sales_rollup_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SourceImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=2000)),
+                ('url_hash', models.CharField(max_length=64, unique=True)),
+                ('content_hash', models.CharField(blank=True, max_length=64)),
+                ('file', models.CharField(blank=True, help_text='Ảnh gốc trong MEDIA_ROOT', max_length=200)),
+                ('width', models.PositiveIntegerField(default=0)),
+                ('height', models.PositiveIntegerField(default=0)),
+                ('presets', models.CharField(blank=True, max_length=200)),
+                ('status', models.CharField(choices=[('ready', 'Đã xử lý'), ('failed', 'Lỗi')], max_length=10)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('fetched_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Ảnh nguồn',
+                'verbose_name_plural': 'Ảnh nguồn',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_source_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.CharField(max_length=20, unique=True)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('queued', 'Chờ xử lý'), ('done', 'Đã tạo đơn'), ('failed', 'Lỗi')], default='queued', max_length=10)),
+                ('claim', models.CharField(blank=True, max_length=100)),
+                ('claimed_until', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pending', to='shop.order')),
+            ],
+            options={
+                'verbose_name': 'Đơn chờ xử lý',
+                'verbose_name_plural': 'Đơn chờ xử lý',
+                'indexes': [models.Index(condition=models.Q(('status', 'queued')), fields=['claimed_until', 'id'], name='pending_order_queued_idx')],
+            },
+        ),
+    ]
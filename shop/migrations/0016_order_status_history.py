@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_pending_orders'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('new', 'Mới'), ('paid', 'Xác nhận'), ('ship', 'Đang giao'), ('done', 'Hoàn tất'), ('cancel', 'Hủy')], max_length=20)),
+                ('to_status', models.CharField(choices=[('new', 'Mới'), ('paid', 'Xác nhận'), ('ship', 'Đang giao'), ('done', 'Hoàn tất'), ('cancel', 'Hủy')], max_length=20)),
+                ('changed_at', models.DateTimeField()),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_changes', to='shop.order')),
+            ],
+            options={
+                'verbose_name': 'Lịch sử trạng thái',
+                'verbose_name_plural': 'Lịch sử trạng thái',
+                'ordering': ['changed_at', 'id'],
+            },
+        ),
+    ]
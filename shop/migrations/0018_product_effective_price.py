@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:07
+
+from django.db import migrations, models
+
+
+def backfill_pricing(apps, schema_editor):
+    from django.utils import timezone
+
+    from shop.models import current_pricing
+
+    Product = apps.get_model('shop', 'Product')
+    products = Product.objects.using(schema_editor.connection.alias)
+    products.update(effective_price=models.F('price'))
+    now = timezone.now()
+    running = products.filter(
+        flash_sale_price__isnull=False, flash_sale_start__lte=now, flash_sale_end__gte=now,
+    )
+    changed = []
+    for product in running.iterator(chunk_size=1000):
+        product.flash_sale_sold_out = False  # added by 0019
+        product.effective_price, product.discount_percent = current_pricing(product, now)
+        changed.append(product)
+    products.bulk_update(changed, ['effective_price', 'discount_percent'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_admin_changelist_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='discount_percent',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(backfill_pricing, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['effective_price', 'id'], name='product_active_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', 'effective_price', 'id'], name='product_active_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['discount_percent', 'id'], name='product_active_discount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', 'discount_percent', 'id'], name='product_active_cat_disc_idx'),
+        ),
+    ]
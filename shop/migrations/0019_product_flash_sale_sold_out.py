@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='flash_sale_sold_out',
+            field=models.BooleanField(default=False, help_text='Đã hết suất Flash Sale (bỏ chọn để mở bán lại)'),
+        ),
+    ]
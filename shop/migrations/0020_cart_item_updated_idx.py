@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_product_flash_sale_sold_out'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['updated_at'], name='cart_item_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_cart_item_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pendingorder',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Chờ xử lý'), ('done', 'Đã tạo đơn'), ('failed', 'Lỗi'), ('cancelled', 'Đã hủy')], default='queued', max_length=10),
+        ),
+    ]
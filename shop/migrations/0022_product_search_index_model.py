@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:40
+
+import django.db.models.deletion
+import shop.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0021_pending_order_cancelled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='shop.product')),
+                ('document', shop.models.FullTextField(db_column='shop_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'shop_product_fts',
+                'managed': False,
+            },
+        ),
+    ]
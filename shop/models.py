@@ -1,4 +1,7 @@
+from decimal import ROUND_HALF_UP, Decimal
+
 from django.db import models
+from django.utils import timezone
 from django.utils.text import slugify
 from django.contrib.auth import get_user_model
 
@@ -22,13 +25,31 @@ class Popup(models.Model):
 
     def __str__(self):
         return self.title
-    
+
+
+class CategoryQuerySet(models.QuerySet):
+    def with_thumbnail(self):
+        """Annotate ``thumbnail_url``: newest active product image of each category.
+
+        Done as one correlated subquery so building the homepage tiles costs a
+        single query regardless of how many categories exist.
+        """
+        first_image = (
+            Product.objects.filter(is_active=True, category=models.OuterRef('pk'))
+            .exclude(image_url='')
+            .order_by('-created_at')
+            .values('image_url')[:1]
+        )
+        return self.annotate(thumbnail_url=models.Subquery(first_image))
+
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=120, unique=True, blank=True)
     image_url = models.URLField(blank=True, help_text='URL ảnh đại diện cho danh mục (tùy chọn)')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CategoryQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Danh mục'
         verbose_name_plural = 'Danh mục'
@@ -42,6 +63,40 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+def discount_percent(price, sale_price):
+    """Whole percent ``sale_price`` takes off ``price`` (halves round up), 0 without a discount."""
+    if not sale_price or not price or price <= 0:
+        return 0
+    # str() first: fixtures and scripts may assign ints or floats.
+    price, sale_price = Decimal(str(price)), Decimal(str(sale_price))
+    return max(0, int(((price - sale_price) * 100 / price).quantize(Decimal('1'), ROUND_HALF_UP)))
+
+
+def flash_sale_running(product, now):
+    """Whether ``product``'s flash price applies at ``now``."""
+    if not product.flash_sale_price or not product.flash_sale_start or not product.flash_sale_end:
+        return False
+    if not (product.flash_sale_start <= now <= product.flash_sale_end):
+        return False
+    if product.flash_sale_sold_out:
+        return False
+    # If flash_sale_stock > 0, require there is stock
+    if product.flash_sale_stock and product.flash_sale_stock > 0:
+        return product.stock > 0
+    # flash_sale_stock == 0 (default) means no separate limit
+    return True
+
+
+def current_pricing(product, now):
+    """``(effective_price, discount_percent)`` of ``product`` at ``now``.
+
+    Works on anything with the Product fields, historical models included.
+    """
+    if flash_sale_running(product, now):
+        return product.flash_sale_price, discount_percent(product.price, product.flash_sale_price)
+    return product.price, 0
+
+
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='products')
     name = models.CharField(max_length=200)
@@ -57,6 +112,15 @@ class Product(models.Model):
     flash_sale_start = models.DateTimeField(null=True, blank=True, help_text='Thời gian bắt đầu Flash Sale')
     flash_sale_end = models.DateTimeField(null=True, blank=True, help_text='Thời gian kết thúc Flash Sale')
     flash_sale_stock = models.PositiveIntegerField(default=0, help_text='Số lượng dành cho Flash Sale (0 = không giới hạn riêng)')
+    # Set by shop.inventory.reserve_stock when the allotment runs out (the
+    # count is then 0, which otherwise means "no separate limit"); cleared
+    # by a top-up of flash_sale_stock.
+    flash_sale_sold_out = models.BooleanField(default=False, help_text='Đã hết suất Flash Sale (bỏ chọn để mở bán lại)')
+    # The price and discount in force, denormalised so listings can sort and
+    # filter on them in SQL. Set by save() and, as sales open and close, by
+    # shop.pricing.refresh_prices (run by flash_sale_worker).
+    effective_price = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    discount_percent = models.PositiveSmallIntegerField(default=0, editable=False)
     is_active = models.BooleanField(default=True)
     is_hot = models.BooleanField(default=False, help_text='Sản phẩm HOT')
     is_best_seller = models.BooleanField(default=False, help_text='Sản phẩm bán chạy')
@@ -67,10 +131,66 @@ class Product(models.Model):
         verbose_name = 'Sản phẩm'
         verbose_name_plural = 'Sản phẩm'
         ordering = ['-created_at']
+        # Partial indexes for the storefront filters: listings only ever show
+        # active products, newest first, with id as the keyset tie-breaker.
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(is_active=True),
+                name='product_active_created_idx',
+            ),
+            models.Index(
+                fields=['category', '-created_at', '-id'],
+                condition=models.Q(is_active=True),
+                name='product_active_cat_created_idx',
+            ),
+            models.Index(
+                fields=['flash_sale_end', 'flash_sale_start'],
+                condition=models.Q(is_active=True, flash_sale_price__isnull=False),
+                name='product_active_flash_idx',
+            ),
+            models.Index(
+                fields=['-created_at'],
+                condition=models.Q(is_active=True, is_hot=True),
+                name='product_active_hot_idx',
+            ),
+            models.Index(
+                fields=['-created_at'],
+                condition=models.Q(is_active=True, is_best_seller=True),
+                name='product_active_best_idx',
+            ),
+            # Price range filters and the price / biggest discount sorts.
+            models.Index(
+                fields=['effective_price', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_price_idx',
+            ),
+            models.Index(
+                fields=['category', 'effective_price', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_cat_price_idx',
+            ),
+            models.Index(
+                fields=['discount_percent', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_discount_idx',
+            ),
+            models.Index(
+                fields=['category', 'discount_percent', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_cat_disc_idx',
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        if self.flash_sale_stock:
+            self.flash_sale_sold_out = False
+        self.refresh_pricing()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'flash_sale_sold_out', 'effective_price', 'discount_percent'}
         super().save(*args, **kwargs)
 
     @property
@@ -82,30 +202,55 @@ class Product(models.Model):
 
     @property
     def is_in_flash_sale(self):
-        from django.utils import timezone
-        if not self.flash_sale_price or not self.flash_sale_start or not self.flash_sale_end:
-            return False
-        now = timezone.now()
-        if not (self.flash_sale_start <= now <= self.flash_sale_end):
-            return False
-        # If flash_sale_stock > 0, require there is stock
-        if self.flash_sale_stock and self.flash_sale_stock > 0:
-            return self.stock > 0
-        # flash_sale_stock == 0 (default) means no separate limit
-        return True
+        return flash_sale_running(self, timezone.now())
 
     @property
     def flash_discount_percent(self):
-        try:
-            if self.flash_sale_price and self.price and self.price > 0:
-                return max(0, int(round((1 - float(self.flash_sale_price) / float(self.price)) * 100)))
-        except Exception:
-            return 0
-        return 0
+        return discount_percent(self.price, self.flash_sale_price)
+
+    def refresh_pricing(self, now=None):
+        """Set ``effective_price``/``discount_percent`` for ``now``; returns whether they changed."""
+        pricing = current_pricing(self, now or timezone.now())
+        changed = pricing != (self.effective_price, self.discount_percent)
+        self.effective_price, self.discount_percent = pricing
+        return changed
 
     def __str__(self):
         return self.name
 
+class FullTextField(models.TextField):
+    """The hidden column named after an FTS5 table; ``field__match=`` runs a MATCH on it."""
+
+
+@FullTextField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class ProductSearchIndex(models.Model):
+    """The FTS5 search index (see ``shop.search``), so searches join it through the ORM.
+
+    The virtual table is created by migration 0009, not by Django, and its
+    rows are written by ``shop.search`` only.
+    """
+    product = models.OneToOneField(
+        Product, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', db_constraint=False,
+        related_name='search_index',
+    )
+    document = FullTextField(db_column='shop_product_fts')
+    # BM25 with shop.search.RANK_WEIGHTS, lower is better; only set under a MATCH.
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'shop_product_fts'
+
+
 class Banner(models.Model):
     title = models.CharField(max_length=200, help_text='Tiêu đề banner')
     image_url = models.URLField(help_text='URL ảnh banner')
@@ -150,6 +295,14 @@ class Order(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Đơn hàng'
         verbose_name_plural = 'Đơn hàng'
+        # The admin changelist: newest first (id breaks ties), by status, and
+        # prefix search on phone and name (shop.changelists).
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='order_created_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='order_status_created_idx'),
+            models.Index(fields=['phone'], name='order_phone_idx'),
+            models.Index(fields=['customer_name'], name='order_customer_name_idx'),
+        ]
 
     def __str__(self):
         return f"ĐH#{self.id} - {self.customer_name} - {self.total_amount}đ"
@@ -165,6 +318,179 @@ class OrderItem(models.Model):
     class Meta:
         verbose_name = 'Mục đơn hàng'
         verbose_name_plural = 'Mục đơn hàng'
+        indexes = [models.Index(fields=['product_name'], name='order_item_product_name_idx')]
+
+    def __str__(self):
+        return f"{self.product_name} x {self.quantity}"
+
+class OrderStatusChange(models.Model):
+    """One status transition of an order (see ``shop.order_status``); rows are only ever appended."""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_changes')
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    changed_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['changed_at', 'id']
+        verbose_name = 'Lịch sử trạng thái'
+        verbose_name_plural = 'Lịch sử trạng thái'
+
+    def __str__(self):
+        return f'ĐH#{self.order_id}: {self.from_status} → {self.to_status}'
+
+class RelatedProductList(models.Model):
+    """A product's precomputed neighbours, best first (see ``shop.related``)."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='related_list')
+    # Comma-separated product ids: one short row per product.
+    product_ids = models.TextField(blank=True)
+    # Set when new orders changed co-purchase counts; refreshed in batches.
+    is_stale = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name = 'Sản phẩm liên quan'
+        verbose_name_plural = 'Sản phẩm liên quan'
+        indexes = [
+            models.Index(fields=['product'], condition=models.Q(is_stale=True), name='related_list_stale_idx'),
+        ]
+
+    @property
+    def ids(self):
+        return [int(pk) for pk in self.product_ids.split(',') if pk]
+
+    def __str__(self):
+        return f'{self.product_id}: {self.product_ids}'
+
+
+class CartItem(models.Model):
+    """One cart line of ``shop.carts.DatabaseCartStore``."""
+    cart_key = models.CharField(max_length=40)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Giỏ hàng'
+        verbose_name_plural = 'Giỏ hàng'
+        constraints = [
+            models.UniqueConstraint(fields=['cart_key', 'product'], name='cart_item_line_uniq'),
+        ]
+        # purge_carts finds abandoned carts by their last change.
+        indexes = [models.Index(fields=['updated_at'], name='cart_item_updated_idx')]
+
+    def __str__(self):
+        return f'{self.cart_key}: {self.product_id} x {self.quantity}'
+
+
+class SalesRollup(models.Model):
+    """Units and revenue of one product in one hour, day or month (see ``shop.analytics``)."""
+    PERIOD_CHOICES = (
+        ('hour', 'Giờ'),
+        ('day', 'Ngày'),
+        ('month', 'Tháng'),
+    )
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    # No FK constraints: sales history outlives deleted products and categories.
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False,
+                                 null=True, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Doanh số sản phẩm'
+        verbose_name_plural = 'Doanh số sản phẩm'
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'product'], name='sales_rollup_uniq'),
+        ]
+        # Covering index: range sums read the index alone, never the table.
+        indexes = [
+            models.Index(fields=['period', 'bucket', 'product', 'category', 'units', 'revenue'],
+                         name='sales_rollup_cover_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.period} {self.bucket:%Y-%m-%d %H:%M} #{self.product_id}: {self.units}'
+
+
+class OrderRollup(models.Model):
+    """Orders and revenue per status and payment method in one hour, day or month."""
+    period = models.CharField(max_length=5, choices=SalesRollup.PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    payment_method = models.CharField(max_length=20, choices=Order.PAYMENT_CHOICES)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = 'Doanh thu đơn hàng'
+        verbose_name_plural = 'Doanh thu đơn hàng'
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'status', 'payment_method'],
+                                    name='order_rollup_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.period} {self.bucket:%Y-%m-%d %H:%M} {self.status}/{self.payment_method}: {self.orders}'
+
+
+class SourceImage(models.Model):
+    """A remote catalog image copied by shop.images, and the presets it has been resized to."""
+    STATUS_CHOICES = (
+        ('ready', 'Đã xử lý'),
+        ('failed', 'Lỗi'),
+    )
+    url = models.URLField(max_length=2000)
+    url_hash = models.CharField(max_length=64, unique=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    file = models.CharField(max_length=200, blank=True, help_text='Ảnh gốc trong MEDIA_ROOT')
+    width = models.PositiveIntegerField(default=0)
+    height = models.PositiveIntegerField(default=0)
+    presets = models.CharField(max_length=200, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    error = models.CharField(max_length=255, blank=True)
+    fetched_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Ảnh nguồn'
+        verbose_name_plural = 'Ảnh nguồn'
+
+    def __str__(self):
+        return self.url
+
+    @property
+    def preset_names(self):
+        return self.presets.split(',') if self.presets else []
+
+
+class PendingOrder(models.Model):
+    """An order taken in queued intake mode, waiting for ``order_worker`` (see ``shop.order_queue``)."""
+    STATUS_CHOICES = (
+        ('queued', 'Chờ xử lý'),
+        ('done', 'Đã tạo đơn'),
+        ('failed', 'Lỗi'),
+        ('cancelled', 'Đã hủy'),
+    )
+    number = models.CharField(max_length=20, unique=True)
+    # Order fields and (product_id, name, qty, unit_price, line_total) lines, as JSON.
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    claim = models.CharField(max_length=100, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    order = models.OneToOneField(Order, null=True, blank=True, on_delete=models.SET_NULL, related_name='pending')
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Đơn chờ xử lý'
+        verbose_name_plural = 'Đơn chờ xử lý'
+        indexes = [
+            models.Index(fields=['claimed_until', 'id'], condition=models.Q(status='queued'),
+                         name='pending_order_queued_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.product_name} x {self.quantity}"
\ No newline at end of file
+        return f'{self.number} ({self.status})'
@@ -0,0 +1,228 @@
+"""Write-behind order intake for flash-sale spikes.
+
+With ``SHOP_ORDER_INTAKE = 'queued'`` checkout does not write the order.
+``enqueue_order`` reserves the stock and appends a ``PendingOrder`` in one
+short transaction, and the customer gets the pending order's number and a
+page polling ``order_status``. ``manage.py order_worker`` processes drain
+the queue in batches. Each batch is one transaction: the Orders and
+their items, the related-list flags, the sales rollups, and the queue
+rows marked done.
+
+The queue is a table in the shop's own SQLite database, so a reservation
+commits with its queue entry and a batch's orders commit with their
+"done" marks. A worker killed mid-batch leaves nothing but its claim.
+The claim lapses after ``lease`` seconds and another worker redoes the
+batch, so every queued order becomes exactly one Order. A row whose
+claim lapsed is retried on its own, and one that has used up
+``MAX_ATTEMPTS`` claims is marked failed instead of being handed out again,
+so an order that keeps killing its worker cannot hold up the queue.
+Failed orders keep their stock reserved until they are retried or
+cancelled (``retry``, ``cancel``; both are admin actions).
+"""
+import os
+import secrets
+import socket
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .analytics import record_orders
+from .inventory import release, reserve_stock
+from .models import Order, OrderItem, PendingOrder, Product
+from .related import mark_stale
+
+BATCH_SIZE = 100
+LEASE = 30
+MAX_ATTEMPTS = 5
+ORDER_FIELDS = ('customer_name', 'phone', 'address', 'payment_method', 'status', 'user_id')
+# What the status endpoint reports for each queue status.
+PUBLIC_STATUS = {'queued': 'pending', 'done': 'placed', 'failed': 'failed', 'cancelled': 'cancelled'}
+
+
+class LeaseLost(Exception):
+    """The batch's claim lapsed and another worker took it over."""
+
+
+def new_number():
+    return f'P{secrets.token_hex(6).upper()}'
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue_order(order, items):
+    """Reserve stock for an unsaved ``order`` and queue it; returns the ``PendingOrder``.
+
+    Raises ``inventory.InsufficientStock`` (and queues nothing) like
+    ``orders.create_order``.
+    """
+    total = sum((item['subtotal'] for item in items), Decimal('0'))
+    payload = {
+        'order': {field: getattr(order, field) for field in ORDER_FIELDS},
+        'total': str(total),
+        'items': [
+            [item['product'].pk, item['product'].name, item['qty'], str(item['unit_price']), str(item['subtotal'])]
+            for item in items
+        ],
+    }
+    with transaction.atomic():
+        reserve_stock([(item['product'], item['qty'], item['unit_price']) for item in items])
+        return PendingOrder.objects.create(number=new_number(), payload=payload)
+
+
+def order_status(number):
+    """``{'number', 'status', 'order_id'}`` of a pending order, or None for an unknown number."""
+    row = PendingOrder.objects.filter(number=number).values('status', 'order_id').first()
+    if row is None:
+        return None
+    return {'number': number, 'status': PUBLIC_STATUS[row['status']], 'order_id': row['order_id']}
+
+
+def claim(worker, batch_size=BATCH_SIZE, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+    """Claim up to ``batch_size`` queued orders whose claim is free or lapsed.
+
+    Returns ``(token, pending_orders)``. The claim is a single UPDATE, so
+    two workers never get the same row while its lease runs. A lapsed row
+    may be what killed its last worker, so it is claimed on its own; after
+    ``max_attempts`` claims it is marked failed instead.
+    """
+    now = timezone.now()
+    token = f'{worker}:{secrets.token_hex(4)}'
+    claimable = Q(status='queued') & (Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+    PendingOrder.objects.filter(claimable, attempts__gte=max_attempts).update(
+        status='failed', claimed_until=None, error=f'Gave up after {max_attempts} attempts',
+    )
+    lease_until = now + timedelta(seconds=lease)
+    claimed = 0
+    for retried, size in ((True, 1), (False, batch_size)):
+        batch = claimable & Q(attempts__gt=0) if retried else claimable
+        ids = PendingOrder.objects.filter(batch).order_by('pk').values('pk')[:size]
+        claimed = PendingOrder.objects.filter(batch, pk__in=ids).update(
+            claim=token, claimed_until=lease_until, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            break
+    if not claimed:
+        return token, []
+    return token, list(PendingOrder.objects.filter(claim=token, status='queued').order_by('pk'))
+
+
+def materialize(pending_orders, token):
+    """Create the Orders of a claimed batch in one transaction; raises ``LeaseLost``."""
+    product_ids = {line[0] for pending in pending_orders for line in pending.payload['items']}
+    user_ids = {pending.payload['order']['user_id'] for pending in pending_orders} - {None}
+    with transaction.atomic():
+        # Write first: this takes the write lock and checks the claim still holds.
+        done = PendingOrder.objects.filter(
+            pk__in=[pending.pk for pending in pending_orders], claim=token, status='queued',
+        ).update(status='done', claimed_until=None)
+        if done != len(pending_orders):
+            raise LeaseLost(token)
+        # Products and users deleted since intake are left out of the rows,
+        # as deleting them would have done (SET_NULL).
+        products = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        orders = []
+        for pending in pending_orders:
+            fields = dict(pending.payload['order'])
+            if fields['user_id'] not in users:
+                fields['user_id'] = None
+            orders.append(Order(total_amount=Decimal(pending.payload['total']), **fields))
+        Order.objects.bulk_create(orders)
+        order_items = [
+            [
+                OrderItem(
+                    order=order, product_id=pid if pid in products else None, product_name=name,
+                    quantity=qty, unit_price=Decimal(unit_price), line_total=Decimal(line_total),
+                )
+                for pid, name, qty, unit_price, line_total in pending.payload['items']
+            ]
+            for order, pending in zip(orders, pending_orders)
+        ]
+        OrderItem.objects.bulk_create([item for items in order_items for item in items])
+        for pending, order in zip(pending_orders, orders):
+            pending.order = order
+        PendingOrder.objects.bulk_update(pending_orders, ['order'])
+        mark_stale(product_ids & products)
+        record_orders(zip(orders, order_items))
+    return orders
+
+
+def _fail(pending, token, exc):
+    PendingOrder.objects.filter(pk=pending.pk, claim=token, status='queued').update(
+        status='failed', claimed_until=None, error=f'{type(exc).__name__}: {exc}'[:255],
+    )
+
+
+def process_batch(worker, batch_size=BATCH_SIZE, lease=LEASE):
+    """Claim and materialise one batch; returns the number of orders claimed.
+
+    If the batch fails as a whole, its orders are retried one by one and
+    the ones that still fail are marked failed (their stock stays
+    reserved until they are retried or cancelled).
+    """
+    token, pending_orders = claim(worker, batch_size, lease)
+    if not pending_orders:
+        return 0
+    try:
+        materialize(pending_orders, token)
+    except LeaseLost:
+        pass
+    except Exception:
+        for pending in pending_orders:
+            try:
+                materialize([pending], token)
+            except LeaseLost:
+                pass
+            except Exception as exc:
+                _fail(pending, token, exc)
+    return len(pending_orders)
+
+
+def retry(pending_orders):
+    """Queue the failed orders among ``pending_orders`` again; returns how many.
+
+    Their stock is still reserved, so the next batch picks them up as if
+    they had just come in.
+    """
+    return pending_orders.filter(status='failed').update(
+        status='queued', claim='', claimed_until=None, attempts=0, error='',
+    )
+
+
+def cancel(pending_orders):
+    """Cancel the failed orders among ``pending_orders`` and release their stock; returns how many."""
+    token = f'cancel:{secrets.token_hex(4)}'
+    ids = pending_orders.filter(status='failed').values('pk')
+    with transaction.atomic():
+        # Only the rows this UPDATE flips give their stock back, so a
+        # concurrent retry or cancel of the same rows cannot double it.
+        cancelled = PendingOrder.objects.filter(pk__in=ids, status='failed').update(status='cancelled', claim=token)
+        quantities = Counter()
+        for payload in PendingOrder.objects.filter(claim=token).values_list('payload', flat=True):
+            for pid, _, qty, *_ in payload['items']:
+                quantities[pid] += qty
+        release(quantities)
+    return cancelled
+
+
+def run_worker(batch_size=BATCH_SIZE, lease=LEASE, poll=0.5, once=False, log=None):
+    """Drain the queue until it is empty (``once``) or forever; returns orders claimed."""
+    worker = worker_name()
+    total = 0
+    while True:
+        claimed = process_batch(worker, batch_size, lease)
+        total += claimed
+        if claimed and log:
+            log(f'{worker} materialised a batch of {claimed}')
+        if not claimed:
+            if once:
+                return total
+            time.sleep(poll)
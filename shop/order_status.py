@@ -0,0 +1,93 @@
+"""Order status transitions, enforced on the server.
+
+``TRANSITIONS`` maps each ``Order.status`` to the statuses it may move to:
+a new order is confirmed (or cancelled) before it ships, shipped orders
+are completed or cancelled, and completed or cancelled orders are final.
+
+``transition`` moves every order of a queryset that may go to ``target``
+with a fixed number of statements per source status, however many orders
+that is: it appends their ``OrderStatusChange`` rows (INSERT ... SELECT),
+moves them between the sales rollup buckets, puts the items of cancelled
+orders back in stock, and flips the status with one
+``UPDATE ... WHERE status = <source>``. Orders that cannot make the move
+are left alone.
+"""
+from django.db import connection, transaction
+from django.db.models import IntegerField, Value
+from django.utils import timezone
+
+from .analytics import orders_moved
+from .inventory import restock
+from .models import Order, OrderStatusChange
+
+CANCELLED = 'cancel'
+TRANSITIONS = {
+    'new': ('paid', CANCELLED),
+    'paid': ('ship', CANCELLED),
+    'ship': ('done', CANCELLED),
+    'done': (),
+    CANCELLED: (),
+}
+
+
+def allowed_statuses(status):
+    """``status`` itself and the statuses it may move to."""
+    return (status, *TRANSITIONS.get(status, ()))
+
+
+def sources(target):
+    """The statuses that may move to ``target``."""
+    return [status for status, targets in TRANSITIONS.items() if target in targets]
+
+
+def _record(orders, target, user, now):
+    """Append one history row per order of ``orders`` with a single INSERT ... SELECT."""
+    rows = orders.order_by().annotate(
+        _to=Value(target), _by=Value(user.pk if user else None, output_field=IntegerField()), _at=Value(now),
+    ).values_list('pk', 'status', '_to', '_by', '_at')
+    select, params = rows.query.sql_with_params()
+    table = OrderStatusChange._meta.db_table
+    columns = ', '.join(
+        connection.ops.quote_name(OrderStatusChange._meta.get_field(name).column)
+        for name in ('order', 'from_status', 'to_status', 'changed_by', 'changed_at')
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {connection.ops.quote_name(table)} ({columns}) {select}', params)
+        return cursor.rowcount
+
+
+def transition(orders, target, user=None):
+    """Move the orders of the ``orders`` queryset that may go to ``target``.
+
+    Returns ``{source_status: count}`` of the orders moved; the rest keep
+    their status.
+    """
+    if target not in TRANSITIONS:
+        raise ValueError(f'Unknown order status: {target!r}')
+    now = timezone.now()
+    selected = orders.order_by().values('pk')
+    moved = {}
+    with transaction.atomic():
+        for source in sources(target):
+            batch = Order.objects.filter(pk__in=selected, status=source)
+            # Write first: the INSERT takes SQLite's write lock, so the rows
+            # read and updated below cannot change under us.
+            if not _record(batch, target, user, now):
+                continue
+            orders_moved(batch, source, target)
+            if target == CANCELLED:
+                restock(batch)
+            moved[source] = batch.update(status=target)
+    return moved
+
+
+def set_status(order, target, user=None):
+    """Move one saved ``order`` to ``target``; raises ``ValueError`` if it may not."""
+    if target not in TRANSITIONS.get(order.status, ()):
+        raise ValueError(f'Order #{order.pk} cannot go from {order.status!r} to {target!r}')
+    if not transition(Order.objects.filter(pk=order.pk), target, user):
+        raise ValueError(f'Order #{order.pk} is no longer {order.status!r}')
+    order.status = target
+    # The rollups have moved already: the next save() must not move them again.
+    order._rollup_key = (target, order.payment_method)
+    return order
@@ -0,0 +1,138 @@
+"""Order creation shared by checkout and programmatic/batch imports.
+
+An order and all of its items are written in one transaction with a fixed
+number of statements: one stock-reservation UPDATE, one Order INSERT, one
+bulk OrderItem INSERT, one UPDATE flagging the products' related lists
+stale (``shop.related``) and one upsert per sales rollup table
+(``shop.analytics``), however many lines the cart has.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import record_orders
+from .inventory import reserve_stock
+from .models import Order, OrderItem, Product, current_pricing, flash_sale_running
+from .pricing import get_snapshots
+from .related import mark_stale
+
+ITEM_BATCH_SIZE = 500
+
+
+def effective_price(product: Product, now=None):
+    # Worked out from the flash-sale fields rather than read from
+    # Product.effective_price: carts are priced from snapshots, to the second.
+    return current_pricing(product, now or timezone.now())[0]
+
+
+def quote_lines(products, quantities):
+    """Price ``(product_id, qty)`` pairs against ``products`` (a dict by id).
+
+    Unknown product ids are skipped. Returns ``(items, total)`` where each
+    item is a dict with product, qty, unit_price, orig_price, is_discounted
+    and subtotal.
+    """
+    items = []
+    total = Decimal('0')
+    now = timezone.now()
+    for pid, qty in quantities:
+        p = products.get(int(pid))
+        if not p:
+            continue
+        unit_price = effective_price(p, now) or Decimal('0')
+        subtotal = unit_price * int(qty)
+        total += subtotal
+        items.append({
+            'product': p,
+            'qty': int(qty),
+            'unit_price': unit_price,
+            'orig_price': p.price,
+            'is_discounted': flash_sale_running(p, now),
+            'subtotal': subtotal,
+        })
+    return items, total
+
+
+def quote_cart(cart):
+    """Price each line of a ``{product_id: qty}`` cart from the pricing snapshots.
+
+    Snapshots may be up to SNAPSHOT_TIMEOUT old; create_order() re-validates
+    every line against the database when it reserves stock.
+    """
+    if not cart:
+        return [], Decimal('0')
+    return quote_lines(get_snapshots(cart.keys()), cart.items())
+
+
+def _order_items(order, items):
+    return [
+        OrderItem(
+            order=order,
+            product=item['product'],
+            product_name=item['product'].name,
+            quantity=item['qty'],
+            unit_price=item['unit_price'],
+            line_total=item['subtotal'],
+        )
+        for item in items
+    ]
+
+
+def _reservation(items):
+    return [(item['product'], item['qty'], item['unit_price']) for item in items]
+
+
+def create_order(order, items, reserve=True):
+    """Persist an unsaved ``order`` with its quoted ``items`` and return it.
+
+    Raises ``inventory.InsufficientStock`` (and writes nothing) if ``reserve``
+    is set and any line can no longer be honoured.
+    """
+    order.total_amount = sum((item['subtotal'] for item in items), Decimal('0'))
+    with transaction.atomic():
+        if reserve:
+            reserve_stock(_reservation(items))
+        order.save()
+        order_items = OrderItem.objects.bulk_create(_order_items(order, items), batch_size=ITEM_BATCH_SIZE)
+        mark_stale({item['product'].pk for item in items})
+        record_orders([(order, order_items)])
+    return order
+
+
+def import_orders(rows, reserve=False, batch_size=ITEM_BATCH_SIZE):
+    """Create many orders at once from plain dicts.
+
+    Each row holds Order field values (customer_name, phone, address and
+    optionally payment_method, status, user) plus ``items``: a list of
+    ``(product_id, qty)`` pairs priced at current prices. All products are
+    fetched in one query and everything is written in one transaction.
+    Historical imports usually leave ``reserve`` off; set it to take stock.
+    Sales rollups are updated; related products are not, run
+    ``rebuild_related_products``.
+    """
+    rows = [dict(row) for row in rows]
+    product_ids = {int(pid) for row in rows for pid, _ in row['items']}
+    products = Product.objects.in_bulk(product_ids)
+    missing = product_ids - set(products)
+    if missing:
+        raise ValueError(f'Unknown product ids: {sorted(missing)}')
+
+    orders = []
+    quoted = []
+    for row in rows:
+        items, total = quote_lines(products, row.pop('items'))
+        orders.append(Order(total_amount=total, **row))
+        quoted.append(items)
+
+    with transaction.atomic():
+        if reserve:
+            reserve_stock(line for items in quoted for line in _reservation(items))
+        Order.objects.bulk_create(orders, batch_size=batch_size)
+        order_items = [_order_items(order, items) for order, items in zip(orders, quoted)]
+        OrderItem.objects.bulk_create(
+            [item for items in order_items for item in items],
+            batch_size=batch_size,
+        )
+        record_orders(zip(orders, order_items))
+    return orders
@@ -0,0 +1,77 @@
+"""Keyset (cursor) pagination for the product grid.
+
+Pages are addressed by an opaque token encoding the ``(created_at, id)`` of
+the last product shown, so fetching the next page is an index range scan
+with a LIMIT instead of a COUNT(*) plus an ever-growing OFFSET: page 1000
+costs the same as page 1.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from .cache import REGION_TIMEOUT, catalog_version, region_key
+
+KEYSET_ORDERING = ('-created_at', '-id')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(product):
+    raw = f'{product.created_at.isoformat()}|{product.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as exc:
+        raise InvalidCursor(token) from exc
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset; iterates like a Page."""
+
+    def __init__(self, object_list, next_cursor, cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_page(qs, cursor=None, per_page=10):
+    """Return the page of ``qs`` (newest first) that follows ``cursor``."""
+    qs = qs.order_by(*KEYSET_ORDERING)
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    # Fetch one extra row to learn whether another page exists without a COUNT.
+    rows = list(qs[:per_page + 1])
+    next_cursor = encode_cursor(rows[per_page - 1]) if len(rows) > per_page else None
+    return KeysetPage(rows[:per_page], next_cursor, cursor or None)
+
+
+def cached_count(qs, name):
+    """Total for ``qs``, cached until the catalog version changes.
+
+    ``name`` must identify the filters applied to ``qs``.
+    """
+    key = region_key(f'count:{name}', catalog_version())
+    return cache.get_or_set(key, qs.count, REGION_TIMEOUT)
@@ -0,0 +1,83 @@
+"""Short-lived per-product pricing snapshots for the cart and checkout pages.
+
+A snapshot holds just what those pages need (price, flash-sale price and
+window, stock, is_active, category plus name/slug/image for display), cached per
+product and fetched for a whole cart with one ``get_many``. Snapshots are
+dropped when a product is saved or deleted and after stock is reserved, and
+expire on their own after SNAPSHOT_TIMEOUT. They are for display only:
+checkout re-validates price and stock against the database when it
+reserves stock (see ``shop.inventory``).
+
+``refresh_prices`` keeps the denormalised ``Product.effective_price`` and
+``discount_percent`` columns current for writes that skip ``save()`` and
+for flash sales opening or closing with the clock.
+"""
+from django.core.cache import cache
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import Product
+
+SNAPSHOT_KEY_PREFIX = 'shop:snapshot'
+SNAPSHOT_TIMEOUT = 60
+SNAPSHOT_FIELDS = (
+    'id', 'name', 'slug', 'image_url', 'price', 'stock', 'is_active', 'category_id',
+    'flash_sale_price', 'flash_sale_start', 'flash_sale_end', 'flash_sale_stock', 'flash_sale_sold_out',
+)
+
+
+def snapshot_key(product_id):
+    return f'{SNAPSHOT_KEY_PREFIX}:{int(product_id)}'
+
+
+def get_snapshots(product_ids):
+    """Return ``{id: Product}`` for the given ids, from cache where possible.
+
+    The instances are unsaved Products built from SNAPSHOT_FIELDS only;
+    ids that do not exist are left out (and remembered as missing).
+    """
+    keys = {snapshot_key(pid): int(pid) for pid in product_ids}
+    found = cache.get_many(keys)
+    missing = [pid for key, pid in keys.items() if key not in found]
+    if missing:
+        rows = {row['id']: row for row in Product.objects.filter(pk__in=missing).values(*SNAPSHOT_FIELDS)}
+        fetched = {snapshot_key(pid): rows.get(pid) for pid in missing}
+        cache.set_many(fetched, SNAPSHOT_TIMEOUT)
+        found.update(fetched)
+    return {keys[key]: Product(**row) for key, row in found.items() if row is not None}
+
+
+def get_snapshot(product_id):
+    return get_snapshots([product_id]).get(int(product_id))
+
+
+def invalidate_snapshots(product_ids):
+    cache.delete_many([snapshot_key(pid) for pid in product_ids])
+
+
+PRICING_FIELDS = (
+    'id', 'price', 'stock', 'flash_sale_price', 'flash_sale_start', 'flash_sale_end',
+    'flash_sale_stock', 'flash_sale_sold_out', 'effective_price', 'discount_percent',
+)
+
+
+def refresh_prices(products=None, now=None):
+    """Recompute ``effective_price``/``discount_percent`` of ``products`` at ``now``.
+
+    ``products`` defaults to the active flash-sale products whose columns may
+    be out of date: those discounted now and those inside their sale window.
+    Only changed rows are written; returns their ids.
+    """
+    now = now or timezone.now()
+    if products is None:
+        products = Product.objects.filter(is_active=True, flash_sale_price__isnull=False).filter(
+            ~Q(effective_price=F('price')) | Q(discount_percent__gt=0)
+            | Q(flash_sale_start__lte=now, flash_sale_end__gte=now)
+        )
+    changed = [product for product in products.only(*PRICING_FIELDS) if product.refresh_pricing(now)]
+    if changed:
+        Product.objects.using(products.db).bulk_update(changed, ['effective_price', 'discount_percent'], batch_size=500)
+        invalidate_snapshots(product.pk for product in changed)
+        bump_catalog_version()
+    return [product.pk for product in changed]
@@ -0,0 +1,221 @@
+"""Precomputed "related products" for the product page.
+
+Each active product keeps the ids of its RELATED_SIZE best neighbours in
+one ``RelatedProductList`` row keyed by the product, so the detail page
+gets them with the product itself and loads them by primary key in one
+query. A candidate ``b`` for product ``a`` scores::
+
+    CATEGORY_WEIGHT * same category
+    + COPURCHASE_WEIGHT * log(1 + orders containing both)
+    + TEXT_WEIGHT * Jaccard similarity of folded name/specification tokens
+
+``rebuild_related`` recomputes the whole table (``manage.py
+rebuild_related_products``). Candidates come from co-purchases, products
+sharing a reasonably rare token (an inverted index; tokens in more than
+MAX_TOKEN_SHARE of the catalog are too common to say anything) and the
+newest products of the same category.
+
+``refresh_related`` recomputes a few products incrementally from a bounded
+candidate set: the current neighbours, co-purchases and category
+neighbours. It runs after a product is saved. Checkout only flags the
+lists of the ordered products stale (one UPDATE), and ``manage.py
+rebuild_related_products --stale`` refreshes flagged lists in batches.
+"""
+import re
+from collections import Counter, defaultdict
+from math import log1p
+
+from django.db import connection, transaction
+
+from .models import Order, OrderItem, Product, RelatedProductList
+from .search import fold
+
+RELATED_SIZE = 8
+CATEGORY_WEIGHT = 1.0
+COPURCHASE_WEIGHT = 2.0
+TEXT_WEIGHT = 3.0
+MAX_TOKEN_SHARE = 0.01
+MIN_TOKEN_DF = 50
+# Candidates per product from each source, before scoring.
+CATEGORY_CANDIDATES = RELATED_SIZE + 1
+TEXT_CANDIDATES = RELATED_SIZE + 1
+WRITE_BATCH_SIZE = 5000
+STALE_BATCH_SIZE = 500
+
+_TOKEN_RE = re.compile(r'\w\w+')
+
+
+def tokens(*texts):
+    return frozenset(t for t in _TOKEN_RE.findall(fold(' '.join(filter(None, texts)))) if not t.isdigit())
+
+
+def score(a, b, copurchases=0):
+    """Relatedness of ``b`` to ``a``; both are ``(category_id, tokens)``."""
+    category, words = a
+    other_category, other_words = b
+    value = CATEGORY_WEIGHT if category == other_category and category is not None else 0.0
+    if copurchases:
+        value += COPURCHASE_WEIGHT * log1p(copurchases)
+    shared = len(words & other_words)
+    if shared:
+        value += TEXT_WEIGHT * shared / (len(words) + len(other_words) - shared)
+    return value
+
+
+def _records(queryset):
+    """``{id: (category_id, tokens)}``; identical token sets are shared."""
+    interned = {}
+    records = {}
+    for pk, category_id, name, specifications in queryset.order_by().values_list(
+        'pk', 'category_id', 'name', 'specifications',
+    ):
+        words = tokens(name, specifications)
+        records[pk] = (category_id, interned.setdefault(words, words))
+    return records
+
+
+def _copurchases(product_ids=None):
+    """``{product_id: {other_id: orders containing both}}``, cancelled orders excluded."""
+    item = OrderItem._meta.db_table
+    order = Order._meta.db_table
+    sql = (
+        f'SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id) '
+        f'FROM {item} a '
+        f'JOIN {item} b ON b.order_id = a.order_id AND b.product_id <> a.product_id '
+        f'JOIN {order} o ON o.id = a.order_id '
+        f"WHERE o.status <> 'cancel' AND a.product_id IS NOT NULL"
+    )
+    params = []
+    if product_ids is not None:
+        params = list(product_ids)
+        if not params:
+            return {}
+        sql += f" AND a.product_id IN ({', '.join(['%s'] * len(params))})"
+    sql += ' GROUP BY a.product_id, b.product_id'
+    pairs = defaultdict(dict)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for a, b, count in cursor.fetchall():
+            pairs[a][b] = count
+    return pairs
+
+
+def _top(pk, candidates, records, copurchases):
+    record = records[pk]
+    scored = [
+        (score(record, records[other], copurchases.get(other, 0)), other)
+        for other in candidates
+        if other != pk and other in records
+    ]
+    scored.sort(reverse=True)
+    return [other for _, other in scored[:RELATED_SIZE]]
+
+
+def _write(neighbours, product_ids=None):
+    """Replace the lists of ``product_ids`` (every list if None) with ``neighbours``."""
+    table = RelatedProductList._meta.db_table
+    rows = [(pk, ','.join(map(str, ids)), False) for pk, ids in neighbours.items() if ids]
+    with transaction.atomic(), connection.cursor() as cursor:
+        if product_ids is None:
+            cursor.execute(f'DELETE FROM {table}')
+        else:
+            RelatedProductList.objects.filter(pk__in=product_ids).delete()
+        for start in range(0, len(rows), WRITE_BATCH_SIZE):
+            cursor.executemany(
+                f'INSERT INTO {table} (product_id, product_ids, is_stale) VALUES (%s, %s, %s)',
+                rows[start:start + WRITE_BATCH_SIZE],
+            )
+    return len(rows)
+
+
+def rebuild_related():
+    """Recompute every active product's neighbours. Returns the number of lists written."""
+    records = _records(Product.objects.filter(is_active=True))
+    copurchases = _copurchases()
+
+    postings = defaultdict(list)
+    by_category = defaultdict(list)
+    for pk in sorted(records, reverse=True):
+        category_id, words = records[pk]
+        by_category[category_id].append(pk)
+        for word in words:
+            postings[word].append(pk)
+    max_df = max(MIN_TOKEN_DF, int(len(records) * MAX_TOKEN_SHARE))
+    postings = {word: ids for word, ids in postings.items() if 1 < len(ids) <= max_df}
+
+    neighbours = {}
+    empty = {}
+    for pk, (category_id, words) in records.items():
+        candidates = set(by_category[category_id][:CATEGORY_CANDIDATES]) if category_id is not None else set()
+        shared = Counter()
+        for word in words:
+            if word in postings:
+                shared.update(postings[word])
+        if shared:
+            candidates.update(other for other, _ in shared.most_common(TEXT_CANDIDATES))
+        partners = copurchases.get(pk, empty)
+        candidates.update(partners)
+        neighbours[pk] = _top(pk, candidates, records, partners)
+    return _write(neighbours)
+
+
+def refresh_related(product_ids):
+    """Recompute the neighbours of ``product_ids`` from a bounded candidate set."""
+    product_ids = set(product_ids)
+    subjects = _records(Product.objects.filter(pk__in=product_ids, is_active=True))
+    if not subjects:
+        RelatedProductList.objects.filter(pk__in=product_ids).delete()
+        return 0
+
+    candidates = defaultdict(set)
+    for current in RelatedProductList.objects.filter(pk__in=subjects):
+        candidates[current.product_id].update(current.ids)
+    copurchases = _copurchases(subjects)
+    for pk, partners in copurchases.items():
+        candidates[pk].update(partners)
+    for category_id in {category_id for category_id, _ in subjects.values() if category_id is not None}:
+        newest = list(
+            Product.objects.filter(is_active=True, category_id=category_id)
+            .order_by('-created_at', '-id')
+            .values_list('pk', flat=True)[:CATEGORY_CANDIDATES]
+        )
+        for pk, (subject_category, _) in subjects.items():
+            if subject_category == category_id:
+                candidates[pk].update(newest)
+
+    records = _records(Product.objects.filter(
+        pk__in={pk for ids in candidates.values() for pk in ids}, is_active=True,
+    ))
+    records.update(subjects)
+    neighbours = {pk: _top(pk, candidates[pk], records, copurchases.get(pk, {})) for pk in subjects}
+    return _write(neighbours, product_ids)
+
+
+def mark_stale(product_ids):
+    """Flag the lists of ``product_ids`` for the next ``refresh_stale``."""
+    RelatedProductList.objects.filter(pk__in=product_ids, is_stale=False).update(is_stale=True)
+
+
+def refresh_stale(batch_size=STALE_BATCH_SIZE):
+    """Refresh every stale list; returns the number of products refreshed."""
+    refreshed = 0
+    while True:
+        ids = list(RelatedProductList.objects.filter(is_stale=True).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return refreshed
+        refresh_related(ids)
+        refreshed += len(ids)
+
+
+def related_products(product, limit=RELATED_SIZE):
+    """The precomputed neighbours of ``product``, best first.
+
+    Load ``product`` with ``select_related('related_list')`` and this is a
+    single query by primary key.
+    """
+    try:
+        ids = product.related_list.ids[:limit]
+    except RelatedProductList.DoesNotExist:
+        return []
+    found = Product.objects.filter(is_active=True).in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
@@ -0,0 +1,166 @@
+"""Product search backed by an SQLite FTS5 index.
+
+``shop_product_fts`` holds an accent-folded copy of each product's name,
+description, specifications and color_options, keyed by the product id as
+rowid. Queries are folded the same way, every term is prefix-matched and
+results are ordered by BM25 (name weighted highest). The index is kept in
+sync by the Product signals in ``shop.signals``; ``manage.py
+rebuild_search_index`` repopulates it after bulk writes. On databases other
+than SQLite, ``search_products`` falls back to ``icontains`` filtering.
+"""
+import re
+import unicodedata
+
+from django.db import connections
+from django.db.models import Q
+
+from .models import Product, ProductSearchIndex
+
+FTS_TABLE = ProductSearchIndex._meta.db_table
+INDEXED_FIELDS = ('name', 'description', 'specifications', 'color_options')
+# bm25() column weights, in INDEXED_FIELDS order.
+RANK_WEIGHTS = (10.0, 1.0, 2.0, 2.0)
+REBUILD_BATCH_SIZE = 2000
+
+_TOKEN_RE = re.compile(r'\w+')
+_fts_ready = {}
+
+
+class _FoldTable(dict):
+    """str.translate() table dropping combining marks, filled in as characters are seen."""
+
+    def __missing__(self, codepoint):
+        value = None if unicodedata.combining(chr(codepoint)) else codepoint
+        self[codepoint] = value
+        return value
+
+
+_FOLD_TABLE = _FoldTable({ord('đ'): 'd', ord('Đ'): 'D'})
+
+
+def fold(text):
+    """Lower-case ``text`` and strip Vietnamese diacritics ("Điện thoại" -> "dien thoai")."""
+    if not text:
+        return ''
+    return unicodedata.normalize('NFD', text).translate(_FOLD_TABLE).lower()
+
+
+def match_expression(query):
+    """Build an FTS5 MATCH string: every folded term, AND-ed and prefix-matched."""
+    terms = _TOKEN_RE.findall(fold(query))
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def fts_available(using='default'):
+    if using not in _fts_ready:
+        connection = connections[using]
+        _fts_ready[using] = (
+            connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_ready[using]
+
+
+def create_index(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"{', '.join(INDEXED_FIELDS)}, tokenize='unicode61 remove_diacritics 2')"
+        )
+        weights = ', '.join(str(w) for w in RANK_WEIGHTS)
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', %s)",
+            [f'bm25({weights})'],
+        )
+    _fts_ready.pop(connection.alias, None)
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    _fts_ready.pop(connection.alias, None)
+
+
+def _row(values):
+    return [fold(value) for value in values]
+
+
+def index_product(product, using='default'):
+    if not fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, {', '.join(INDEXED_FIELDS)}) VALUES (%s, %s, %s, %s, %s)",
+            [product.pk, *_row(getattr(product, field) for field in INDEXED_FIELDS)],
+        )
+
+
+def index_products(product_ids, using='default'):
+    """Re-index many products from the database: one SELECT, DELETE and batched INSERT."""
+    product_ids = list(product_ids)
+    if not fts_available(using) or not product_ids:
+        return
+    rows = Product.objects.using(using).filter(pk__in=product_ids).values_list('pk', *INDEXED_FIELDS).order_by()
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(product_ids))})", product_ids,
+        )
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE}(rowid, {', '.join(INDEXED_FIELDS)}) VALUES (%s, %s, %s, %s, %s)",
+            [[pk, *_row(values)] for pk, *values in rows],
+        )
+
+
+def unindex_product(product_id, using='default'):
+    if not fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def rebuild_index(using='default', manager=None):
+    """Repopulate the index from scratch; returns the number of products indexed.
+
+    ``manager`` lets migrations pass their historical Product manager.
+    """
+    if not fts_available(using):
+        return 0
+    insert = f"INSERT INTO {FTS_TABLE}(rowid, {', '.join(INDEXED_FIELDS)}) VALUES (%s, %s, %s, %s, %s)"
+    manager = manager or Product.objects
+    rows = manager.using(using).values_list('pk', *INDEXED_FIELDS).order_by()
+    count = 0
+    batch = []
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        for pk, *values in rows.iterator(chunk_size=REBUILD_BATCH_SIZE):
+            batch.append([pk, *_row(values)])
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                cursor.executemany(insert, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert, batch)
+            count += len(batch)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    return count
+
+
+def search_products(qs, query):
+    """Filter ``qs`` to products matching ``query``, best matches first."""
+    if not fts_available(qs.db):
+        return icontains_search(qs, query)
+    match = match_expression(query)
+    if not match:
+        return qs.none()
+    # A join (rather than a correlated rank subquery) lets SQLite drive the
+    # query from the FTS match and look products up by primary key.
+    return qs.filter(search_index__document__match=match).order_by('search_index__rank', '-created_at')
+
+
+def icontains_search(qs, query):
+    """Fallback for backends without FTS5: substring match, newest first."""
+    condition = Q()
+    for field in INDEXED_FIELDS:
+        condition |= Q(**{f'{field}__icontains': query})
+    return qs.filter(condition).order_by('-created_at')
@@ -0,0 +1,78 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import analytics, search
+from .cache import bump_catalog_version
+from .models import Banner, Category, Order, Popup, Product
+from .pricing import invalidate_snapshots
+from .related import refresh_related
+
+
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Popup)
+@receiver(post_delete, sender=Popup)
+def invalidate_catalog_regions(sender, using='default', **kwargs):
+    # After commit: a request that read the new version before the write
+    # committed would cache the old rows under it.
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_snapshot(sender, instance, using='default', **kwargs):
+    # post_delete clears instance.pk afterwards: take it now.
+    pk = instance.pk
+    transaction.on_commit(lambda: invalidate_snapshots([pk]), using=using)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, using='default', **kwargs):
+    if not raw:
+        search.index_product(instance, using)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using='default', **kwargs):
+    search.unindex_product(instance.pk, using)
+
+
+@receiver(post_save, sender=Product)
+def refresh_related_products(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: refresh_related([instance.pk]))
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    cart = getattr(request, 'cart', None)
+    if cart is not None:
+        cart.merge_anonymous()
+
+
+@receiver(post_init, sender=Order)
+def remember_order_rollup_key(sender, instance, **kwargs):
+    # __dict__, not attributes: a deferred status must not cost a query.
+    instance._rollup_key = (instance.__dict__.get('status'), instance.__dict__.get('payment_method'))
+
+
+@receiver(post_save, sender=Order)
+def move_order_rollups(sender, instance, created, raw=False, **kwargs):
+    # New orders enter the rollups with their items in create_order().
+    old_status, old_payment_method = instance._rollup_key
+    if not (created or raw) and old_status is not None:
+        analytics.order_changed(instance, old_status, old_payment_method)
+    instance._rollup_key = (instance.status, instance.payment_method)
+
+
+@receiver(pre_delete, sender=Order)
+def remove_order_rollups(sender, instance, **kwargs):
+    old_status, old_payment_method = instance._rollup_key
+    if old_status is not None:
+        analytics.order_deleted(instance, old_status, old_payment_method)
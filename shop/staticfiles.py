@@ -0,0 +1,182 @@
+"""Static asset build and serving.
+
+``CompressedManifestStaticFilesStorage`` is Django's manifest storage
+(``collectstatic`` copies every file under a content-hash name such as
+``styles.3f2a9c1b7d4e.css`` and rewrites the references between them)
+plus precompression: each fingerprinted text asset gets a ``.gz`` copy,
+and a ``.br`` copy when the optional ``brotli`` package is installed.
+
+``StaticFilesApp`` wraps the WSGI application (see ``ecommerce.wsgi``) and
+answers ``STATIC_URL`` requests from ``STATIC_ROOT`` before Django sees
+them. It sends the best precompressed variant the client accepts, ETags
+for revalidation, and ``immutable`` one-year caching for fingerprinted
+names, so a repeat visitor requests no static bytes at all.
+"""
+import gzip
+import json
+import mimetypes
+import os
+from email.utils import formatdate
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.mjs', '.svg', '.json', '.map', '.txt', '.xml', '.html', '.ico')
+MIN_COMPRESS_SIZE = 256
+# A variant is only kept if it saves at least this fraction of the bytes.
+MIN_SAVING = 0.05
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=60'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+MANIFEST_NAME = 'staticfiles.json'
+CHUNK_SIZE = 64 * 1024
+
+
+def compressed_variants(data):
+    """``[(suffix, bytes)]`` worth storing next to an asset of ``data``."""
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    return [(suffix, body) for suffix, body in variants if len(body) <= len(data) * (1 - MIN_SAVING)]
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        # Before the first collectstatic (runserver, tests) there is no
+        # manifest; serve the source names as DEBUG does.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            with self.open(name) as file:
+                data = file.read()
+            if len(data) < MIN_COMPRESS_SIZE:
+                continue
+            for suffix, body in compressed_variants(data):
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(body))
+                yield name, name + suffix, True
+
+
+class StaticFile:
+    def __init__(self, path, immutable):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type in ('application/javascript', 'image/svg+xml'):
+            self.content_type += '; charset=utf-8'
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.etag = f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        self.variants = {}
+        for encoding, suffix in ENCODINGS:
+            if os.path.exists(path + suffix):
+                self.variants[encoding] = (path + suffix, os.path.getsize(path + suffix))
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        name, _, value = params.partition('=')
+        try:
+            quality = float(value) if name.strip() == 'q' else 1.0
+        except ValueError:
+            quality = 0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _file_iterator(path):
+    with open(path, 'rb') as file:
+        while chunk := file.read(CHUNK_SIZE):
+            yield chunk
+
+
+class StaticFilesApp:
+    """WSGI middleware serving ``STATIC_ROOT`` under ``STATIC_URL``.
+
+    Files are indexed once at start-up (restart after ``collectstatic``);
+    unknown paths fall through to ``application``.
+    """
+
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.root = str(root or settings.STATIC_ROOT)
+        self.prefix = prefix or settings.STATIC_URL
+        if not self.prefix.startswith('/'):
+            self.prefix = '/' + self.prefix
+        self.files = self._index()
+
+    def _index(self):
+        files = {}
+        if not os.path.isdir(self.root):
+            return files
+        immutable = set()
+        manifest = os.path.join(self.root, MANIFEST_NAME)
+        if os.path.exists(manifest):
+            with open(manifest, encoding='utf-8') as file:
+                immutable = set(json.load(file).get('paths', {}).values())
+        suffixes = tuple(suffix for _, suffix in ENCODINGS)
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if name.endswith(suffixes) and os.path.exists(path.rsplit('.', 1)[0]):
+                    continue
+                files[self.prefix + relative] = StaticFile(path, relative in immutable)
+        return files
+
+    def __call__(self, environ, start_response):
+        static = self.files.get(environ.get('PATH_INFO', ''))
+        if static is None:
+            return self.application(environ, start_response)
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD'), ('Content-Length', '0')])
+            return []
+        path, size, etag = static.path, static.size, static.etag
+        headers = [
+            ('Content-Type', static.content_type),
+            ('Cache-Control', static.cache_control),
+            ('Last-Modified', static.last_modified),
+        ]
+        if static.variants:
+            headers.append(('Vary', 'Accept-Encoding'))
+            accepted = _accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+            for encoding, _ in ENCODINGS:
+                if encoding in accepted and encoding in static.variants:
+                    path, size = static.variants[encoding]
+                    etag = f'{etag[:-1]}-{encoding}"'
+                    headers.append(('Content-Encoding', encoding))
+                    break
+        headers.append(('ETag', etag))
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH', '')
+        if if_none_match and (if_none_match.strip() == '*' or etag in [
+            tag.strip().removeprefix('W/') for tag in if_none_match.split(',')
+        ]):
+            start_response('304 Not Modified', [h for h in headers if h[0] not in ('Content-Type', 'Content-Encoding')])
+            return []
+        headers.append(('Content-Length', str(size)))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(open(path, 'rb'), CHUNK_SIZE)
+        return _file_iterator(path)
@@ -0,0 +1,60 @@
+from functools import lru_cache
+from html import escape
+
+from django import template
+from django.utils.html import format_html_join
+from django.utils.safestring import SafeData, mark_safe
+
+from .. import images
+
+register = template.Library()
+
+
+def _attrs(attrs):
+    # Plain str building: format_html per attribute dominated the homepage render.
+    return ''.join(
+        f' {name}="{value if isinstance(value, SafeData) else escape(str(value))}"'
+        for name, value in attrs.items() if value is not None
+    )
+
+
+def _img(src, attrs):
+    return mark_safe(f'<img src="{escape(src)}"{_attrs(attrs)}>')
+
+
+@register.simple_tag
+def picture(url, preset, alt='', **attrs):
+    """``<img>`` for a catalog image at ``preset`` size (see shop.images).
+
+    Processed sources get a ``<picture>`` with AVIF and WebP ``srcset``s;
+    others go through the image proxy, and failed ones stay hotlinked.
+    Extra keyword arguments become ``<img>`` attributes (``loading``
+    defaults to lazy).
+    """
+    if not url:
+        return ''
+    attrs = {'alt': alt, 'loading': 'lazy', 'decoding': 'async', **attrs}
+    if not images.is_remote(url):
+        return _img(url, attrs)
+    info = images.lookup(url)
+    if info is not None and info['status'] != 'ready':
+        # Could not be fetched: leave it hotlinked.
+        return _img(url, attrs)
+    if info is None or preset not in info['presets']:
+        return _img(images.proxy_url(url, preset), attrs)
+    markup, src, width, height = _picture_parts(info['hash'], info['width'], info['height'], preset)
+    attrs = {'width': width, 'height': height, **attrs}
+    return mark_safe(f'<picture>{markup}{_img(src, attrs)}</picture>')
+
+
+@lru_cache(maxsize=4096)
+def _picture_parts(content_hash, source_width, source_height, preset):
+    """``<source>`` markup, fallback src and size of one processed image; pure, so memoized."""
+    info = {'hash': content_hash, 'width': source_width}
+    sizes = images.PRESETS[preset][1]
+    sources = format_html_join('', '<source type="{}" srcset="{}" sizes="{}">', (
+        (images.FORMATS[fmt][0], images.srcset(info, preset, fmt), sizes) for fmt in images.formats()
+    ))
+    width = images.default_width(preset, source_width)
+    src = images.variant_url(content_hash, width, images.FALLBACK_FORMAT)
+    return sources, src, width, max(1, round(source_height * width / source_width))
@@ -0,0 +1,30 @@
+from functools import lru_cache
+
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+
+@lru_cache(maxsize=None)
+def _read(path):
+    return _read_uncached(path)
+
+
+def _read_uncached(path):
+    found = finders.find(path)
+    if found is None:
+        raise template.TemplateSyntaxError(f'inline_static: no static file {path!r}')
+    with open(found, encoding='utf-8') as file:
+        return file.read()
+
+
+@register.simple_tag
+def inline_static(path):
+    """Contents of a (small, trusted) static file, e.g. critical CSS inside ``<style>``.
+
+    Read once per process; re-read on every render under DEBUG.
+    """
+    return mark_safe(_read_uncached(path) if settings.DEBUG else _read(path))
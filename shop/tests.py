@@ -1,3 +1,1788 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import os
+import re
+import signal
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import addModuleCleanup, mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from PIL import Image
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.http import Http404
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import parse_http_date
+
+from . import cache as region_cache
+from . import analytics, async_views, carts, exports, images, imports, instrumentation, search, views
+from .flash_sales import FlashSaleTimeline, get_timeline
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .inventory import InsufficientStock, reserve_stock
+from .models import (
+    Banner, CartItem, Category, Order, OrderItem, OrderRollup, OrderStatusChange, PendingOrder, Popup, Product, RelatedProductList,
+    SalesRollup, SourceImage,
+)
+from .order_status import set_status, transition
+from .order_queue import MAX_ATTEMPTS, LeaseLost, claim, enqueue_order, materialize, process_batch, run_worker
+from .orders import create_order, import_orders, quote_cart
+from .pricing import get_snapshots, refresh_prices
+from .related import rebuild_related, related_products
+from .staticfiles import StaticFilesApp
+
+
+def setUpModule():
+    """Give the run a cache of its own.
+
+    The default file cache (settings.CACHES) is shared by every process on
+    the host, so clearing it here would wipe a running dev server's catalog
+    version and carts, and leave it regions built from the test database.
+    It stays a file cache: worker threads and forked workers share it.
+    """
+    directory = tempfile.TemporaryDirectory()
+    addModuleCleanup(directory.cleanup)
+    own_cache = override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name,
+    }})
+    own_cache.enable()
+    addModuleCleanup(own_cache.disable)
+
+
+class ShopTestCase(TestCase):
+    """TestCase that starts every test with an empty cache.
+
+    Row ids are reused after each test's rollback, so cached regions and
+    pricing snapshots must not leak from one test into the next.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        use_temp_media(self)
+
+
+def use_temp_media(test):
+    """Point MEDIA_ROOT at a directory removed after ``test``."""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    test.enterContext(override_settings(MEDIA_ROOT=directory.name))
+
+
+def make_product(name, category=None, **kwargs):
+    kwargs.setdefault('price', Decimal('100000'))
+    kwargs.setdefault('stock', 10)
+    return Product.objects.create(name=name, category=category, **kwargs)
+
+
+class CategoryTileTests(ShopTestCase):
+    def _home_query_count(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_tile_thumbnail_prefers_category_then_newest_product_image(self):
+        with_image = Category.objects.create(name='Áo', image_url='https://img.example/cat.png')
+        from_product = Category.objects.create(name='Giày')
+        empty = Category.objects.create(name='Mũ')
+        make_product('Giày cũ', from_product, image_url='https://img.example/old.png')
+        make_product('Giày không ảnh', from_product)
+        make_product('Giày mới', from_product, image_url='https://img.example/new.png')
+        make_product('Mũ ẩn', empty, image_url='https://img.example/hidden.png', is_active=False)
+
+        response = self.client.get(reverse('home'))
+        tiles = {t['slug']: t['image_url'] for t in response.context['categories_tiles']}
+        self.assertEqual(tiles[with_image.slug], 'https://img.example/cat.png')
+        self.assertEqual(tiles[from_product.slug], 'https://img.example/new.png')
+        self.assertTrue(tiles[empty.slug].startswith('/media/images/placeholders/'))
+        self.assertTrue(default_storage.exists(tiles[empty.slug].removeprefix('/media/')))
+
+    def test_query_count_does_not_grow_with_categories(self):
+        Category.objects.bulk_create(Category(name=f'Danh mục {i}', slug=f'dm-{i}') for i in range(5))
+        make_product('SP đầu', Category.objects.first(), image_url='https://img.example/0.png')
+        baseline = self._home_query_count()
+
+        Category.objects.bulk_create(Category(name=f'Nhóm {i}', slug=f'nhom-{i}') for i in range(495))
+        categories = list(Category.objects.all()[:50])
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, cat in enumerate(categories):
+                make_product(f'SP {i}', cat, image_url=f'https://img.example/{i}.png')
+        self.assertEqual(Category.objects.count(), 500)
+        self.assertEqual(self._home_query_count(), baseline)
+
+
+class HomeRegionCacheTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Điện thoại')
+        make_product('Điện thoại A', self.category, image_url='https://img.example/a.png')
+        Banner.objects.create(title='Sale', image_url='https://img.example/b.png', is_featured=True)
+        Popup.objects.create(title='Popup', description='...', image='https://img.example/p.png')
+
+    def test_warm_cache_serves_home_without_queries(self):
+        self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(len(response.context['products']), 1)
+        self.assertEqual(len(response.context['banners']), 1)
+        self.assertIsNotNone(response.context['popup'])
+
+    def test_model_changes_invalidate_regions(self):
+        self.client.get(reverse('home'))
+        # Invalidation waits for the commit, so a request in between cannot
+        # cache the old rows under the new version.
+        with self.captureOnCommitCallbacks() as callbacks:
+            Banner.objects.create(title='Sale 2', image_url='https://img.example/b2.png', is_featured=True)
+            make_product('Điện thoại B', self.category)
+        self.assertEqual(len(self.client.get(reverse('home')).context['banners']), 1)
+        for callback in callbacks:
+            callback()
+        response = self.client.get(reverse('home'))
+        self.assertEqual(len(response.context['banners']), 2)
+        self.assertEqual(len(response.context['products']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.all().delete()
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['categories_tiles'], [])
+
+    def test_search_is_not_served_from_grid_cache(self):
+        make_product('Tai nghe', self.category)
+        self.client.get(reverse('home'))
+        response = self.client.get(reverse('home'), {'q': 'tai nghe'})
+        self.assertEqual([p.name for p in response.context['products']], ['Tai nghe'])
+
+    def test_region_timeout_stops_at_next_flash_sale_boundary(self):
+        now = timezone.now()
+        make_product(
+            'Flash', self.category, flash_sale_price=Decimal('50000'),
+            flash_sale_start=now + timedelta(seconds=42), flash_sale_end=now + timedelta(hours=1),
+        )
+        timeline = get_timeline()
+        self.assertEqual(timeline.next_transition(now), now + timedelta(seconds=42))
+        self.assertEqual(region_cache.region_timeout(now + timedelta(seconds=42), now), 42)
+        self.assertEqual(region_cache.region_timeout(None), region_cache.REGION_TIMEOUT)
+
+        with mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            self.client.get(reverse('home'))
+        self.assertLessEqual(set_many.call_args.args[1], 42)
+
+
+class ProductSearchTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.phone = make_product('Điện thoại Samsung', description='Màn hình đẹp', color_options='Đỏ, Xanh')
+        self.case = make_product('Ốp lưng', description='Dành cho điện thoại', specifications='Chất liệu silicon')
+        make_product('Tai nghe', description='Âm thanh hay')
+
+    def _names(self, query):
+        return [p.name for p in search.search_products(Product.objects.all(), query)]
+
+    def test_fold_strips_vietnamese_diacritics(self):
+        self.assertEqual(search.fold('Điện Thoại Ốp Lưng'), 'dien thoai op lung')
+        self.assertEqual(search.match_expression('điện  thoại!'), '"dien"* "thoai"*')
+
+    def test_accent_insensitive_prefix_search_ranks_name_first(self):
+        self.assertTrue(search.fts_available())
+        self.assertEqual(self._names('dien thoa'), ['Điện thoại Samsung', 'Ốp lưng'])
+        self.assertEqual(self._names('silic'), ['Ốp lưng'])
+        self.assertEqual(self._names('do'), ['Điện thoại Samsung'])
+        self.assertEqual(self._names('!!!'), [])
+
+    def test_search_composes_like_any_filter(self):
+        results = search.search_products(Product.objects.only('name'), 'dien thoai')
+        self.assertTrue(results.query.where)
+        self.assertEqual(results.count(), 2)
+        self.assertEqual([p.name for p in results.exclude(pk=self.case.pk)], ['Điện thoại Samsung'])
+        self.assertEqual([p.name for p in results.order_by('-name')], ['Ốp lưng', 'Điện thoại Samsung'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.case.name = 'Bao da'
+        self.case.save()
+        self.assertEqual(self._names('bao'), ['Bao da'])
+        self.case.delete()
+        self.assertEqual(self._names('bao'), [])
+
+    def test_rebuild_command_picks_up_bulk_writes(self):
+        Product.objects.bulk_create([Product(name='Sạc dự phòng', slug='sac', price=Decimal('1'))])
+        self.assertEqual(self._names('sac'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self._names('sac'), ['Sạc dự phòng'])
+
+    def test_icontains_fallback(self):
+        names = [p.name for p in search.icontains_search(Product.objects.all(), 'silicon')]
+        self.assertEqual(names, ['Ốp lưng'])
+
+
+class KeysetPaginationTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Phụ kiện')
+        for i in range(25):
+            make_product(f'Phụ kiện {i}', category)
+        # Ties on created_at must be broken by id.
+        Product.objects.update(created_at=timezone.now())
+
+    def test_walks_every_product_once(self):
+        seen = []
+        cursor = None
+        while True:
+            page = keyset_page(Product.objects.all(), cursor, per_page=10)
+            seen.extend(p.pk for p in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(sorted(seen), sorted(Product.objects.values_list('pk', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_cursor_round_trip(self):
+        product = Product.objects.first()
+        self.assertEqual(decode_cursor(encode_cursor(product)), (product.created_at, product.pk))
+
+    def test_deep_page_costs_the_same_as_first_page(self):
+        last = Product.objects.order_by('created_at', 'id').first()
+        with CaptureQueriesContext(connection) as first:
+            keyset_page(Product.objects.all(), None, per_page=10)
+        with CaptureQueriesContext(connection) as deep:
+            keyset_page(Product.objects.all(), encode_cursor(last), per_page=10)
+        self.assertEqual(len(first), len(deep))
+        self.assertNotIn('OFFSET', deep.captured_queries[0]['sql'])
+        self.assertNotIn('COUNT', deep.captured_queries[0]['sql'])
+
+    def test_json_endpoint(self):
+        response = self.client.get(reverse('product_list_json'))
+        data = response.json()
+        self.assertEqual(data['product_count'], 25)
+        self.assertEqual(data['total_pages'], 3)
+        self.assertEqual(len(data['products']), 10)
+        response = self.client.get(reverse('product_list_json'), {'cursor': data['next_cursor']})
+        self.assertEqual(len(response.json()['products']), 10)
+        response = self.client.get(reverse('product_list_json'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_home_cursor_mode(self):
+        response = self.client.get(reverse('home'), {'cursor': encode_cursor(Product.objects.order_by('-created_at', '-id').first())})
+        self.assertEqual(len(response.context['products']), 10)
+        self.assertContains(response, 'Xem thêm')
+        self.assertTrue(json.loads(response.context['home_response'])['has_previous'])
+        # An unreadable cursor falls back to the first page, which has nothing before it.
+        response = self.client.get(reverse('home'), {'cursor': 'not-a-cursor'})
+        self.assertFalse(json.loads(response.context['home_response'])['has_previous'])
+
+
+class QueryPlanTests(ShopTestCase):
+    """Run EXPLAIN QUERY PLAN on every storefront query touching shop_product."""
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.category = Category.objects.create(name='Laptop')
+        self.product = make_product('Laptop A', self.category, image_url='https://img.example/l.png')
+        make_product(
+            'Laptop B', self.category, flash_sale_price=Decimal('1000'),
+            flash_sale_start=now - timedelta(hours=1), flash_sale_end=now + timedelta(hours=1),
+        )
+
+    def assert_no_full_scans(self, method, url, data=None, expect_queries=True):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data or {})
+        self.assertLess(response.status_code, 400)
+        table = Product._meta.db_table
+        checked = 0
+        with connection.cursor() as cursor:
+            for query in ctx.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or f'"{table}"' not in sql:
+                    continue
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    if re.match(rf'SCAN {table}\b(?!_)', detail) and 'USING' not in detail:
+                        self.fail(f'{url} full-scans {table}: {detail}\n{sql}')
+                checked += 1
+        if expect_queries:
+            self.assertGreater(checked, 0)
+
+    def test_listing_queries_use_indexes(self):
+        self.assert_no_full_scans('get', reverse('home'))
+        cache.clear()
+        self.assert_no_full_scans('get', reverse('home'), {'cat': self.category.slug, 'page': 2})
+        self.assert_no_full_scans('get', reverse('home'), {'q': 'laptop'})
+        self.assert_no_full_scans('get', reverse('home'), {'cursor': encode_cursor(self.product)})
+        for sort in ('price_asc', 'price_desc', 'discount'):
+            self.assert_no_full_scans('get', reverse('home'), {'sort': sort, 'min_price': 500})
+            self.assert_no_full_scans('get', reverse('home'), {'sort': sort, 'cat': self.category.slug})
+        self.assert_no_full_scans('get', reverse('product_list_json'), {'cat': self.category.slug})
+
+    def test_product_and_cart_queries_use_indexes(self):
+        self.assert_no_full_scans('get', reverse('product_detail', args=[self.product.slug]))
+        self.assert_no_full_scans('post', reverse('add_to_cart', args=[self.product.id]), {'qty': 1})
+        # Warm pricing snapshots: the cart pages need no product queries at all.
+        self.assert_no_full_scans('get', reverse('cart_view'), expect_queries=False)
+        self.assert_no_full_scans('get', reverse('checkout'), expect_queries=False)
+
+
+CHECKOUT_DATA = {'customer_name': 'Nguyễn Văn A', 'phone': '0900000000', 'address': 'Hà Nội', 'payment_method': 'cod'}
+
+
+class StockReservationTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.product = make_product('Tai nghe', stock=5)
+        self.flash = make_product(
+            'Flash', stock=10, flash_sale_price=Decimal('50000'), flash_sale_stock=3,
+            flash_sale_start=now - timedelta(minutes=5), flash_sale_end=now + timedelta(hours=1),
+        )
+
+    def reserve(self, *lines):
+        with transaction.atomic():
+            reserve_stock(lines)
+
+    def test_checkout_decrements_stock(self):
+        self.client.post(reverse('add_to_cart', args=[self.product.id]), {'qty': 2})
+        self.client.post(reverse('checkout'), CHECKOUT_DATA)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(Order.objects.get().items.get().quantity, 2)
+
+    def test_failed_line_rolls_back_whole_order(self):
+        self.client.post(reverse('add_to_cart', args=[self.product.id]), {'qty': 2})
+        self.client.post(reverse('add_to_cart', args=[self.flash.id]), {'qty': 1})
+        Product.objects.filter(pk=self.flash.pk).update(stock=0)
+        response = self.client.post(reverse('checkout'), CHECKOUT_DATA)
+        self.assertRedirects(response, reverse('cart_view'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.assertFalse(Order.objects.exists())
+
+    def test_stale_price_is_rejected(self):
+        quoted = Product.objects.get(pk=self.product.pk)
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('1'))
+        with self.assertRaises(InsufficientStock):
+            self.reserve((quoted, 1, quoted.price))
+
+    def test_flash_allotment_is_enforced_and_closes_the_sale(self):
+        with self.assertRaises(InsufficientStock):
+            self.reserve((self.flash, 4, self.flash.flash_sale_price))
+        self.reserve((self.flash, 3, self.flash.flash_sale_price))
+        self.flash.refresh_from_db()
+        self.assertEqual((self.flash.stock, self.flash.flash_sale_stock), (7, 0))
+        self.assertFalse(self.flash.is_in_flash_sale)
+        with self.assertRaises(InsufficientStock):
+            self.reserve((self.flash, 1, self.flash.flash_sale_price))
+
+        # The schedule survives the sell-out: topping the allotment up resumes the sale.
+        self.assertGreater(self.flash.flash_sale_end, timezone.now())
+        self.flash.flash_sale_stock = 2
+        self.flash.save()
+        self.assertTrue(self.flash.is_in_flash_sale)
+        self.reserve((self.flash, 1, self.flash.flash_sale_price))
+
+
+class StockReservationConcurrencyTests(TransactionTestCase):
+    """Hammer one SKU from many threads against the file-backed test database."""
+
+    BUYERS = 200
+    STOCK = 60
+
+    def test_no_overselling_under_concurrent_checkouts(self):
+        self.assertFalse(connection.is_in_memory_db())
+        product = make_product('Hot SKU', stock=self.STOCK)
+        sold = []
+        rejected = []
+        errors = []
+        barrier = threading.Barrier(self.BUYERS)
+
+        def buy():
+            try:
+                quoted = Product.objects.get(pk=product.pk)
+                barrier.wait()
+                with transaction.atomic():
+                    reserve_stock([(quoted, 1, quoted.price)])
+                    Order.objects.create(customer_name='x', phone='1', address='y', total_amount=quoted.price)
+                sold.append(1)
+            except InsufficientStock:
+                rejected.append(1)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(self.BUYERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        product.refresh_from_db()
+        self.assertEqual(len(sold), self.STOCK)
+        self.assertEqual(len(rejected), self.BUYERS - self.STOCK)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.count(), self.STOCK)
+
+
+class OrderBuilderTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = [make_product(f'SP {i}', stock=100) for i in range(40)]
+
+    def _place(self, count):
+        items, _ = quote_cart({str(p.id): 2 for p in self.products[:count]})
+        order = Order(customer_name='A', phone='1', address='HN')
+        with CaptureQueriesContext(connection) as ctx:
+            create_order(order, items)
+        return order, len(ctx.captured_queries)
+
+    def test_query_count_is_independent_of_cart_size(self):
+        small, small_queries = self._place(1)
+        large, large_queries = self._place(40)
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(large.items.count(), 40)
+        self.assertEqual(large.total_amount, Decimal('100000') * 2 * 40)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 96)
+
+    def test_import_orders(self):
+        first, second = self.products[:2]
+        orders = import_orders([
+            {'customer_name': 'A', 'phone': '1', 'address': 'HN', 'items': [(first.id, 1), (second.id, 3)]},
+            {'customer_name': 'B', 'phone': '2', 'address': 'HCM', 'status': 'done', 'items': [(first.id, 2)]},
+        ])
+        self.assertEqual([o.total_amount for o in orders], [Decimal('400000'), Decimal('200000')])
+        self.assertEqual(OrderItem.objects.filter(order=orders[0]).count(), 2)
+        self.assertEqual(Order.objects.get(pk=orders[1].pk).status, 'done')
+        first.refresh_from_db()
+        self.assertEqual(first.stock, 100)
+        with self.assertRaises(ValueError):
+            import_orders([{'customer_name': 'C', 'phone': '3', 'address': 'x', 'items': [(999999, 1)]}])
+
+    def test_import_orders_can_reserve_stock(self):
+        product = self.products[0]
+        import_orders([{'customer_name': 'A', 'phone': '1', 'address': 'HN', 'items': [(product.id, 60)]}], reserve=True)
+        with self.assertRaises(InsufficientStock):
+            import_orders([{'customer_name': 'B', 'phone': '1', 'address': 'HN', 'items': [(product.id, 60)]}], reserve=True)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 40)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+CHECKOUT = {'customer_name': 'Khách', 'phone': '0900000000', 'address': 'Hà Nội', 'payment_method': 'cod'}
+
+
+@override_settings(SHOP_ORDER_INTAKE='queued')
+class QueuedCheckoutTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product('Áo', stock=5)
+
+    def test_checkout_queues_the_order_until_a_worker_runs(self):
+        user = User.objects.create_user('an', password='x')
+        self.client.force_login(user)
+        self.client.post(reverse('add_to_cart', args=[self.product.pk]), {'qty': 2})
+        response = self.client.post(reverse('checkout'), CHECKOUT)
+        pending = PendingOrder.objects.get()
+        self.assertRedirects(response, reverse('order_pending', args=[pending.number]))
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 3)
+        status_url = reverse('order_status_json', args=[pending.number])
+        self.assertEqual(self.client.get(status_url).json()['status'], 'pending')
+        self.assertContains(self.client.get(response.url), pending.number)
+
+        call_command('order_worker', '--once', stdout=StringIO())
+        order = Order.objects.get()
+        self.assertEqual(self.client.get(status_url).json(), {
+            'number': pending.number, 'status': 'placed', 'order_id': order.pk,
+        })
+        self.assertEqual((order.user, order.status, order.total_amount), (user, 'new', Decimal('200000')))
+        self.assertEqual(list(order.items.values_list('product_id', 'quantity')), [(self.product.pk, 2)])
+        self.assertEqual(OrderRollup.objects.get(period='day').orders, 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 3)
+        self.assertEqual(self.client.get(reverse('order_status_json', args=['NOPE'])).status_code, 404)
+
+    def test_insufficient_stock_queues_nothing(self):
+        items, _ = quote_cart({str(self.product.pk): 6})
+        with self.assertRaises(InsufficientStock):
+            enqueue_order(Order(**CHECKOUT), items)
+        self.assertFalse(PendingOrder.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 5)
+
+    def test_a_lapsed_claim_cannot_materialise(self):
+        items, _ = quote_cart({str(self.product.pk): 1})
+        enqueue_order(Order(**CHECKOUT), items)
+        token, batch = claim('slow', lease=30)
+        later = timezone.now() + timedelta(seconds=31)
+        with mock.patch('shop.order_queue.timezone.now', return_value=later):
+            self.assertEqual(process_batch('fast'), 1)
+        with self.assertRaises(LeaseLost):
+            materialize(batch, token)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(PendingOrder.objects.get().attempts, 2)
+
+    def test_a_failing_order_does_not_hold_up_its_batch(self):
+        items, _ = quote_cart({str(self.product.pk): 1})
+        good = enqueue_order(Order(**CHECKOUT), items)
+        bad = enqueue_order(Order(**CHECKOUT), items)
+        PendingOrder.objects.filter(pk=bad.pk).update(payload={**bad.payload, 'total': 'not a number'})
+        self.assertEqual(process_batch('w'), 2)
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual((good.status, bad.status), ('done', 'failed'))
+        self.assertIn('InvalidOperation', bad.error)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_an_order_that_keeps_killing_its_worker_is_given_up_on(self):
+        items, _ = quote_cart({str(self.product.pk): 1})
+        poison, fresh = enqueue_order(Order(**CHECKOUT), items), enqueue_order(Order(**CHECKOUT), items)
+        PendingOrder.objects.filter(pk=poison.pk).update(attempts=1)
+        # A lapsed row is retried on its own, so its batch-mates keep their attempts.
+        self.assertEqual([p.pk for p in claim('w')[1]], [poison.pk])
+        PendingOrder.objects.filter(pk=poison.pk).update(attempts=MAX_ATTEMPTS, claimed_until=None)
+        self.assertEqual([p.pk for p in claim('w')[1]], [fresh.pk])
+        poison.refresh_from_db()
+        self.assertEqual((poison.status, poison.error), ('failed', f'Gave up after {MAX_ATTEMPTS} attempts'))
+
+    def test_admin_retries_or_cancels_failed_orders(self):
+        items, _ = quote_cart({str(self.product.pk): 1})
+        retried, cancelled, done = (enqueue_order(Order(**CHECKOUT), items) for _ in range(3))
+        PendingOrder.objects.filter(pk__in=[retried.pk, cancelled.pk]).update(
+            status='failed', attempts=MAX_ATTEMPTS, error='boom',
+        )
+        PendingOrder.objects.filter(pk=done.pk).update(status='done')
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        changelist = reverse('admin:shop_pendingorder_changelist')
+        for action, pending in (('retry', retried), ('cancel', cancelled)):
+            response = self.client.post(changelist, {
+                'action': action, '_selected_action': [pending.pk, done.pk],
+            }, follow=True)
+            self.assertContains(response, 'Bỏ qua 1 đơn')
+        retried.refresh_from_db()
+        cancelled.refresh_from_db()
+        self.assertEqual((retried.status, retried.attempts, retried.error), ('queued', 0, ''))
+        self.assertEqual(cancelled.status, 'cancelled')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 3)
+        # Cancelling again does not hand the stock back twice.
+        self.client.post(changelist, {'action': 'cancel', '_selected_action': [cancelled.pk]})
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 3)
+        self.assertEqual(process_batch('w'), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        status_url = reverse('order_status_json', args=[cancelled.number])
+        self.assertEqual(self.client.get(status_url).json()['status'], 'cancelled')
+
+class OrderWorkerCrashTests(TransactionTestCase):
+    """Kill a worker process in the middle of a batch and drain the queue again."""
+
+    ORDERS = 20
+
+    def test_killed_worker_leaves_no_orders_and_its_batch_is_redone_once(self):
+        cache.clear()
+        product = make_product('Hot SKU', stock=100)
+        items, _ = quote_cart({str(product.pk): 1})
+        for _ in range(self.ORDERS):
+            enqueue_order(Order(**CHECKOUT), items)
+        connections.close_all()
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Child: stop inside the batch transaction, after the orders are written.
+            try:
+                os.close(read_end)
+
+                def stall(pairs):
+                    os.write(write_end, b'x')
+                    time.sleep(60)
+
+                with mock.patch('shop.order_queue.record_orders', stall):
+                    process_batch('doomed', batch_size=self.ORDERS, lease=30)
+            finally:
+                os._exit(1)
+        os.close(write_end)
+        self.assertEqual(os.read(read_end, 1), b'x')
+        os.close(read_end)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(OrderItem.objects.count(), 0)
+        self.assertEqual(PendingOrder.objects.filter(status='queued', claim__startswith='doomed').count(), self.ORDERS)
+        # Still leased: nothing for another worker yet.
+        self.assertEqual(run_worker(once=True), 0)
+
+        later = timezone.now() + timedelta(seconds=31)
+        with mock.patch('shop.order_queue.timezone.now', return_value=later):
+            self.assertEqual(run_worker(batch_size=7, once=True), self.ORDERS)
+        self.assertEqual(Order.objects.count(), self.ORDERS)
+        self.assertEqual(OrderItem.objects.count(), self.ORDERS)
+        self.assertEqual(set(PendingOrder.objects.values_list('status', 'attempts')), {('done', 2)})
+        self.assertEqual(PendingOrder.objects.filter(order__isnull=True).count(), 0)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 100 - self.ORDERS)
+        self.assertEqual(OrderRollup.objects.get(period='day').orders, self.ORDERS)
+
+
+class PricingSnapshotTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product('Chuột', stock=5)
+        self.client.post(reverse('add_to_cart', args=[self.product.id]), {'qty': 2})
+
+    def _product_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        return response, [q for q in ctx.captured_queries if 'shop_product' in q['sql']]
+
+    def test_warm_cart_needs_no_product_queries(self):
+        response, queries = self._product_queries(reverse('cart_view'))
+        self.assertEqual(queries, [])
+        self.assertEqual(response.context['total'], Decimal('200000'))
+
+    def test_snapshot_dropped_on_save_and_missing_ids_remembered(self):
+        self.product.price = Decimal('150000')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response, queries = self._product_queries(reverse('cart_view'))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.context['total'], Decimal('300000'))
+        self.assertEqual(get_snapshots([self.product.id, 999999]).keys(), {self.product.id})
+        with self.assertNumQueries(0):
+            get_snapshots([999999])
+
+    def test_checkout_revalidates_stale_snapshot(self):
+        # update() bypasses signals, so the cached snapshot still has the old price.
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('1'))
+        response = self.client.post(reverse('checkout'), CHECKOUT_DATA)
+        self.assertRedirects(response, reverse('cart_view'))
+        self.assertFalse(Order.objects.exists())
+
+    def test_update_cart_sets_quantity(self):
+        self.client.post(reverse('update_cart', args=[self.product.id]), {'qty': 4})
+        self.assertEqual(dict(CartItem.objects.values_list('product_id', 'quantity')), {self.product.id: 4})
+        self.client.post(reverse('update_cart', args=[self.product.id]), {'qty': 50})
+        self.assertEqual(dict(CartItem.objects.values_list('product_id', 'quantity')), {self.product.id: 5})
+
+
+class FlashSaleTimelineTests(ShopTestCase):
+    def test_active_set_and_transitions(self):
+        t0 = timezone.now()
+
+        def at(minutes):
+            return t0 + timedelta(minutes=minutes)
+
+        timeline = FlashSaleTimeline([(1, at(0), at(10)), (2, at(5), at(20)), (3, at(30), at(30))])
+        self.assertEqual(timeline.active_ids(at(-1)), frozenset())
+        self.assertEqual(timeline.next_transition(at(-1)), at(0))
+        self.assertEqual(timeline.active_ids(at(0)), {1})
+        self.assertEqual(timeline.active_ids(at(7)), {1, 2})
+        self.assertEqual(timeline.ends_at(at(7)), at(10))
+        self.assertEqual(timeline.next_transition(at(7)), at(10))
+        self.assertEqual(timeline.active_ids(at(10)), {2})
+        self.assertEqual(timeline.active_ids(at(25)), frozenset())
+        self.assertIsNone(timeline.next_transition(at(25)))
+
+    def test_home_strip_follows_timeline_without_queries_when_warm(self):
+        now = timezone.now()
+        make_product(
+            'Flash', flash_sale_price=Decimal('50000'),
+            flash_sale_start=now - timedelta(minutes=1), flash_sale_end=now + timedelta(hours=1),
+        )
+        self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        self.assertEqual([p.name for p in response.context['flash_sale_products']], ['Flash'])
+        self.assertEqual(response.context['flash_sale_ends_at'], now + timedelta(hours=1))
+
+    def test_worker_prewarms_upcoming_strip(self):
+        now = timezone.now()
+        make_product(
+            'Sắp mở bán', flash_sale_price=Decimal('50000'),
+            flash_sale_start=now + timedelta(seconds=3), flash_sale_end=now + timedelta(hours=1),
+        )
+        out = StringIO()
+        call_command('flash_sale_worker', '--once', '--lead', '10', stdout=out)
+        self.assertIn('pre-warmed flash_sale_strip:', out.getvalue())
+
+        # Once the sale opens, the homepage strip is served from the pre-warmed entry.
+        with mock.patch('shop.views.timezone.now', return_value=now + timedelta(seconds=4)):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse('home'))
+        self.assertEqual([p.name for p in response.context['flash_sale_products']], ['Sắp mở bán'])
+        self.assertFalse([q for q in ctx.captured_queries if 'flash_sale_end" ASC' in q['sql']])
+
+    def test_worker_refuses_a_process_local_cache(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem), self.assertRaises(CommandError):
+            call_command('flash_sale_worker', '--once', stdout=StringIO())
+
+    def test_timeline_sweep_matches_window_scan(self):
+        t0 = timezone.now()
+        windows = [
+            (pid, t0 + timedelta(minutes=(pid * 7) % 60), t0 + timedelta(minutes=(pid * 7) % 60 + pid % 45 + 1))
+            for pid in range(200)
+        ]
+        timeline = FlashSaleTimeline(windows)
+        for minute in range(-1, 110):
+            at = t0 + timedelta(minutes=minute, seconds=30)
+            running = [(pid, end) for pid, start, end in windows if start <= at < end]
+            self.assertEqual(timeline.active_ids(at), {pid for pid, _ in running})
+            self.assertEqual(timeline.ends_at(at), min((end for _, end in running), default=None))
+
+
+class EffectivePriceTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.plain = make_product('Tai nghe', price=Decimal('80000'))
+        self.flash = make_product(
+            'Flash', stock=10, flash_sale_price=Decimal('66667'), flash_sale_stock=2,
+            flash_sale_start=self.now - timedelta(minutes=5), flash_sale_end=self.now + timedelta(hours=1),
+        )
+        self.upcoming = make_product(
+            'Sắp mở bán', price=Decimal('200000'), flash_sale_price=Decimal('150000'),
+            flash_sale_start=self.now + timedelta(minutes=10), flash_sale_end=self.now + timedelta(hours=2),
+        )
+
+    def pricing(self, product):
+        product.refresh_from_db()
+        return product.effective_price, product.discount_percent
+
+    def test_save_sets_columns_and_sold_out_sale_resets_them(self):
+        self.assertEqual(self.pricing(self.plain), (Decimal('80000'), 0))
+        self.assertEqual(self.pricing(self.flash), (Decimal('66667'), 33))
+        self.assertEqual(self.pricing(self.upcoming), (Decimal('200000'), 0))
+        self.plain.flash_sale_price = Decimal('60000')
+        self.plain.flash_sale_start, self.plain.flash_sale_end = self.flash.flash_sale_start, self.flash.flash_sale_end
+        self.plain.save(update_fields=['flash_sale_price', 'flash_sale_start', 'flash_sale_end'])
+        self.assertEqual(self.pricing(self.plain), (Decimal('60000'), 25))
+
+        with transaction.atomic():
+            reserve_stock([(self.flash, 2, self.flash.flash_sale_price)])
+        self.assertEqual(self.pricing(self.flash), (Decimal('100000'), 0))
+
+    def test_refresh_prices_follows_transitions(self):
+        opens = self.upcoming.flash_sale_start + timedelta(seconds=1)
+        self.assertEqual(refresh_prices(now=opens), [self.upcoming.pk])
+        self.assertEqual(self.pricing(self.upcoming), (Decimal('150000'), 25))
+        self.assertEqual(refresh_prices(now=opens), [])
+        closes = self.upcoming.flash_sale_end + timedelta(seconds=1)
+        self.assertEqual(sorted(refresh_prices(now=closes)), sorted([self.flash.pk, self.upcoming.pk]))
+        self.assertEqual(self.pricing(self.upcoming), (Decimal('200000'), 0))
+
+    def test_worker_reprices_the_running_segment(self):
+        # A sale that opened while nothing was running to reprice it.
+        Product.objects.filter(pk=self.flash.pk).update(effective_price=F('price'), discount_percent=0)
+        out = StringIO()
+        call_command('flash_sale_worker', '--once', stdout=out)
+        self.assertIn('repriced 1 products', out.getvalue())
+        self.assertEqual(self.pricing(self.flash), (Decimal('66667'), 33))
+
+    def test_home_sorts_and_filters_by_current_price(self):
+        def names(**params):
+            response = self.client.get(reverse('home'), params)
+            return [p.name for p in response.context['products']]
+
+        self.assertEqual(names(sort='price_asc'), ['Flash', 'Tai nghe', 'Sắp mở bán'])
+        self.assertEqual(names(sort='price_desc'), ['Sắp mở bán', 'Tai nghe', 'Flash'])
+        self.assertEqual(names(sort='discount')[0], 'Flash')
+        self.assertEqual(names(sort='price_asc', min_price='70000', max_price='100000'), ['Tai nghe'])
+        self.assertEqual(names(max_price='abc'), ['Sắp mở bán', 'Flash', 'Tai nghe'])
+        response = self.client.get(reverse('home'), {'sort': 'discount', 'q': 'a b', 'min_price': '1'})
+        self.assertEqual(response.context['grid_query'], '&q=a+b&sort=discount&min_price=1')
+
+
+class ConditionalGetTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.product = make_product(
+            'Flash', flash_sale_price=Decimal('50000'),
+            flash_sale_start=self.now + timedelta(minutes=1), flash_sale_end=self.now + timedelta(hours=1),
+        )
+        self.url = reverse('product_detail', args=[self.product.slug])
+
+    def _get(self, url, at=None, **headers):
+        with mock.patch('shop.conditional.timezone.now', return_value=at or self.now):
+            return self.client.get(url, headers=headers)
+
+    def test_unchanged_pages_answer_304_without_rendering(self):
+        for url in (reverse('home'), self.url):
+            with self.subTest(url=url):
+                response = self._get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['ETag'].startswith('W/"'))
+                self.assertIn('Last-Modified', response)
+                self.assertEqual(response['Cache-Control'], 'private, no-cache')
+                # A product page reads its product's state (stock changes
+                # without a catalog version bump); the homepage reads nothing.
+                with self.assertNumQueries(0 if url == reverse('home') else 1):
+                    again = self._get(url, if_none_match=response['ETag'])
+                self.assertEqual(again.status_code, 304)
+                self.assertFalse(again.templates)
+                self.assertEqual(again['ETag'], response['ETag'])
+
+        etag = self._get(self.url)['ETag']
+        self.product.price = Decimal('90000')
+        self.product.save()
+        self.assertNotEqual(self._get(self.url)['ETag'], etag)
+        self.assertEqual(self._get(reverse('product_detail', args=['khong-co'])).status_code, 404)
+
+    def test_selling_out_invalidates_the_product_page(self):
+        response = self._get(self.url)
+        self.assertContains(response, 'Còn hàng (10)')
+        with transaction.atomic():
+            reserve_stock([(self.product, 10, self.product.price)])
+        again = self._get(self.url, if_none_match=response['ETag'], if_modified_since=response['Last-Modified'])
+        self.assertEqual(again.status_code, 200)
+        self.assertNotContains(again, 'Còn hàng (10)')
+
+    def test_validators_flip_when_flash_sale_starts_and_ends(self):
+        before, during, after = self.now, self.now + timedelta(minutes=2), self.now + timedelta(hours=2)
+        for url in (reverse('home'), self.url):
+            with self.subTest(url=url):
+                etags = [self._get(url, at)['ETag'] for at in (before, during, after)]
+                self.assertEqual(len(set(etags)), 3)
+                self.assertEqual(self._get(url, during, if_none_match=etags[0]).status_code, 200)
+                self.assertEqual(self._get(url, during + timedelta(minutes=5), if_none_match=etags[1]).status_code, 304)
+                self.assertEqual(self._get(url, after, if_none_match=etags[1]).status_code, 200)
+        response = self._get(self.url, during)
+        self.assertContains(response, '50000')
+        self.assertEqual(parse_http_date(response['Last-Modified']), int(self.product.flash_sale_start.timestamp()))
+        since = response['Last-Modified']
+        self.client.cookies.clear()
+        self.assertEqual(self._get(self.url, during, if_modified_since=since).status_code, 304)
+        self.assertEqual(self._get(self.url, after, if_modified_since=since).status_code, 200)
+
+    def test_visitor_is_part_of_the_etag(self):
+        etag = self._get(self.url)['ETag']
+        self.client.force_login(User.objects.create_user('khach', password='x'))
+        response = self._get(self.url, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'khach')
+        # With cookies, Last-Modified alone cannot vouch for the page.
+        self.assertEqual(self._get(self.url, if_modified_since=response['Last-Modified']).status_code, 200)
+        self.assertEqual(self._get(self.url, if_none_match=response['ETag']).status_code, 304)
+
+
+@override_settings(SHOP_INSTRUMENTATION_SAMPLE_RATE=1.0)
+class InstrumentationTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        instrumentation.reset()
+        self.addCleanup(instrumentation.reset)
+        make_product('Áo thun', Category.objects.create(name='Áo'))
+
+    def test_records_queries_and_template_time_per_url_name(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('cart_view'))
+        samples = instrumentation.collect()
+        self.assertEqual(set(samples), {'home', 'cart_view'})
+        home = samples['home'][0]
+        self.assertGreater(home.queries, 0)
+        self.assertGreater(home.template_ms, 0)
+        self.assertGreaterEqual(home.duration_ms, home.template_ms)
+
+    def test_duplicate_statements_are_fingerprinted(self):
+        self.assertEqual(
+            instrumentation.fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x'  LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+        Category.objects.create(name='Giày')
+        recorder = instrumentation._Recorder()
+        with connection.execute_wrapper(recorder):
+            for category in Category.objects.all():
+                list(Product.objects.filter(category=category))
+        self.assertEqual(sorted(recorder.statements.values()), [1, 2])
+
+        report = instrumentation.summarize({'home': [
+            instrumentation.Sample(10, 12, 4, 3, (('SELECT ?', 10),)),
+            instrumentation.Sample(20, 12, 4, 3, (('SELECT ?', 10),)),
+        ]})
+        self.assertEqual(report['views'][0]['duration_ms']['p99'], 20)
+        self.assertEqual(report['duplicates'][0]['executions'], 20)
+        self.assertEqual(report['duplicates'][0]['per_request'], 10)
+
+    @override_settings(SHOP_INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_disabled_when_sample_rate_is_zero(self):
+        self.client.get(reverse('home'))
+        self.assertEqual(instrumentation.collect(), {})
+
+    def test_report_command_and_admin_page(self):
+        self.client.get(reverse('home'))
+        out = StringIO()
+        call_command('instrumentation_report', stdout=out)
+        self.assertIn('home', out.getvalue())
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        response = self.client.get(reverse('admin_instrumentation'))
+        self.assertContains(response, 'home')
+
+
+class RelatedProductsTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        phones = Category.objects.create(name='Điện thoại')
+        other = Category.objects.create(name='Khác')
+        self.phone = make_product('Điện thoại Galaxy', phones, specifications='Màn hình AMOLED')
+        self.twin = make_product('Điện thoại Galaxy Plus', phones, specifications='Màn hình AMOLED')
+        self.sibling = make_product('Điện thoại cũ', phones)
+        self.case = make_product('Ốp lưng silicon', other)
+        self.stranger = make_product('Nồi cơm điện', other)
+        self.hidden = make_product('Điện thoại Galaxy ẩn', phones, is_active=False)
+
+    def _ids(self, product):
+        product = Product.objects.select_related('related_list').get(pk=product.pk)
+        return [p.pk for p in related_products(product)]
+
+    def test_rebuild_ranks_copurchases_category_and_text(self):
+        import_orders([
+            {'customer_name': 'A', 'phone': '1', 'address': 'HN', 'items': [(self.phone.pk, 1), (self.case.pk, 1)]},
+        ] * 2)
+        self.assertEqual(rebuild_related(), 5)
+        ids = self._ids(self.phone)
+        self.assertEqual(ids[:3], [self.twin.pk, self.case.pk, self.sibling.pk])
+        self.assertNotIn(self.hidden.pk, ids)
+        self.assertNotIn(self.phone.pk, ids)
+
+    def test_detail_page_reads_related_by_primary_key(self):
+        rebuild_related()
+        get_timeline()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('product_detail', args=[self.phone.slug]))
+        product_queries = [q['sql'] for q in ctx.captured_queries if 'shop_product' in q['sql']]
+        # The conditional-GET validator, then the product and its related list.
+        self.assertEqual(len(product_queries), 3)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('product_detail', args=[self.phone.slug]))
+        self.assertEqual(len([q for q in ctx.captured_queries if 'shop_product' in q['sql']]), 3)
+        self.assertEqual([p.pk for p in response.context['related_products']], self._ids(self.phone))
+
+    def test_orders_and_saves_refresh_incrementally(self):
+        rebuild_related()
+        self.assertNotEqual(self._ids(self.stranger)[0], self.sibling.pk)
+        items, _ = quote_cart({str(self.stranger.pk): 1, str(self.sibling.pk): 1})
+        create_order(Order(customer_name='A', phone='1', address='HN'), items)
+        self.assertEqual(RelatedProductList.objects.filter(is_stale=True).count(), 2)
+        out = StringIO()
+        call_command('rebuild_related_products', '--stale', stdout=out)
+        self.assertIn('Refreshed 2', out.getvalue())
+        self.assertEqual(self._ids(self.stranger)[0], self.sibling.pk)
+        self.assertEqual(self._ids(self.sibling)[0], self.stranger.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.case.is_active = False
+            self.case.save()
+        self.assertEqual(self._ids(self.case), [])
+
+
+class CartStoreTests(ShopTestCase):
+    STORES = ('shop.carts.DatabaseCartStore', 'shop.carts.CacheCartStore', 'shop.carts.SignedCookieCartStore')
+
+    def setUp(self):
+        super().setUp()
+        self.first = make_product('Áo', stock=50)
+        self.second = make_product('Quần', stock=50)
+
+    def _cart(self):
+        response = self.client.get(reverse('cart_view'))
+        return {item['product'].pk: item['qty'] for item in response.context['items']}
+
+    def test_every_store_keeps_the_cart_out_of_the_session(self):
+        for store in self.STORES:
+            with self.subTest(store=store), self.settings(SHOP_CART_STORE=store):
+                self.client.cookies.clear()
+                self.client.post(reverse('add_to_cart', args=[self.first.pk]), {'qty': 2})
+                with CaptureQueriesContext(connection) as ctx:
+                    self.client.post(reverse('add_to_cart', args=[self.first.pk]), {'qty': 1})
+                self.assertFalse([q for q in ctx.captured_queries if 'django_session' in q['sql']])
+                self.client.post(reverse('add_to_cart', args=[self.second.pk]), {'qty': 1})
+                self.client.post(reverse('update_cart', args=[self.second.pk]), {'qty': 4})
+                self.assertEqual(self._cart(), {self.first.pk: 3, self.second.pk: 4})
+                self.client.post(reverse('remove_from_cart', args=[self.first.pk]))
+                self.assertEqual(self._cart(), {self.second.pk: 4})
+                self.client.post(reverse('clear_cart'))
+                self.assertEqual(self._cart(), {})
+
+    def test_database_store_changes_one_row_per_update(self):
+        self.client.post(reverse('add_to_cart', args=[self.first.pk]), {'qty': 1})
+        self.client.post(reverse('add_to_cart', args=[self.second.pk]), {'qty': 1})
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse('add_to_cart', args=[self.first.pk]), {'qty': 1})
+        writes = [q['sql'] for q in ctx.captured_queries if not q['sql'].startswith('SELECT')]
+        self.assertEqual(len(writes), 1)
+        self.assertIn('ON CONFLICT', writes[0])
+
+    def test_purge_deletes_only_abandoned_anonymous_carts(self):
+        old = timezone.now() - timedelta(days=40)
+        CartItem.objects.bulk_create([
+            CartItem(cart_key='a:' + 'a' * 32, product=self.first, quantity=1),
+            CartItem(cart_key='a:' + 'b' * 32, product=self.first, quantity=1),
+            CartItem(cart_key='a:' + 'b' * 32, product=self.second, quantity=1),
+            CartItem(cart_key='u:1', product=self.first, quantity=1),
+        ])
+        CartItem.objects.update(updated_at=old)
+        # Cart "b" changed one line recently: the whole cart stays.
+        CartItem.objects.filter(cart_key='a:' + 'b' * 32, product=self.second).update(updated_at=timezone.now())
+        out = StringIO()
+        call_command('purge_carts', '--older-than', '30', stdout=out)
+        self.assertIn('Deleted 1 ', out.getvalue())
+        self.assertEqual(sorted(set(CartItem.objects.values_list('cart_key', flat=True))), ['a:' + 'b' * 32, 'u:1'])
+
+    def test_compact_encoding_and_tampered_cookie(self):
+        self.assertEqual(carts.encode({12: 3, 7: 1, 9: 0}), '12:3,7:1')
+        self.assertEqual(carts.decode('12:3,7:1,x:2,5:-1,8:5000'), {12: 3, 7: 1, 8: carts.MAX_QUANTITY})
+        with self.settings(SHOP_CART_STORE='shop.carts.SignedCookieCartStore'):
+            self.client.post(reverse('add_to_cart', args=[self.first.pk]), {'qty': 2})
+            self.client.cookies[carts.CART_COOKIE] = self.client.cookies[carts.CART_COOKIE].value.replace(':2', ':9')
+            self.assertEqual(self._cart(), {})
+
+    def test_anonymous_cart_is_merged_on_login(self):
+        user = User.objects.create_user('khach', password='pw')
+        CartItem.objects.create(cart_key=f'u:{user.pk}', product=self.first, quantity=1)
+        self.client.post(reverse('add_to_cart', args=[self.first.pk]), {'qty': 2})
+        self.client.post(reverse('add_to_cart', args=[self.second.pk]), {'qty': 1})
+        self.client.post(reverse('login'), {'username': 'khach', 'password': 'pw'})
+        self.assertEqual(self._cart(), {self.first.pk: 3, self.second.pk: 1})
+        self.assertFalse(CartItem.objects.exclude(cart_key=f'u:{user.pk}').exists())
+
+
+class AsyncStorefrontTests(TransactionTestCase):
+    """Async views fetch in worker threads, which need committed data."""
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        use_temp_media(self)
+        self.category = Category.objects.create(name='Điện thoại')
+        Banner.objects.create(title='Sale tháng 10', image_url='https://img.example/b.png', is_featured=True)
+        self.products = [make_product(f'Điện thoại {i}', self.category) for i in range(12)]
+        self.factory = RequestFactory()
+
+    def _render(self, view, path, data=None, **kwargs):
+        request = self.factory.get(path, data or {})
+        request.user = AnonymousUser()
+        if asyncio.iscoroutinefunction(view):
+            return async_to_sync(view)(request, **kwargs)
+        return view(request, **kwargs)
+
+    def test_async_home_matches_sync_home(self):
+        for data in ({}, {'cat': self.category.slug, 'page': 2}, {'q': 'dien thoai'}):
+            with self.subTest(data=data):
+                cache.clear()
+                expected = self._render(views.home_view, '/', data)
+                cache.clear()
+                actual = self._render(async_views.home_view, '/', data)
+                self.assertEqual(actual.status_code, 200)
+                strip = partial(re.sub, rb'name="csrfmiddlewaretoken" value="[^"]+"', b'')
+                self.assertEqual(strip(actual.content), strip(expected.content))
+
+    def test_async_search_in_a_fresh_process(self):
+        # Nothing has checked for the FTS table yet: that check must not run on the event loop.
+        self.enterContext(mock.patch.dict(search._fts_ready, clear=True))
+        response = self._render(async_views.home_view, '/', {'q': 'dien thoai'})
+        self.assertContains(response, 'Điện thoại 11')
+        search._fts_ready.clear()
+        payload = json.loads(self._render(async_views.product_list_json, '/products.json', {'q': 'dien thoai'}).content)
+        self.assertEqual(payload['product_count'], 12)
+
+    def test_async_json_and_detail(self):
+        response = self._render(async_views.product_list_json, '/products.json')
+        payload = json.loads(response.content)
+        self.assertEqual(payload['product_count'], 12)
+        self.assertEqual(len(payload['products']), 10)
+        product = self.products[0]
+        response = self._render(async_views.product_detail_view, '/', slug=product.slug)
+        self.assertContains(response, product.name)
+        self.assertContains(response, self.category.name)
+        with self.assertRaises(Http404):
+            self._render(async_views.product_detail_view, '/', slug='khong-co')
+
+    @override_settings(SHOP_INSTRUMENTATION_SAMPLE_RATE=1.0)
+    def test_instrumentation_counts_queries_of_worker_thread_stages(self):
+        instrumentation.reset()
+        self.addCleanup(instrumentation.reset)
+        for name, view in (('sync', views.home_view), ('async', async_views.home_view)):
+            cache.clear()
+            middleware = instrumentation.InstrumentationMiddleware(
+                lambda request, view=view: self._render(view, '/', {'q': 'dien thoai'}),
+            )
+            middleware(self.factory.get('/'))
+        sync_sample, async_sample = instrumentation.local_samples()['home']
+        self.assertGreater(sync_sample.queries, 0)
+        self.assertEqual(async_sample.queries, sync_sample.queries)
+
+    def test_independent_regions_are_built_concurrently(self):
+        def slow(name):
+            def build(regions):
+                time.sleep(0.2)
+                return name
+            return build
+
+        stages = [
+            {'a': slow('a'), 'b': slow('b'), 'c': slow('c')},
+            {'abc': lambda regions: regions['a'] + regions['b'] + regions['c']},
+        ]
+        started = time.perf_counter()
+        regions = async_to_sync(region_cache.aget_regions)(stages, 1)
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(regions['abc'], 'abc')
+        self.assertEqual(async_to_sync(region_cache.aget_regions)(stages[:1], 1)['a'], 'a')
+
+
+class DatabaseRoutingTests(TransactionTestCase):
+    """The replica only sees committed rows, so these tests commit."""
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        use_temp_media(self)
+        self.product = make_product('Tai nghe')
+
+    def _pragma(self, alias, name):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connections_are_tuned_and_replica_is_read_only(self):
+        self.assertEqual(self._pragma('default', 'journal_mode'), 'wal')
+        self.assertEqual(self._pragma('default', 'synchronous'), 1)
+        self.assertEqual(self._pragma('default', 'busy_timeout'), 5000)
+        self.assertEqual(self._pragma('replica', 'query_only'), 1)
+        with self.assertRaises(OperationalError):
+            Product.objects.using('replica').filter(pk=self.product.pk).update(stock=0)
+
+    def test_storefront_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('product_detail', args=[self.product.slug]))
+            self.client.get(reverse('home'))
+        self.assertTrue(replica.captured_queries)
+
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.post(reverse('add_to_cart', args=[self.product.pk]), {'qty': 1})
+            self.client.post(reverse('checkout'), {
+                'customer_name': 'Khách', 'phone': '0900000000', 'address': 'Hà Nội', 'payment_method': 'cod',
+            })
+        self.assertFalse(replica.captured_queries)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_lock_timeouts_are_not_reported_as_a_missing_database(self):
+        with mock.patch('shop.views.get_regions', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                self.client.get(reverse('home'))
+        with mock.patch('shop.views.get_regions', side_effect=OperationalError('no such table: shop_banner')):
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, 'migrate')
+
+
+class SalesAnalyticsTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.phones = Category.objects.create(name='Điện thoại')
+        self.phone = make_product('Điện thoại A', self.phones, stock=1000)
+        self.case = make_product('Ốp lưng', stock=1000)
+
+    def _order(self, quantities, **fields):
+        items, _ = quote_cart({str(product.pk): qty for product, qty in quantities})
+        return create_order(Order(customer_name='A', phone='1', address='HN', **fields), items)
+
+    def _rows(self, model):
+        fields = [f.attname for f in model._meta.concrete_fields if f.name != 'id']
+        return sorted(model.objects.exclude(orders=0).values_list(*fields))
+
+    def test_orders_status_changes_and_deletes_update_every_period(self):
+        first = self._order([(self.phone, 2), (self.case, 1)])
+        self._order([(self.phone, 1)], payment_method='bank')
+        self.assertEqual(
+            sorted(SalesRollup.objects.filter(product=self.phone).values_list('period', 'units', 'orders')),
+            [('day', 3, 2), ('hour', 3, 2), ('month', 3, 2)],
+        )
+        self.assertEqual(SalesRollup.objects.get(period='day', product=self.phone).category_id, self.phones.pk)
+
+        first.status = 'cancel'
+        first.save()
+        self.assertEqual(SalesRollup.objects.get(period='month', product=self.phone).units, 1)
+        self.assertEqual(SalesRollup.objects.get(period='month', product=self.case).units, 0)
+        cancelled = OrderRollup.objects.get(period='day', status='cancel')
+        self.assertEqual((cancelled.orders, cancelled.revenue), (1, Decimal('300000')))
+
+        incremental = (self._rows(OrderRollup), self._rows(SalesRollup))
+        self.assertEqual(analytics.rebuild_rollups(), 9)
+        self.assertEqual((self._rows(OrderRollup), self._rows(SalesRollup)), incremental)
+
+        Order.objects.get(pk=first.pk).delete()
+        self.assertFalse(OrderRollup.objects.filter(status='cancel').exclude(orders=0).exists())
+
+    def test_year_range_reads_month_day_and_hour_buckets(self):
+        now = timezone.now()
+        for days_ago in (400, 200, 20, 0):
+            order = self._order([(self.phone, 1)])
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(days=days_ago, minutes=5))
+        call_command('backfill_sales_rollups', stdout=StringIO())
+
+        start = now - timedelta(days=365)
+        periods = {period for period, _, _ in analytics._segments(start, now)}
+        self.assertEqual(periods, {'month', 'day', 'hour'})
+        summary = analytics.sales_summary(start, now)
+        self.assertEqual((summary['orders'], summary['revenue']), (3, Decimal('300000')))
+        self.assertEqual(summary['products'][0]['units_total'], 3)
+        self.assertEqual(summary['categories'][0]['name'], self.phones.name)
+        self.assertEqual(analytics.units_sold(now - timedelta(days=30), now), {self.phone.pk: 2})
+        self.assertEqual(len(analytics.revenue_series(start, now, 'month')), 3)
+
+    def test_flags_follow_sales_velocity(self):
+        old = make_product('Bán đều', stock=1000, is_hot=True)
+        stale = make_product('Hết thời', stock=1000, is_best_seller=True)
+        now = timezone.now()
+        for days_ago in range(0, 28, 3):
+            order = self._order([(old, 1)])
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(days=days_ago, hours=1))
+        self._order([(self.phone, 5)])
+        analytics.rebuild_rollups()
+
+        self.assertEqual(analytics.product_flags(), ([old.pk, self.phone.pk], [self.phone.pk]))
+        call_command('update_product_flags', stdout=StringIO())
+        flags = dict(Product.objects.values_list('pk', 'is_best_seller'))
+        self.assertEqual((flags[self.phone.pk], flags[old.pk], flags[stale.pk]), (True, True, False))
+        self.assertEqual(list(Product.objects.filter(is_hot=True)), [self.phone])
+
+    def test_admin_dashboard(self):
+        self._order([(self.phone, 2)])
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        for days in (30, 365):
+            with self.assertNumQueries(7):
+                response = self.client.get(reverse('admin_sales'), {'days': days})
+            self.assertContains(response, self.phone.name)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('admin_sales'), {'days': 365})
+
+
+class OrderStatusTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product('Điện thoại', stock=1000)
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+
+    def _orders(self, count, status='new', qty=1):
+        items, _ = quote_cart({str(self.product.pk): qty})
+        orders = [create_order(Order(customer_name='A', phone='1', address='HN'), items) for _ in range(count)]
+        Order.objects.filter(pk__in=[o.pk for o in orders]).update(status=status)
+        analytics.rebuild_rollups()
+        return orders
+
+    def _rollups(self):
+        return (
+            sorted(OrderRollup.objects.exclude(orders=0).values_list('period', 'status', 'orders', 'revenue')),
+            sorted(SalesRollup.objects.exclude(orders=0).values_list('period', 'product_id', 'units', 'orders')),
+        )
+
+    def _transition_queries(self, target):
+        with CaptureQueriesContext(connection) as ctx:
+            moved = transition(Order.objects.all(), target, user=self.admin)
+        return moved, len(ctx.captured_queries)
+
+    def test_bulk_transition_moves_only_valid_sources_in_constant_queries(self):
+        self._orders(3, 'paid')
+        self._orders(2, 'done')
+        few = self._transition_queries('ship')
+        self.assertEqual(few[0], {'paid': 3})
+        self._orders(40, 'paid')
+        many = self._transition_queries('ship')
+        self.assertEqual(many, ({'paid': 40}, few[1]))
+        self.assertEqual(Order.objects.filter(status='ship').count(), 43)
+        self.assertEqual(Order.objects.filter(status='done').count(), 2)
+        change = OrderStatusChange.objects.order_by('pk').first()
+        self.assertEqual((change.from_status, change.to_status, change.changed_by), ('paid', 'ship', self.admin))
+        self.assertEqual(OrderStatusChange.objects.count(), 43)
+
+        incremental = self._rollups()
+        analytics.rebuild_rollups()
+        self.assertEqual(self._rollups(), incremental)
+
+    def test_cancelling_restocks_and_leaves_sales(self):
+        self._orders(5, 'new', qty=3)
+        self._orders(2, 'done', qty=3)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 1000 - 21)
+        self.assertEqual(transition(Order.objects.all(), 'cancel'), {'new': 5})
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 1000 - 6)
+        self.assertEqual(SalesRollup.objects.get(period='day', product=self.product).units, 6)
+        incremental = self._rollups()
+        analytics.rebuild_rollups()
+        self.assertEqual(self._rollups(), incremental)
+        # Cancelled is final: nothing moves, nothing is restocked twice.
+        self.assertEqual(transition(Order.objects.all(), 'cancel'), {})
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 1000 - 6)
+        with self.assertRaises(ValueError):
+            set_status(Order.objects.filter(status='cancel').first(), 'new')
+
+    def test_cancelling_the_last_units_resumes_a_limited_flash_sale(self):
+        now = timezone.now()
+        flash = make_product(
+            'Flash', stock=2, flash_sale_price=Decimal('50000'), flash_sale_stock=5,
+            flash_sale_start=now - timedelta(minutes=5), flash_sale_end=now + timedelta(hours=1),
+        )
+        items, _ = quote_cart({str(flash.pk): 2})
+        order = create_order(Order(customer_name='A', phone='1', address='HN'), items)
+        # Taking the last of the stock ended the sale: back to the list price.
+        self.assertEqual(Product.objects.get(pk=flash.pk).effective_price, Decimal('100000'))
+        version = region_cache.catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            transition(Order.objects.filter(pk=order.pk), 'cancel')
+        flash.refresh_from_db()
+        self.assertEqual((flash.stock, flash.effective_price, flash.discount_percent), (2, Decimal('50000'), 50))
+        self.assertNotEqual(region_cache.catalog_version(), version)
+
+    def test_admin_actions_and_form_enforce_transitions(self):
+        paid = self._orders(2, 'paid')
+        new = self._orders(1, 'new')[0]
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('admin:shop_order_changelist'), {
+            'action': 'mark_ship', '_selected_action': [o.pk for o in paid + [new]],
+        }, follow=True)
+        self.assertContains(response, 'Đã chuyển 2 đơn')
+        self.assertContains(response, 'Bỏ qua 1 đơn')
+        self.assertEqual(Order.objects.filter(status='ship').count(), 2)
+
+        url = reverse('admin:shop_order_change', args=[new.pk])
+        form = {'customer_name': 'A', 'phone': '1', 'address': 'HN', 'payment_method': 'cod', 'total_amount': '100000',
+                'status_changes-TOTAL_FORMS': 0, 'status_changes-INITIAL_FORMS': 0}
+        response = self.client.post(url, {**form, 'status': 'done'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get(pk=new.pk).status, 'new')
+        self.client.post(url, {**form, 'status': 'paid'})
+        self.assertEqual(Order.objects.get(pk=new.pk).status, 'paid')
+        self.assertEqual(list(new.status_changes.values_list('from_status', 'to_status')), [('new', 'paid')])
+        self.assertEqual(OrderRollup.objects.get(period='day', status='paid').orders, 1)
+        self.assertEqual(OrderRollup.objects.get(period='day', status='new').orders, 0)
+
+
+class AdminChangelistTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        self.phones = Category.objects.create(name='Điện thoại')
+        self.products = [make_product(f'Điện thoại {i}', self.phones, stock=1000) for i in range(3)]
+
+    def _orders(self, count):
+        items, _ = quote_cart({str(p.pk): 1 for p in self.products})
+        return [create_order(Order(customer_name='Nguyễn An', phone=f'0900{n:06d}', address='HN'), items)
+                for n in range(count)]
+
+    def _get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self._orders(2)
+        urls = [reverse(f'admin:shop_{name}_changelist') for name in ('orderitem', 'order', 'product')]
+        few = [self._get(url)[1] for url in urls]
+        self._orders(20)
+        for i in range(20):
+            make_product(f'Ốp lưng {i}', self.phones)
+        self.assertEqual([self._get(url)[1] for url in urls], few)
+
+    def test_prefix_and_fts_search(self):
+        first, second = self._orders(2)
+        items = reverse('admin:shop_orderitem_changelist')
+        response, _ = self._get(f'{items}?q={second.pk}')
+        self.assertEqual(response.context['cl'].result_count, 3)
+        response, _ = self._get(f'{items}?q=điện')
+        self.assertEqual(response.context['cl'].result_count, 6)
+        orders = reverse('admin:shop_order_changelist')
+        response, _ = self._get(f'{orders}?q=0900000001')
+        self.assertEqual([o.pk for o in response.context['cl'].result_list], [second.pk])
+        response, _ = self._get(f'{orders}?q=nguyễn')
+        self.assertEqual(response.context['cl'].result_count, 2)
+        response, _ = self._get(f'{reverse("admin:shop_product_changelist")}?q=dien thoai 2')
+        self.assertEqual([p.pk for p in response.context['cl'].result_list], [self.products[2].pk])
+        # Only the page of rows is projected (list_only), not the action queryset.
+        self.assertIn('description', response.context['cl'].result_list[0].get_deferred_fields())
+        self.assertEqual(response.context['cl'].get_queryset(response.wsgi_request).query.deferred_loading[0], set())
+
+    def test_unfiltered_big_tables_get_an_estimated_count(self):
+        self._orders(3)
+        OrderItem.objects.filter(pk=OrderItem.objects.order_by('pk')[1].pk).delete()
+        url = reverse('admin:shop_orderitem_changelist')
+        with mock.patch('shop.changelists.ESTIMATE_ABOVE', 1):
+            response, _ = self._get(url)
+            self.assertEqual(response.context['cl'].result_count, 9)
+            response, _ = self._get(f'{url}?quantity=1')
+            self.assertEqual(response.context['cl'].result_count, 8)
+        response, _ = self._get(url)
+        self.assertEqual(response.context['cl'].result_count, 8)
+
+
+class ExportTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.phone = make_product('Điện thoại', stock=100)
+        self.case = make_product('Ốp lưng', stock=100, is_active=False)
+        import_orders([
+            {'customer_name': f'Khách {i}', 'phone': '1', 'address': 'HN', 'status': status,
+             'items': [(self.phone.pk, 1), (self.case.pk, 2)] if i % 2 else [(self.phone.pk, i + 1)]}
+            for i, status in enumerate(['new', 'done', 'done', 'cancel', 'done'])
+        ])
+        self.order_ids = list(Order.objects.order_by('pk').values_list('pk', flat=True))
+
+    def test_csv_has_a_line_per_item_and_queries_grow_per_chunk_only(self):
+        export = exports.Export('orders', 'csv', chunk_size=2)
+        with CaptureQueriesContext(connection) as ctx:
+            rows = list(csv.reader(''.join(export).splitlines()))
+        # One cursor over the orders plus one item prefetch per chunk of two.
+        self.assertEqual(len(ctx.captured_queries), 1 + 3)
+        self.assertEqual(rows[0], list(exports.ORDER_FIELDS + exports.ITEM_FIELDS))
+        self.assertEqual(len(rows), 1 + 7)
+        self.assertEqual((export.count, export.last_id), (5, self.order_ids[-1]))
+        self.assertEqual(rows[2][exports.ORDER_FIELDS.index('id')], str(self.order_ids[1]))
+        self.assertEqual(rows[2][len(exports.ORDER_FIELDS) + exports.ITEM_FIELDS.index('product_name')], 'Điện thoại')
+
+    def test_jsonl_filters_and_resume(self):
+        lines = list(exports.Export('orders', 'jsonl', statuses=['done'], after_id=self.order_ids[1]))
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([r['id'] for r in records], self.order_ids[2::2])
+        self.assertEqual(records[0]['items'], [
+            {'product_id': self.phone.pk, 'product_name': 'Điện thoại', 'quantity': 3,
+             'unit_price': '100000.00', 'line_total': '300000.00'},
+        ])
+        today = timezone.localdate()
+        self.assertEqual(len(list(exports.Export('orders', 'jsonl', since=today, until=today))), 5)
+        self.assertEqual(list(exports.Export('orders', 'jsonl', until=today - timedelta(days=1))), [])
+        products = [json.loads(line) for line in exports.Export('products', 'jsonl', statuses=['inactive'])]
+        self.assertEqual([p['id'] for p in products], [self.case.pk])
+        with self.assertRaises(ValueError):
+            exports.Export('orders', 'csv', statuses=['lost'])
+
+    def test_command_resumes_into_the_same_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'products.csv')
+        err = StringIO()
+        call_command('export_data', 'products', '--output', path, stderr=err)
+        self.assertIn('Exported 2 products', err.getvalue())
+        product = make_product('Tai nghe')
+        call_command('export_data', 'products', '--output', path, '--append',
+                     '--after-id', str(self.case.pk), stderr=StringIO())
+        with open(path, encoding='utf-8', newline='') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual([row[0] for row in rows], ['id', str(self.phone.pk), str(self.case.pk), str(product.pk)])
+
+    def test_admin_action_streams(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        response = self.client.post(reverse('admin:shop_order_changelist'), {
+            'action': 'export_jsonl', '_selected_action': self.order_ids,
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="orders-', response['Content-Disposition'])
+        # The changelist's list_only projection must not reach the export,
+        # or every order fetches its deferred fields on its own.
+        with CaptureQueriesContext(connection) as ctx:
+            records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertEqual([r['id'] for r in records], self.order_ids)
+        self.assertEqual(records[0]['address'], 'HN')
+
+
+class CatalogImportTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.phones = Category.objects.create(name='Điện thoại')
+        self.old = make_product('Tai nghe', self.phones, slug='tai-nghe', stock=5, description='Cũ')
+
+    def _import(self, text, fmt='csv', **kwargs):
+        return imports.import_catalog(StringIO(text), fmt, **kwargs)
+
+    def test_creates_with_unique_slugs_and_categories(self):
+        report = self._import(
+            'name,price,category,stock\n'
+            'Tai nghe,150000,điện thoại,3\n'
+            'Tai nghe,160000,Phụ kiện,4\n'
+            'Sạc nhanh,90000,phu-kien,\n',
+            batch_size=2,
+        )
+        self.assertEqual((report.created, report.updated, report.error_count), (3, 0, 0))
+        products = Product.objects.exclude(pk=self.old.pk).order_by('pk')
+        self.assertEqual([p.slug for p in products], ['tai-nghe-2', 'tai-nghe-3', 'sac-nhanh'])
+        accessories = Category.objects.get(name='Phụ kiện')
+        self.assertEqual([p.category_id for p in products], [self.phones.pk, accessories.pk, accessories.pk])
+        self.assertEqual(products[2].stock, 0)
+        self.assertTrue(products[2].is_active)
+        self.assertIsNotNone(products[2].created_at)
+        self.assertEqual([p.pk for p in search.search_products(Product.objects.all(), 'sac nhanh')], [products[2].pk])
+
+    def test_out_of_range_decimals_and_alike_categories_are_row_errors(self):
+        report = self._import(
+            'name,price,category\n'
+            'Quá đắt,1e30,\n'
+            'Quá dài,12345678901234567890.123,\n'
+            'Ốp lưng,50000,Phu kien\n'
+            'Cáp sạc,60000,Phụ kiện\n',
+        )
+        self.assertEqual((report.created, report.error_count), (2, 2))
+        self.assertEqual([line for line, _ in report.errors], [2, 3])
+        self.assertIn('price', report.errors[0][1])
+        self.assertEqual(Category.objects.filter(slug='phu-kien').count(), 1)
+        self.assertEqual(
+            Product.objects.filter(category__slug='phu-kien').count(), 2,
+        )
+
+    def test_batches_written_before_a_failure_still_invalidate_the_homepage(self):
+        make_product('Tai nghe 2', slug='tai-nghe-2')
+        version = region_cache.catalog_version()
+        index_products = search.index_products
+        calls = []
+
+        def fail_second_batch(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise OperationalError('disk I/O error')
+            index_products(*args, **kwargs)
+
+        with mock.patch('shop.imports.search.index_products', fail_second_batch), \
+                self.captureOnCommitCallbacks(execute=True), self.assertRaises(OperationalError):
+            self._import('slug,stock\ntai-nghe,9\ntai-nghe-2,9\n', batch_size=1)
+        self.assertEqual(Product.objects.get(pk=self.old.pk).stock, 9)
+        self.assertNotEqual(region_cache.catalog_version(), version)
+
+    def test_update_writes_only_given_columns(self):
+        get_snapshots([self.old.pk])
+        report = self._import('{"slug": "tai-nghe", "price": "120000.50"}\n', fmt='jsonl')
+        self.assertEqual((report.created, report.updated), (0, 1))
+        self.old.refresh_from_db()
+        self.assertEqual((self.old.price, self.old.stock, self.old.description), (Decimal('120000.50'), 5, 'Cũ'))
+        self.assertEqual(get_snapshots([self.old.pk])[self.old.pk].price, Decimal('120000.50'))
+        self.assertEqual(self.old.effective_price, Decimal('120000.50'))
+
+    def test_rejects_invalid_rows_with_line_numbers(self):
+        report = self._import(
+            'name,price,stock,category\n'
+            'Ốp lưng,abc,1,\n'
+            ',100,1,\n'
+            'Cáp,100,-1,\n'
+            'Pin,100,1,Máy ảnh\n'
+            'Loa,100,1,\n',
+            create_categories=False,
+        )
+        self.assertEqual((report.created, report.error_count), (1, 4))
+        self.assertEqual([line for line, _ in report.errors], [2, 3, 4, 5])
+        self.assertIn('price', report.errors[0][1])
+        self.assertIn('required', report.errors[1][1])
+        self.assertIn('negative', report.errors[2][1])
+        self.assertIn('unknown category', report.errors[3][1])
+        self.assertFalse(Category.objects.filter(name='Máy ảnh').exists())
+
+    def test_command_and_admin_upload(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'catalog.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('slug,stock\ntai-nghe,42\nkhong-co,1\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, stdout=out, stderr=err)
+        self.assertIn('1 updated, 1 rejected', out.getvalue())
+        self.assertIn('line 3: name, price: required', err.getvalue())
+        self.old.refresh_from_db()
+        self.assertEqual(self.old.stock, 42)
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        upload = SimpleUploadedFile('catalog.jsonl', '{"name": "Loa", "price": 200000}\n'.encode())
+        response = self.client.post(reverse('admin:shop_product_import'), {'file': upload, 'create_categories': 'on'})
+        self.assertRedirects(response, reverse('admin:shop_product_changelist'))
+        self.assertTrue(Product.objects.filter(slug='loa', price=200000).exists())
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImagePipelineTests(ShopTestCase):
+    """Against a local stand-in for the image hosts."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        buffer = BytesIO()
+        Image.new('RGB', (600, 400), '#ee4d2d').save(buffer, 'PNG')
+        cls.png = buffer.getvalue()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _ImageHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.host = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.server.hits = []
+        self.server.files = {'/photo.png': self.png, '/copy.png': self.png, '/broken.png': b'<html>'}
+        self.photo = f'{self.host}/photo.png'
+
+    def _picture(self, url, preset='card'):
+        return Template("{% load shop_images %}{% picture url preset alt='Ảnh' %}").render(
+            Context({'url': url, 'preset': preset}),
+        )
+
+    def test_process_makes_content_hashed_variants_once(self):
+        source = images.process(self.photo, ['card'])
+        self.assertEqual((source.status, source.width, source.height, source.presets), ('ready', 600, 400, 'card'))
+        self.assertEqual(images.widths('card', 600), [160, 240, 320, 480])
+        for width in images.widths('card', 600):
+            for fmt in images.formats():
+                self.assertTrue(default_storage.exists(images.variant_name(source.content_hash, width, fmt)))
+        with default_storage.open(images.variant_name(source.content_hash, 240, 'webp')) as f:
+            self.assertEqual(Image.open(f).size, (240, 160))
+
+        copy = images.process(f'{self.host}/copy.png', ['card'])
+        self.assertEqual(copy.content_hash, source.content_hash)
+        source = images.process(self.photo, ['card', 'tile'])
+        self.assertEqual(source.preset_names, ['card', 'tile'])
+        self.assertEqual(self.server.hits, ['/photo.png', '/copy.png'])
+        self.assertEqual(images.widths('tile', 600), [44, 88])
+        self.assertEqual(images.widths('banner', 600), [480, 600])
+
+    def test_tag_goes_through_proxy_until_processed(self):
+        proxy = images.proxy_url(self.photo, 'card')
+        self.assertIn(f'src="{proxy}"', self._picture(self.photo))
+        response = self.client.get(proxy)
+        source = SourceImage.objects.get(url=self.photo)
+        self.assertRedirects(response, images.variant_url(source.content_hash, 320, 'webp'),
+                             fetch_redirect_response=False)
+
+        html = self._picture(self.photo)
+        self.assertIn('<picture><source type="image/avif" srcset="/media/images/', html)
+        self.assertIn('480w" sizes="(min-width: 992px) 240px, 50vw">', html)
+        self.assertIn('width="320" height="213" alt="Ảnh" loading="lazy"', html)
+        self.assertIn(f'src="{images.proxy_url(self.photo, "detail")}"', self._picture(self.photo, 'detail'))
+        self.assertEqual(self._picture('/static/logo.png'),
+                         '<img src="/static/logo.png" alt="Ảnh" loading="lazy" decoding="async">')
+        self.assertEqual(self.client.get(proxy[:-2] + 'x/').status_code, 404)
+
+    def test_failed_sources_stay_hotlinked_without_refetching(self):
+        for path in ('/broken.png', '/missing.png'):
+            url = f'{self.host}{path}'
+            response = self.client.get(images.proxy_url(url, 'card'))
+            self.assertRedirects(response, url, fetch_redirect_response=False)
+            self.assertIn(f'src="{url}"', self._picture(url))
+            self.client.get(images.proxy_url(url, 'card'))
+        self.assertEqual(self.server.hits, ['/broken.png', '/missing.png'])
+        self.assertIn('not an image', SourceImage.objects.get(url=f'{self.host}/broken.png').error)
+
+    def test_command_warms_catalog_images(self):
+        Category.objects.create(name='Áo', image_url=self.photo)
+        make_product('Áo thun', image_url=f'{self.host}/copy.png')
+        Banner.objects.create(title='Sale', image_url=f'{self.host}/missing.png', is_featured=True)
+        out, err = StringIO(), StringIO()
+        call_command('process_images', stdout=out, stderr=err)
+        self.assertIn('2 images ready, 1 failed', out.getvalue())
+        self.assertIn('missing.png', err.getvalue())
+        self.assertEqual(SourceImage.objects.get(url=self.photo).preset_names, ['tile'])
+        self.assertEqual(SourceImage.objects.get(url=f'{self.host}/copy.png').preset_names,
+                         ['card', 'cart', 'detail', 'tile'])
+
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.content.decode().count('<picture>'), 2)
+        self.server.files['/missing.png'] = self.png
+        call_command('process_images', '--retry-failed', stdout=out, stderr=err)
+        self.assertEqual(SourceImage.objects.get(url=f'{self.host}/missing.png').status, 'ready')
+
+
+class StaticAssetTests(ShopTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        cls.root = directory.name
+        cls.enterClassContext(override_settings(STATIC_ROOT=cls.root))
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.styles = staticfiles_storage.stored_name('css/styles.css')
+
+    def _get(self, path, method='GET', **headers):
+        def fallback(environ, start_response):
+            start_response('404 Not Found', [])
+            return [b'django']
+
+        app = StaticFilesApp(fallback, root=self.root, prefix='/static/')
+        response = {}
+
+        def start_response(status, response_headers):
+            response['status'] = int(status.split()[0])
+            response['headers'] = dict(response_headers)
+
+        body = b''.join(app({'PATH_INFO': path, 'REQUEST_METHOD': method, **headers}, start_response))
+        return response['status'], response['headers'], body
+
+    def test_collectstatic_fingerprints_and_precompresses(self):
+        self.assertRegex(self.styles, r'^css/styles\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(self.root, self.styles), 'rb') as f:
+            original = f.read()
+        with open(os.path.join(self.root, self.styles + '.gz'), 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), original)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'css/styles.css.gz')))
+
+        html = self.client.get(reverse('home')).content.decode()
+        self.assertIn(f'href="/static/{self.styles}"', html)
+        self.assertIn('.category-thumb {', html)
+
+    def test_wsgi_layer_serves_precompressed_immutable_files(self):
+        status, headers, body = self._get(f'/static/{self.styles}', HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(headers['Content-Type'], 'text/css; charset=utf-8')
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        plain = gzip.decompress(body)
+
+        status, identity_headers, body = self._get(f'/static/{self.styles}')
+        self.assertNotIn('Content-Encoding', identity_headers)
+        self.assertEqual(body, plain)
+        self.assertNotEqual(identity_headers['ETag'], headers['ETag'])
+
+        status, _, body = self._get(f'/static/{self.styles}', HTTP_ACCEPT_ENCODING='gzip',
+                                    HTTP_IF_NONE_MATCH=headers['ETag'])
+        self.assertEqual((status, body), (304, b''))
+        status, headers, _ = self._get('/static/css/styles.css')
+        self.assertEqual(headers['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(self._get('/static/css/missing.css'), (404, {}, b'django'))
+        self.assertEqual(self._get(f'/static/{self.styles}', method='POST')[0], 405)
+        self.assertEqual(self._get(f'/static/{self.styles}', method='HEAD')[2], b'')
@@ -1,13 +1,24 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Read-only storefront pages: async variants under ASGI (SHOP_ASYNC_VIEWS).
+if getattr(settings, 'SHOP_ASYNC_VIEWS', False):
+    from . import async_views as storefront
+else:
+    storefront = views
+
 urlpatterns = [
-    path('', views.home_view, name='home'),
+    path('', storefront.home_view, name='home'),
+    path('products.json', storefront.product_list_json, name='product_list_json'),
     path('cart/', views.cart_view, name='cart_view'),
     path ('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path ('cart/remove/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
     path ('cart/clear/', views.clear_cart, name='clear_cart'),
     path ('cart/update/<int:product_id>/', views.update_cart, name='update_cart'),
-    path ( 'product/<slug:slug>/', views.product_detail_view, name='product_detail' ),
+    path ( 'product/<slug:slug>/', storefront.product_detail_view, name='product_detail' ),
     path('checkout/', views.checkout_view, name='checkout'),
+    path('orders/<str:number>.json', views.order_status_json, name='order_status_json'),
+    path('orders/<str:number>/', views.order_pending_view, name='order_pending'),
+    path('images/<str:token>/', views.image_proxy_view, name='image_proxy'),
 ]
@@ -1,17 +1,33 @@
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login, logout as auth_logout
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.signing import BadSignature
+from django.core.paginator import Paginator, Page, EmptyPage, PageNotAnInteger
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 import json
-from django.db.models import Q
+from urllib.parse import quote, urlencode
 from django.db.utils import OperationalError, ProgrammingError
 from django.utils import timezone
 from decimal import Decimal
 
 POPUP_VERSION = str(timezone.now().timestamp())
 
+from .cache import catalog_version, get_regions
+from .conditional import conditional_page, home_validators, product_validators
+from .db import is_busy, storefront_reads
+from . import images
+from .flash_sales import build_strip, get_timeline, strip_region_name
 from .forms import RegisterForm , CheckoutForm
+from .inventory import InsufficientStock
+from .orders import create_order, quote_cart, quote_lines
+from .order_queue import enqueue_order, order_status
+from .pricing import get_snapshot, get_snapshots
+from .pagination import InvalidCursor, KeysetPage, cached_count, keyset_page
+from .related import RELATED_SIZE, related_products
+from .search import search_products
 from .models import Product, Category, Banner , Order , OrderItem
 from .models import Popup
 from django.shortcuts import render
@@ -22,139 +38,295 @@ def home(request):
         "popup": popup
     })
 
-def home_view(request):
-    query = request.GET.get('q', '').strip()
-    category_slug = request.GET.get('cat', '').strip()
+PRODUCTS_PER_PAGE = 10
+# Homepage grid orderings (?sort=...); each one is served by an index.
+SORTS = {
+    'new': ('-created_at',),
+    'price_asc': ('effective_price', 'id'),
+    'price_desc': ('-effective_price', '-id'),
+    'discount': ('-discount_percent', '-id'),
+}
+# (sort, min_price, max_price)
+DEFAULT_LISTING = ('new', None, None)
 
-    products = []
-    categories = []
 
+def _parse_page_number(value):
     try:
-        qs = Product.objects.filter(is_active=True)
-        if query:
-            qs = qs.filter(Q(name__icontains=query) | Q(description__icontains=query))
-        if category_slug:
-            qs = qs.filter(category__slug=category_slug)
-        categories = list(Category.objects.all())
-
-        if qs.exists():
-            paginator = Paginator(qs.order_by('-created_at'), 10)
-            page_number = request.GET.get('page', 1)
-            try:
-                page_number = int(page_number)
-            except (TypeError, ValueError):
-                page_number = 1
-            if page_number < 1:
-                page_number = 1
-            try:
-                products = paginator.page(page_number)
-            except PageNotAnInteger:
-                products = paginator.page(1)
-            except EmptyPage:
-                products = paginator.page(paginator.num_pages)
-        else:
-            products = []
-
-        if hasattr(products, 'paginator'):
-            home_response = {
-                'page': products.number,
-                'total_pages': products.paginator.num_pages,
-                'product_count': products.paginator.count,
-                'has_next': products.has_next(),
-                'has_previous': products.has_previous(),
-            }
-        else:
-            home_response = {
-                'page': 1,
-                'total_pages': 1,
-                'product_count': len(products),
-                'has_next': False,
-                'has_previous': False,
-            }
-
-        # Build category tiles with thumbnail images (prefer category image, then first product image, else fallback)
-        categories_tiles = []
-        for cat in categories:
-            if getattr(cat, 'image_url', None):
-                thumb = cat.image_url
-            else:
-                first_with_img = Product.objects.filter(is_active=True, category=cat).exclude(image_url="").first()
-                if first_with_img and first_with_img.image_url:
-                    thumb = first_with_img.image_url
-                else:
-                    # Fallback placeholder image with category initial
-                    initial = (cat.name or "?")[:1].upper()
-                    thumb = f"https://via.placeholder.com/100/fff0ec/ee4d2d?text={initial}"
-            categories_tiles.append({
-                'name': cat.name,
-                'slug': cat.slug,
-                'image_url': thumb,
-            })
-        # Get featured banners for carousel
-        banners = list(Banner.objects.filter(is_active=True, is_featured=True))
-        # Flash sale products
-        now = timezone.now()
-        flash_qs = Product.objects.filter(
-            is_active=True,
-            flash_sale_price__isnull=False,
-            flash_sale_start__lte=now,
-            flash_sale_end__gte=now,
-        ).exclude(flash_sale_price=0)
-        flash_sale_products = list(flash_qs.order_by('flash_sale_end')[:20])
-        flash_sale_ends_at = None
-        if flash_sale_products:
-            flash_sale_ends_at = min([p.flash_sale_end for p in flash_sale_products if p.flash_sale_end])
-    except (OperationalError, ProgrammingError):
-        messages.warning(
-            request,
-            "Cơ sở dữ liệu chưa được khởi tạo. Vui lòng chạy lệnh: python manage.py migrate rồi khởi động lại server."
-        )
-        categories_tiles = []
-        banners = []
+        page_number = int(value)
+    except (TypeError, ValueError):
+        page_number = 1
+    return max(page_number, 1)
 
-    context = {
+
+def _product_page_region(qs, page_number):
+    """Evaluate one grid page into a picklable dict (no queryset references)."""
+    paginator = Paginator(qs, PRODUCTS_PER_PAGE)
+    if not paginator.count:
+        return {'object_list': [], 'number': 1, 'count': 0}
+    try:
+        page = paginator.page(page_number)
+    except (PageNotAnInteger, EmptyPage):
+        page = paginator.page(paginator.num_pages)
+    return {'object_list': list(page.object_list), 'number': page.number, 'count': paginator.count}
+
+
+def _page_from_region(region):
+    if not region['count']:
+        return []
+    # range() gives the paginator a length without touching the database.
+    paginator = Paginator(range(region['count']), PRODUCTS_PER_PAGE)
+    return Page(region['object_list'], region['number'], paginator)
+
+
+def _category_tiles(categories):
+    # Build category tiles with thumbnail images (prefer category image, then first product image, else fallback)
+    categories_tiles = []
+    for cat in categories:
+        thumb = cat.image_url or cat.thumbnail_url
+        if not thumb:
+            # Fallback placeholder image with category initial, drawn locally
+            thumb = images.placeholder_url((cat.name or "?")[:1].upper())
+        categories_tiles.append({
+            'name': cat.name,
+            'slug': cat.slug,
+            'image_url': thumb,
+        })
+    return categories_tiles
+
+
+def _parse_price(value):
+    try:
+        price = Decimal(value)
+    except (TypeError, ArithmeticError):
+        return None
+    return price if price.is_finite() and 0 <= price < 10 ** 10 else None
+
+
+def _listing_params(request):
+    sort = request.GET.get('sort', '').strip()
+    return (
+        sort if sort in SORTS else 'new',
+        _parse_price(request.GET.get('min_price', '').strip()),
+        _parse_price(request.GET.get('max_price', '').strip()),
+    )
+
+
+def _storefront_products(query, category_slug, listing=DEFAULT_LISTING):
+    sort, min_price, max_price = listing
+    qs = Product.objects.filter(is_active=True).order_by('-created_at')
+    # Filter and sort on the denormalised current price, not price /
+    # flash_sale_price, so the (category,) effective_price indexes apply.
+    if min_price is not None:
+        qs = qs.filter(effective_price__gte=min_price)
+    if max_price is not None:
+        qs = qs.filter(effective_price__lte=max_price)
+    if query:
+        qs = search_products(qs, query)
+    if category_slug:
+        qs = qs.filter(category__slug=category_slug)
+    if sort != 'new':
+        qs = qs.order_by(*SORTS[sort])
+    return qs
+
+
+def _product_payload(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'slug': product.slug,
+        'url': reverse('product_detail', args=[product.slug]),
+        'price': str(product.price),
+        'flash_sale_price': str(product.flash_sale_price) if product.is_in_flash_sale else None,
+        'effective_price': str(product.effective_price),
+        'discount_percent': product.discount_percent,
+        'image_url': product.image_url,
+        'is_hot': product.is_hot,
+        'is_best_seller': product.is_best_seller,
+    }
+
+
+def _home_params(request):
+    listing = _listing_params(request)
+    return (
+        request.GET.get('q', '').strip(),
+        request.GET.get('cat', '').strip(),
+        listing,
+        _parse_page_number(request.GET.get('page', 1)),
+        # Cursors hold a created_at position, so other sorts page by number.
+        request.GET.get('cursor', '').strip() if listing[0] == 'new' else '',
+    )
+
+
+def _home_builders(qs, query, category_slug, listing, page_number, cursor):
+    """Region builders for the homepage, as two stages.
+
+    Regions in the first stage are independent of each other; the second
+    stage may use regions from the first. ``home_view`` builds them in order,
+    ``async_views.home_view`` builds each stage concurrently. Returns
+    ``(stages, grid_region)``; grid_region is None when the product grid
+    is not cached (searches and cursor pages).
+    """
+    first = {
+        'category_sidebar': lambda regions: list(Category.objects.with_thumbnail()),
+        'banner_carousel': lambda regions: list(Banner.objects.filter(is_active=True, is_featured=True)),
+        'popup': lambda regions: Popup.objects.filter(is_active=True).select_related('product').first(),
+    }
+    second = {
+        'category_tiles': lambda regions: _category_tiles(regions['category_sidebar']),
+    }
+    # Search results are too varied to be worth caching; plain listing pages are.
+    grid_region = None
+    if not query and not cursor:
+        grid_region = f'product_grid:{quote(category_slug)}:{page_number}'
+        if listing != DEFAULT_LISTING:
+            grid_region += ':' + ':'.join(str(value or '') for value in listing)
+        first[grid_region] = lambda regions: _product_page_region(qs, page_number)
+    return [first, second], grid_region
+
+
+def _home_listing(qs, page_number, cursor):
+    """The product grid when it is not a cached region (search or cursor mode)."""
+    if cursor:
+        try:
+            return keyset_page(qs, cursor, PRODUCTS_PER_PAGE)
+        except InvalidCursor:
+            return keyset_page(qs, None, PRODUCTS_PER_PAGE)
+    return _page_from_region(_product_page_region(qs, page_number))
+
+
+def _grid_query(query, category_slug, listing):
+    """The grid's filters as ``&``-prefixed query string parameters, for page links."""
+    sort, min_price, max_price = listing
+    params = {'q': query, 'cat': category_slug, 'sort': sort if sort != 'new' else '',
+              'min_price': min_price, 'max_price': max_price}
+    params = {name: value for name, value in params.items() if value not in ('', None)}
+    return '&' + urlencode(params) if params else ''
+
+
+def _home_context(products, regions, flash_sale, query, category_slug, listing=DEFAULT_LISTING):
+    if isinstance(products, KeysetPage):
+        home_response = {
+            'page': None,
+            'total_pages': None,
+            'product_count': None,
+            'has_next': products.has_next(),
+            'has_previous': products.has_previous(),
+        }
+    elif products:
+        home_response = {
+            'page': products.number,
+            'total_pages': products.paginator.num_pages,
+            'product_count': products.paginator.count,
+            'has_next': products.has_next(),
+            'has_previous': products.has_previous(),
+        }
+    else:
+        home_response = {
+            'page': 1,
+            'total_pages': 1,
+            'product_count': 0,
+            'has_next': False,
+            'has_previous': False,
+        }
+
+    return {
         'products': products,
-        'categories': categories,
-        'categories_tiles': categories_tiles,
-        'banners': banners,
-        'flash_sale_products': flash_sale_products if 'flash_sale_products' in locals() else [],
-        'flash_sale_ends_at': flash_sale_ends_at if 'flash_sale_ends_at' in locals() else None,
+        'categories': regions.get('category_sidebar', []),
+        'categories_tiles': regions.get('category_tiles', []),
+        'banners': regions.get('banner_carousel', []),
+        'flash_sale_products': flash_sale.get('products', []),
+        'flash_sale_ends_at': flash_sale.get('ends_at'),
         'current_query': query,
         'current_category': category_slug,
-        'popup': Popup.objects.filter(is_active=True).first(),
+        'current_sort': listing[0],
+        'min_price': listing[1],
+        'max_price': listing[2],
+        'grid_query': _grid_query(query, category_slug, listing),
+        'popup': regions.get('popup'),
         'popup_version': POPUP_VERSION,
         'home_response': json.dumps({
             'query': query,
             'category': category_slug,
+            'sort': listing[0],
             'page': home_response.get('page'),
             'total_pages': home_response.get('total_pages'),
             'product_count': home_response.get('product_count'),
             'has_next': home_response.get('has_next'),
             'has_previous': home_response.get('has_previous'),
+            'next_cursor': getattr(products, 'next_cursor', None),
         }),
     }
+
+
+DATABASE_NOT_READY = "Cơ sở dữ liệu chưa được khởi tạo. Vui lòng chạy lệnh: python manage.py migrate rồi khởi động lại server."
+
+
+@storefront_reads
+@conditional_page(home_validators)
+def home_view(request):
+    query, category_slug, listing, page_number, cursor = _home_params(request)
+    qs = _storefront_products(query, category_slug, listing)
+    stages, grid_region = _home_builders(qs, query, category_slug, listing, page_number, cursor)
+
+    regions = {}
+    flash_sale = {}
+    try:
+        now = timezone.now()
+        version = catalog_version()
+        timeline = get_timeline(version)
+        strip_region = strip_region_name(timeline, now)
+        stages[0][strip_region] = lambda regions: build_strip(timeline, now)
+        builders = {name: build for stage in stages for name, build in stage.items()}
+        regions = get_regions(builders, version, expires_at=timeline.next_transition(now))
+        flash_sale = regions[strip_region]
+        if grid_region:
+            products = _page_from_region(regions[grid_region])
+        else:
+            products = _home_listing(qs, page_number, cursor)
+    except (OperationalError, ProgrammingError) as exc:
+        if is_busy(exc):
+            # A lock timeout is a real failure, not an unmigrated database.
+            raise
+        messages.warning(request, DATABASE_NOT_READY)
+        products = []
+
+    context = _home_context(products, regions, flash_sale, query, category_slug, listing)
     return render(request, 'shop/home.html', context)
 
-def _effective_price(product: Product):
+
+@storefront_reads
+def product_list_json(request):
+    """Cursor-paginated product listing for infinite-scroll clients.
+
+    Takes the same ``q``/``cat`` filters as the homepage plus ``cursor``; the
+    total is an approximate count cached per catalog version.
+    """
+    query = request.GET.get('q', '').strip()
+    category_slug = request.GET.get('cat', '').strip()
+    qs = _storefront_products(query, category_slug)
     try:
-        if getattr(product, 'flash_sale_price', False) and getattr(product, 'flash_sale_price', None):
-            return product.flash_sale_price
-    except Exception:
-        pass
-    return product.price
-
-CART_SESSION_KEY = 'cart'
-
-def _get_cart(session):
-    return session.get(CART_SESSION_KEY, {})
-def _save_cart(session, cart):
-    session[CART_SESSION_KEY] = cart
-    session.modified = True
-    
+        page = keyset_page(qs, request.GET.get('cursor', '').strip() or None, PRODUCTS_PER_PAGE)
+    except InvalidCursor:
+        return JsonResponse({'error': 'invalid cursor'}, status=400)
+    product_count = cached_count(qs, f'{quote(query)}:{quote(category_slug)}')
+    return JsonResponse({
+        'query': query,
+        'category': category_slug,
+        'product_count': product_count,
+        'total_pages': max(1, -(-product_count // PRODUCTS_PER_PAGE)),
+        'has_next': page.has_next(),
+        'next_cursor': page.next_cursor,
+        'products': [_product_payload(p) for p in page],
+    })
+
 def add_to_cart(request, product_id):
+    product = get_snapshot(product_id)
+    if not product:
+        raise Http404('Sản phẩm không tồn tại.')
     if request.method != 'POST':
-        return redirect('product_detail' , slug=get_object_or_404(Product, id=product_id).slug)
-    product = get_object_or_404(Product, id=product_id, is_active=True)
+        return redirect('product_detail' , slug=product.slug)
+    if not product.is_active:
+        raise Http404('Sản phẩm không tồn tại.')
     try:
         qty = int(request.POST.get('qty', '1'))
     except ValueError:
@@ -166,13 +338,11 @@ def add_to_cart(request, product_id):
         next_url = request.POST.get('next') or request.META.get('HTTP_REFERER') or '/'
         return redirect(next_url)
     
-    cart = _get_cart(request.session)
-    key = str(product.id)
-    current = int(cart.get(key, 0))
+    cart = request.cart
+    current = cart.quantity(product.id)
     max_allowed = int(product.stock) if product.stock is not None else 9999
     new_qty = min(current + qty, max_allowed, 999)
-    cart[key] = new_qty
-    _save_cart(request.session, cart)
+    cart.set(product.id, new_qty)
     if new_qty < current + qty:
         messages.warning(request, f'Số lượng sản phẩm trong giỏ đã đạt tối đa ({max_allowed}).')
     else:
@@ -181,30 +351,9 @@ def add_to_cart(request, product_id):
     return redirect(next_url)
 
 def cart_view(request):
-    cart = _get_cart(request.session)
-    items = []
-    total = Decimal('0')
-    if cart:
-        # Fetch products in one query
-        ids = [int(i) for i in cart.keys()]
-        products = {p.id: p for p in Product.objects.filter(id__in=ids)}
-        for sid, qty in cart.items():
-            pid = int(sid)
-            p = products.get(pid)
-            if not p:
-                continue
-            unit_price = _effective_price(p) or Decimal('0')
-            subtotal = unit_price * int(qty)
-            total += subtotal
-            is_discounted = bool(getattr(p, 'is_in_flash_sale', False) and getattr(p, 'flash_sale_price', None))
-            items.append({
-                'product': p,
-                'qty': int(qty),
-                'unit_price': unit_price,
-                'orig_price': p.price,
-                'is_discounted': is_discounted,
-                'subtotal': subtotal,
-            })
+    cart = request.cart
+    # Display only: prices come from cached snapshots, checkout re-validates.
+    items, total = quote_lines(get_snapshots(cart.lines), cart.items()) if cart else ([], Decimal('0'))
     context = {
         'items': items,
         'total': total,
@@ -213,59 +362,67 @@ def cart_view(request):
 
 def update_cart(request, product_id):
     if request.method != 'POST':
-        return redirect('cart')
+        return redirect('cart_view')
     try:
         qty = int(request.POST.get('qty', '1'))
     except ValueError:
         qty = 1
     qty = max(0, min(qty, 999))
-    cart = _get_cart(request.session)
-    key = str(int(product_id))
+    cart = request.cart
     
-    product = Product.objects.filter(id=product_id, is_active=True).first()
-    if not product:
-        cart.pop(key, None)
-        _save_cart(request.session, cart)
+    product = get_snapshot(product_id)
+    if not product or not product.is_active:
+        cart.remove(product_id)
         messages.error(request, 'Sản phẩm không tồn tại.')
-        return redirect('cart')
+        return redirect('cart_view')
     
     if qty <= 0:
-        cart.pop(key, None)
+        cart.remove(product_id)
         messages.info(request, f'Đã xóa "{product.name}" khỏi giỏ hàng.')
     else:
         max_allowed = int(product.stock) if product.stock is not None else 9999
         if product.stock is not None and product.stock<=0:
-            cart.pop(key, None)
+            cart.remove(product_id)
             messages.error(request, 'Sản phẩm hiện đã hết hàng.')
         else:
             if qty > max_allowed:
                 qty = max_allowed
                 messages.warning(request, f'Số lượng sản phẩm trong giỏ đã đạt tối đa ({max_allowed}).')
-                cart[key] = qty
-    _save_cart(request.session, cart)
+            cart.set(product_id, qty)
     return redirect('cart_view')
 
 def remove_from_cart(request, product_id):
-    cart = _get_cart(request.session)
-    cart.pop(str(int(product_id)), None)
-    _save_cart(request.session, cart)
+    request.cart.remove(product_id)
     return redirect('cart_view')
 
 def clear_cart(request):
-    _save_cart(request.session, {})
+    request.cart.clear()
     return redirect('cart_view')
                             
                    
+@storefront_reads
+@conditional_page(product_validators)
 def product_detail_view(request, slug):
-    product = get_object_or_404(Product, slug=slug, is_active=True)
-    # Gợi ý sản phẩm cùng danh mục (nếu có)
-    related = Product.objects.filter(is_active=True, category=product.category).exclude(id=product.id)[:8]
+    product = get_object_or_404(Product.objects.select_related('related_list'), slug=slug, is_active=True)
+    related = related_products(product)
+    if not related:
+        # Chưa có gợi ý tính sẵn (sản phẩm mới): lấy sản phẩm cùng danh mục
+        related = Product.objects.filter(is_active=True, category=product.category).exclude(id=product.id)[:RELATED_SIZE]
     context = {
         'product': product,
         'related_products': related,
     }
     return render(request, 'shop/product_detail.html', context)
 
+def image_proxy_view(request, token):
+    """Redirect to a local thumbnail of a signed source URL, making it on first use."""
+    try:
+        url, preset = images.read_token(token)
+    except BadSignature:
+        raise Http404
+    return redirect(images.redirect_url(url, preset))
+
+
 def logout_view(request):
     if request.method in ('POST', 'GET'):
         auth_logout(request)
@@ -294,51 +451,36 @@ def register_view(request):
 
 
 def checkout_view(request):
-    cart  =  _get_cart(request.session)
+    cart = request.cart
     if not cart:
         messages.warning(request, 'Giỏ hàng của bạn đang trống.')
         return redirect('cart_view')
     
-    items = []
-    total = Decimal('0')
-    ids = [int(i) for i in cart.keys()]
-    products = {p.id: p for p in Product.objects.filter(id__in=ids)}
-    for sid, qty in cart.items():
-        pid = int(sid)
-        p = products.get(pid)
-        if not p:
-            continue
-        unit_price = _effective_price(p) or Decimal('0')
-        subtotal = unit_price * int(qty)
-        total += subtotal
-        items.append({
-            'product': p,
-            'qty': int(qty),
-            'unit_price': unit_price,
-            'subtotal': subtotal,
-        })
-        
+    items, total = quote_cart(cart.lines)
+
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
             order = form.save(commit=False)
             if request.user.is_authenticated:
                 order.user = request.user
-            order.total_amount = total
             order.status = 'new'
-            order.save()
-            # Save order items
-            for item in items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item['product'],
-                    product_name=item['product'].name,
-                    quantity=item['qty'],
-                    unit_price=item['unit_price'],
-                    line_total=item['subtotal'],
+            queued = getattr(settings, 'SHOP_ORDER_INTAKE', 'direct') == 'queued'
+            try:
+                if queued:
+                    pending = enqueue_order(order, items)
+                else:
+                    create_order(order, items)
+            except InsufficientStock as exc:
+                messages.error(
+                    request,
+                    f'Sản phẩm "{exc.product.name}" không đủ hàng hoặc đã thay đổi giá. Vui lòng kiểm tra lại giỏ hàng.'
                 )
+                return redirect('cart_view')
             # Clear cart
-            _save_cart(request.session, {})
+            cart.clear()
+            if queued:
+                return redirect('order_pending', number=pending.number)
             messages.success(request, 'Đặt hàng thành công! Cảm ơn bạn đã mua sắm.')
             return redirect('home')
         else:
@@ -355,4 +497,18 @@ def checkout_view(request):
         'form': form,
     }
     
-    return render(request, 'shop/checkout.html', context)
\ No newline at end of file
+    return render(request, 'shop/checkout.html', context)
+
+
+def order_pending_view(request, number):
+    status = order_status(number)
+    if status is None:
+        raise Http404('Không tìm thấy đơn hàng')
+    return render(request, 'shop/order_pending.html', {'order': status})
+
+
+def order_status_json(request, number):
+    status = order_status(number)
+    if status is None:
+        raise Http404('Không tìm thấy đơn hàng')
+    return JsonResponse(status)